@@ -53,11 +53,18 @@ def make_map(config):
 
         # SVM commands.
         connect('startvm', '/servicevm/start', controller='servicevm', action='start')
+        connect('startvm_async', '/servicevm/start_async', controller='servicevm', action='start_async')
+        connect('startvm_status', '/servicevm/start_status', controller='servicevm', action='start_status')
         connect('stopvm', '/servicevm/stop', controller='servicevm', action='stop')
 
         # Migration commands.
         connect('/servicevm/migration_svm_metadata', controller='servicevm', action='migration_svm_metadata')
         connect('/servicevm/migration_svm_disk_file', controller='servicevm', action='migration_svm_disk_file')
+        connect('/servicevm/migration_svm_disk_chunks', controller='servicevm', action='migration_svm_disk_chunks')
+        connect('/servicevm/migration_svm_disk_finish', controller='servicevm', action='migration_svm_disk_finish')
+        connect('/servicevm/migration_svm_disk_status', controller='servicevm', action='migration_svm_disk_status')
+        connect('/servicevm/migration_svm_base_negotiate', controller='servicevm', action='migration_svm_base_negotiate')
+        connect('/servicevm/migration_svm_base_chunks', controller='servicevm', action='migration_svm_base_chunks')
         connect('/servicevm/abort_migration', controller='servicevm', action='abort_migration')
         connect('/servicevm/migration_generate_credentials', controller='servicevm', action='migration_generate_credentials')
         connect('/servicevm/migration_svm_resume', controller='servicevm', action='migration_svm_resume')
@@ -69,5 +76,12 @@ def make_map(config):
         # Metadata commands.
         connect('metadata', '/system', controller='cloudlet', action='metadata')
         connect('get_messages', '/system/get_messages', controller='cloudlet', action='get_messages')
+        connect('warm_pool', '/system/warm_pool', controller='cloudlet', action='warm_pool')
+        connect('hibernation', '/system/hibernation', controller='cloudlet', action='hibernation')
+        connect('prewarm', '/system/prewarm', controller='cloudlet', action='prewarm')
+        connect('ports', '/system/ports', controller='cloudlet', action='ports')
+        connect('hypervisor', '/system/hypervisor', controller='cloudlet', action='hypervisor')
+        connect('traces', '/system/traces', controller='cloudlet', action='traces')
+        connect('metrics', '/system/metrics', controller='cloudlet', action='metrics')
 
     return mapper
@@ -40,7 +40,6 @@ import json
 # Controller to derive from.
 from pycloud.pycloud.pylons.lib.base import BaseController
 from pycloud.pycloud.pylons.lib.util import asjson
-from pycloud.pycloud.utils import timelog
 from pycloud.pycloud.model import App
 
 log = logging.getLogger(__name__)
@@ -61,8 +60,7 @@ class AppPushController(BaseController):
     @asjson
     def GET_getList(self):
         print '\n*************************************************************************************************'
-        timelog.TimeLog.reset()
-        timelog.TimeLog.stamp("Request for stored apps received.")
+        print "Request for stored apps received."
 
         os_name = request.params.get('osName', None)
         os_version = request.params.get('osVersion', None)
@@ -81,8 +79,7 @@ class AppPushController(BaseController):
         apps = App.find(query)
 
         # Send the response.
-        timelog.TimeLog.stamp("Sending response back to " + request.environ['REMOTE_ADDR'])
-        timelog.TimeLog.writeToFile()
+        print "Sending response back to " + request.environ['REMOTE_ADDR']
         return apps
         
     ################################################################################################################
@@ -96,8 +93,7 @@ class AppPushController(BaseController):
             abort(400, '400 Bad Request - must provide app_id')
         
         print '\n*************************************************************************************************'    
-        timelog.TimeLog.reset()
-        timelog.TimeLog.stamp("Request to push app received.")
+        print "Request to push app received."
 
         app = App.by_id(app_id)
         if not app:
@@ -111,8 +107,7 @@ class AppPushController(BaseController):
             abort(404, '404 Not Found - APK for app with id "%s" was not found' % app_id)
 
         # Log that we are responding.
-        timelog.TimeLog.stamp("Sending response back to " + request.environ['REMOTE_ADDR'])
-        timelog.TimeLog.writeToFile()                                
+        print "Sending response back to " + request.environ['REMOTE_ADDR']
 
         # Create a FileApp to return the APK to download. This app will do the actually return execution;
         # this makes the current action a middleware for this app in WSGI definitions.
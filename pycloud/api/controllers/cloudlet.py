@@ -28,31 +28,43 @@
 
 __author__ = 'jdroot'
 
-from pylons import request
+from pylons import request, response
 from pylons.controllers.util import abort
 
 from pycloud.pycloud.pylons.lib.base import BaseController, bool_param
 from pycloud.pycloud.pylons.lib.util import asjson
-from pycloud.pycloud.utils import timelog
 from pycloud.pycloud.cloudlet import Cloudlet
 from pycloud.pycloud.model import Service, App
 
 from pycloud.pycloud.model.message import DeviceMessage
+from pycloud.pycloud.model.warmpool import get_warm_pool_instance
+from pycloud.pycloud.model.hibernation import get_hibernation_manager
+from pycloud.pycloud.model.prewarm import get_prewarmer
+from pycloud.pycloud.utils.portmanager import get_port_manager
+from pycloud.pycloud.vm.hypervisorpool import get_hypervisor_pool
+from pycloud.pycloud.utils.tracing import get_tracer
+from pycloud.pycloud.utils import metrics
 
 
 class CloudletController(BaseController):
 
     # Maps API URL words to actual functions in the controller.
     API_ACTIONS_MAP = {'': {'action': 'metadata', 'reply_type': 'json'},
-                       'get_messages': {'action': 'get_messages', 'reply_type': 'json'}}
+                       'get_messages': {'action': 'get_messages', 'reply_type': 'json'},
+                       'warm_pool': {'action': 'warm_pool', 'reply_type': 'json'},
+                       'hibernation': {'action': 'hibernation', 'reply_type': 'json'},
+                       'prewarm': {'action': 'prewarm', 'reply_type': 'json'},
+                       'ports': {'action': 'ports', 'reply_type': 'json'},
+                       'hypervisor': {'action': 'hypervisor', 'reply_type': 'json'},
+                       'traces': {'action': 'traces', 'reply_type': 'json'},
+                       'metrics': {'action': 'metrics', 'reply_type': 'text'}}
 
     ################################################################################################################
     #
     ################################################################################################################
     @asjson
     def GET_metadata(self):
-        timelog.TimeLog.reset()
-        timelog.TimeLog.stamp("Request received: get metadata.")
+        print "Request received: get metadata."
         ret = Cloudlet.system_information()
 
         if bool_param('services'):
@@ -61,7 +73,7 @@ class CloudletController(BaseController):
         if bool_param('apps'):
             ret.apps = App.find()
 
-        timelog.TimeLog.stamp("Sending response back to " + request.environ['REMOTE_ADDR'])
+        print "Sending response back to " + request.environ['REMOTE_ADDR']
         return ret
 
     ################################################################################################################
@@ -82,3 +94,53 @@ class CloudletController(BaseController):
         print 'Messages: '
         print reply
         return reply
+
+    ################################################################################################################
+    # Returns hit/miss counts and refill times of the warm pools of paused SVMs, by service id.
+    ################################################################################################################
+    @asjson
+    def GET_warm_pool(self):
+        return get_warm_pool_instance().get_stats()
+
+    ################################################################################################################
+    # Returns how many SVMs were kept idle, reclaimed or expired, by service id.
+    ################################################################################################################
+    @asjson
+    def GET_hibernation(self):
+        return get_hibernation_manager().get_stats()
+
+    ################################################################################################################
+    # Returns which service images are in the page cache, and how popular their services are.
+    ################################################################################################################
+    @asjson
+    def GET_prewarm(self):
+        return get_prewarmer().get_status()
+
+    ################################################################################################################
+    # Returns how full the range of host ports used for SVM port forwarding is.
+    ################################################################################################################
+    @asjson
+    def GET_ports(self):
+        return get_port_manager().get_stats()
+
+    ################################################################################################################
+    # Returns call counts and latencies of the pooled connections to the hypervisor.
+    ################################################################################################################
+    @asjson
+    def GET_hypervisor(self):
+        return get_hypervisor_pool().get_stats()
+
+    ################################################################################################################
+    # Returns latency percentiles of each phase of recently traced requests, optionally only for the given request name
+    # (controller and action, such as ServiceVMController.GET_start).
+    ################################################################################################################
+    @asjson
+    def GET_traces(self):
+        return get_tracer().get_percentiles(request.params.get('name', None))
+
+    ################################################################################################################
+    # Returns all cloudlet metrics in the Prometheus text exposition format, to be scraped periodically.
+    ################################################################################################################
+    def GET_metrics(self):
+        response.content_type = metrics.CONTENT_TYPE
+        return metrics.REGISTRY.render()
@@ -28,6 +28,7 @@
 __author__ = 'Sebastian'
 
 import datetime
+import logging
 import json
 import threading
 
@@ -47,6 +48,8 @@ from pycloud.api.controllers.cloudlet import CloudletController
 from pycloud.pycloud.security import encryption
 from pycloud.pycloud.model.paired_device import PairedDevice
 
+log = logging.getLogger(__name__)
+
 
 ################################################################################################################
 # Class that handles all encrypted commands.
@@ -55,19 +58,20 @@ class EncryptedController(BaseController):
 
     ##################################################################################################################
     # Dummy function, used as a start response function for the controllers called from this action, since we don't
-    # want them to set the headers, as we will do that when we return.
+    # want them to set the headers, as we will do that when we return. It only stores the status and headers.
     ##################################################################################################################
-    def dummy_start_response(self, *args):
-        pass
+    def dummy_start_response(self, status, headers, *args):
+        self.internal_status = status
+        self.internal_headers = headers
 
     #################################################################################################################
     # Helper function to abort.
     #################################################################################################################
-    def send_abort_response(self, code, message, password):
-        print message
+    def send_abort_response(self, code, message, password, headers=None):
+        log.warning(message)
         encrypted_message = message
         #encrypted_message = encryption.encrypt_message(message, password)
-        abort(code, encrypted_message)
+        abort(code, encrypted_message, headers=headers)
 
     #################################################################################################################
     # Main function of the encrypted API, receives a command and its parameters encrypted. Will call the corresponding
@@ -76,8 +80,7 @@ class EncryptedController(BaseController):
     def POST_command(self):
         # Check what device is sending this request.
         device_id = request.headers['X-Device-ID']
-        print ''
-        print 'Received encrypted request from device ' + device_id
+        log.info('Received encrypted request from device ' + device_id)
         device_info = PairedDevice.by_id(device_id)
         if not device_info:
             # We can't encrypt the reply since we got an invalid device id.
@@ -96,16 +99,16 @@ class EncryptedController(BaseController):
 
         # Decrypt the request.
         encrypted_request = request.params['command']
-        print 'Encrypted request: ' + encrypted_request
+        log.debug('Encrypted request: %s', encrypted_request)
         decrypted_request = encryption.decrypt_message(encrypted_request, password)
-        print 'Decrypted request: ' + decrypted_request
+        log.debug('Decrypted request: %s', decrypted_request)
 
         # Parse the request.
         controller_name = None
         action_name = ''
         parts = decrypted_request.split("&")
         command = parts[0]
-        print 'Received command: ' + command
+        log.info('Received command: ' + command)
         command_parts = command.split("/")
         if len(command_parts) > 1:
             controller_name = command_parts[1]
@@ -143,31 +146,39 @@ class EncryptedController(BaseController):
             request.method = controller.API_ACTIONS_MAP[action_name]['method']
 
         # Prepare the received params in the request object.
-        print params_dict
+        log.debug('Request params: %s', params_dict)
         for param in params_dict:
             request.GET[param] = params_dict[param]
 
         # Execute the request we are redirecting to, and get its response.
         request.environ['pylons.routes_dict']['action'] = controller.API_ACTIONS_MAP[action_name]['action']
+        self.internal_status = ''
+        self.internal_headers = []
         internal_response = controller(self.environ, self.dummy_start_response)
         raw_response = internal_response[0]
 
+        # If the controller is too busy to handle this request, let the device know when to retry.
+        if self.internal_status.startswith('503'):
+            retry_after_headers = [header for header in self.internal_headers if header[0] == 'Retry-After']
+            self.send_abort_response(503, raw_response, password, headers=retry_after_headers)
+
         # TODO: find a way to make this hack cleaner....
         # Hack to store SVM id in DB along with paired device info to stop it when mission ends.
         if controller_name == 'servicevm' and action_name == 'start':
             associate_instance_to_device(device_info, raw_response)
+        elif controller_name == 'servicevm' and action_name == 'start_status':
+            associate_started_instance_to_device(device_info, raw_response)
 
         # Check if the reply is an error.
         if reply_format == 'json':
             try:
                 json.loads(raw_response)
             except ValueError:
-                print 'Error in reply: not a json object, assuming internal error. Will return a 500 error.'
+                log.error('Error in reply: not a json object, assuming internal error. Will return a 500 error.')
                 self.send_abort_response(500, raw_response, password)
 
         # Encrypt the reply.
         encrypted_reply = encryption.encrypt_message(raw_response, password)
-        print 'Encrypted reply ' #+ encrypted_reply
 
         # Reset the response body that each controller may have added, and set the content length to the length of the
         # encrypted reply.
@@ -175,10 +186,24 @@ class EncryptedController(BaseController):
         response.content_length = len(encrypted_reply)
 
         # If there was no error, respond with OK and the encrypted reply.
-        print 'Sending encrypted reply, length: {}'.format(len(encrypted_reply))
+        log.info('Sending encrypted reply, length: {}'.format(len(encrypted_reply)))
         return encrypted_reply
 
 
+################################################################################################################
+# Stores the instance id of a Service VM started through start_async, once its job reports it is running.
+################################################################################################################
+def associate_started_instance_to_device(device_info, reply):
+    try:
+        json_object = json.loads(reply)
+    except ValueError:
+        return
+
+    # Only associate it the first time the device gets the status of the finished job.
+    if 'svm' in json_object and device_info.instance != json_object['svm']['_id']:
+        associate_instance_to_device(device_info, json.dumps(json_object['svm']))
+
+
 ################################################################################################################
 # Stores the instance id of a running Service VM instance associated with a paired device.
 ################################################################################################################
@@ -191,16 +216,16 @@ def associate_instance_to_device(device_info, reply):
         device_info.instance = instance_id
         device_info.save()
     except ValueError:
-        print 'VM not started, will not be stored to be stopped later.'
+        log.info('VM not started, will not be stored to be stopped later.')
         return
 
     # Start a timer to stop the instance when the mission time ends.
     time_to_wait = ((device_info.auth_start + datetime.timedelta(minutes=device_info.auth_duration)) - datetime.datetime.now()).seconds
     if time_to_wait > 0:
-        print 'Setting up timer to stop Service VM once deployment time runs out (time to wait: ' + str(time_to_wait) + ' seconds)'
+        log.info('Setting up timer to stop Service VM once deployment time runs out (time to wait: ' + str(time_to_wait) + ' seconds)')
         timer_thread = threading.Timer(time_to_wait, device_info.stop_associated_instance, [device_info.device_id])
         timer_thread.start()
     else:
         # If we are already past end time, stop VM right away.
-        print 'Stopping service VM right away since deployment has already timed out.'
+        log.info('Stopping service VM right away since deployment has already timed out.')
         device_info.stop_associated_instance()
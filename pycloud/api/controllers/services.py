@@ -37,7 +37,6 @@ from pycloud.pycloud.pylons.lib.base import BaseController
 
 # Repository to look for SVMs, and logging util.
 from pycloud.pycloud.pylons.lib.util import asjson
-from pycloud.pycloud.utils import timelog
 
 from pycloud.pycloud.model import Service, App
 
@@ -60,13 +59,12 @@ class ServicesController(BaseController):
     @asjson
     def GET_list(self):
         print '\n*************************************************************************************************'
-        timelog.TimeLog.reset()
-        timelog.TimeLog.stamp("Request received: get list of Services.")
+        print "Request received: get list of Services."
 
         services = Service.find()
         
         # Send the response.
-        timelog.TimeLog.stamp("Sending response back to " + request.environ['REMOTE_ADDR'])
+        print "Sending response back to " + request.environ['REMOTE_ADDR']
         return services
             
     ################################################################################################################
@@ -77,12 +75,11 @@ class ServicesController(BaseController):
         # Look for the VM in the repository.
         sid = request.params.get('serviceId', None)
         print '\n*************************************************************************************************'
-        timelog.TimeLog.reset()
-        timelog.TimeLog.stamp("Request received: find cached Service VM.")
+        print "Request received: find cached Service VM."
         ret = Service.by_id(sid)
         if not ret:
             abort(404, '404 Not Found - service for %s not found' % sid)
         else:
             # Send the response.
-            timelog.TimeLog.stamp("Sending response back to " + request.environ['REMOTE_ADDR'])
+            print "Sending response back to " + request.environ['REMOTE_ADDR']
             return ret
\ No newline at end of file
@@ -26,7 +26,9 @@
 # Released under the MIT license
 # http://jquery.org/license
 
+import json
 import logging
+import time
 
 # Pylon imports.
 from pylons import request
@@ -38,15 +40,26 @@ from pycloud.pycloud.model import Service, ServiceVM
 from pycloud.pycloud.pylons.lib.base import BaseController
 
 # Manager to handle running instances, and logging util.
-from pycloud.pycloud.utils import timelog
 from pycloud.pycloud.pylons.lib.util import asjson
 from pycloud.pycloud.utils import ajaxutils
+from pycloud.pycloud.utils import tracing
+from pycloud.pycloud.utils import metrics
 from pycloud.pycloud.model import migrator
 from pycloud.pycloud.model.migrator import MigrationException
 from pycloud.pycloud.model.servicevm import SVMNotFoundException
+from pycloud.pycloud.vm.diskprecopy import DiskPreCopyException
+from pycloud.pycloud.vm.chunkcodec import get_supported_encodings
+from pycloud.pycloud.model.startjob import get_start_job_queue
+from pycloud.pycloud.model.hibernation import get_hibernation_manager
+from pycloud.pycloud.utils.threadpool import ThreadPoolFullException
 
 log = logging.getLogger(__name__)
 
+# Time to remove a user from an SVM, by what happened to the SVM: it still has users (released), it was kept idle
+# (hibernated), or it was destroyed (stopped).
+SVM_STOP_SECONDS = metrics.histogram('pycloud_svm_stop_seconds', 'Time to remove a user from an SVM.',
+                                     ['service_id', 'path'])
+
 
 ################################################################################################################
 # Class that handles Service VM related HTTP requests to a Cloudlet.
@@ -55,9 +68,16 @@ class ServiceVMController(BaseController):
 
     # Maps API URL words to actual functions in the controller.
     API_ACTIONS_MAP = {'start': {'action': 'start', 'reply_type': 'json'},
+                       'start_async': {'action': 'start_async', 'reply_type': 'json'},
+                       'start_status': {'action': 'start_status', 'reply_type': 'json'},
                        'stop': {'action': 'stop', 'reply_type': 'json'},
                        'migration_svm_metadata': {'action': 'migration_svm_metadata', 'reply_type': 'json', 'method': 'POST'},
                        'migration_svm_disk_file': {'action': 'migration_svm_disk_file', 'reply_type': 'json', 'method': 'POST'},
+                       'migration_svm_disk_chunks': {'action': 'migration_svm_disk_chunks', 'reply_type': 'json', 'method': 'POST'},
+                       'migration_svm_disk_finish': {'action': 'migration_svm_disk_finish', 'reply_type': 'json', 'method': 'POST'},
+                       'migration_svm_disk_status': {'action': 'migration_svm_disk_status', 'reply_type': 'json', 'method': 'POST'},
+                       'migration_svm_base_negotiate': {'action': 'migration_svm_base_negotiate', 'reply_type': 'json', 'method': 'POST'},
+                       'migration_svm_base_chunks': {'action': 'migration_svm_base_chunks', 'reply_type': 'json', 'method': 'POST'},
                        'abort_migration': {'action': 'abort_migration', 'reply_type': 'json', 'method': 'POST'},
                        'migration_generate_credentials': {'action': 'migration_generate_credentials', 'reply_type': 'json', 'method': 'POST'},
                        'migration_svm_resume': {'action': 'migration_svm_resume', 'reply_type': 'json', 'method': 'POST'}}
@@ -75,7 +95,6 @@ class ServiceVMController(BaseController):
     @asjson
     def GET_start(self):
         # Start the Service VM on a random port.
-        print '\n*************************************************************************************************'        
 
         # Get variables.
         sid = request.params.get('serviceId', None)
@@ -83,7 +102,7 @@ class ServiceVMController(BaseController):
             # If we didnt get a valid one, just return an error message.
             abort(400, 'Must provide service id')
 
-        timelog.TimeLog.stamp("Request received: start VM with service id " + sid)
+        log.info("Request received: start VM with service id " + sid)
         service = Service.by_id(sid)
         if not service:
             abort(400, 'Service vm for %s not found' % sid)
@@ -98,21 +117,62 @@ class ServiceVMController(BaseController):
         try:
             svm = service.get_vm_instance(join=join)
 
-            # Update the amount of users on this SVM, and save that change.
-            svm.num_current_users += 1
-            svm.save()
-
             # Send the response.
-            timelog.TimeLog.stamp("Sending response back to " + request.environ['REMOTE_ADDR'])
-            timelog.TimeLog.writeToFile()
+            log.info("Sending response back to " + request.environ['REMOTE_ADDR'])
             return svm
         except Exception as e:
             if svm:
                 # If there was a problem starting the instance, stop it.
                 svm.stop()
-            print 'Error starting Service VM Instance: ' + str(e)
+            log.error('Error starting Service VM Instance: ' + str(e))
             abort(500, '%s' % str(e))
 
+    ################################################################################################################
+    # Called to start a Service VM in the background. Returns a job id right away, which can be used to get the
+    # status of the start process through start_status.
+    # - join: indicates if we want to run our own Service VM (false) or if we can share an existing one (true)
+    ################################################################################################################
+    @asjson
+    def GET_start_async(self):
+        # Get variables.
+        sid = request.params.get('serviceId', None)
+        if not sid:
+            # If we didnt get a valid one, just return an error message.
+            abort(400, 'Must provide service id')
+
+        service = Service.by_id(sid)
+        if not service:
+            abort(400, 'Service vm for %s not found' % sid)
+
+        # Check the flags that indicates whether we could join an existing instance.
+        join = request.params.get('join', False)
+        if not isinstance(join, bool):
+            join = join.upper() in ['T', 'TRUE', 'Y', 'YES']
+
+        try:
+            job = get_start_job_queue().submit(service, join=join)
+        except ThreadPoolFullException as e:
+            log.info('Rejecting start request: ' + e.message)
+            retry_after = str(app_globals.cloudlet.async_start_retry_after)
+            abort(503, 'Too many Service VMs being started, retry later.', headers=[('Retry-After', retry_after)])
+
+        return job.get_status()
+
+    ################################################################################################################
+    # Returns the phase, elapsed time and, if it finished, the resulting SVM of a job created by start_async.
+    ################################################################################################################
+    @asjson
+    def GET_start_status(self):
+        job_id = request.params.get('jobId', None)
+        if not job_id:
+            abort(400, 'Must provide job id')
+
+        job = get_start_job_queue().get_job(job_id)
+        if not job:
+            abort(404, 'Start job %s not found' % job_id)
+
+        return job.get_status()
+
     ################################################################################################################
     # Called to stop a running instance of a Service VM.
     ################################################################################################################
@@ -123,9 +183,7 @@ class ServiceVMController(BaseController):
             # If we didnt get a valid one, just return an error message.
             abort(400, 'Must provide instance id')
 
-        print '\n*************************************************************************************************'
-        timelog.TimeLog.reset()
-        timelog.TimeLog.stamp("Request received: stop VM with instance id " + svm_id)
+        log.info("Request received: stop VM with instance id " + svm_id)
 
         # Stop the Service VM.
         svm = ServiceVM.by_id(svm_id)
@@ -133,20 +191,28 @@ class ServiceVMController(BaseController):
             abort(404, 'Service vm for %s not found' % svm_id)
 
         try:
-            # Check if there are other users using the SVM, and if so, decrement counter; otherwise, stop it and delete it.
-            if svm.num_current_users > 1:
-                svm.num_current_users -= 1
-                svm.save()
-            else:
-                svm.stop()
-                ServiceVM.find_and_remove(svm_id)
-
-            timelog.TimeLog.stamp("Sending response back to " + request.environ['REMOTE_ADDR'])
-            timelog.TimeLog.writeToFile()
+            # Unregister the user. If it was the last one, keep the SVM idle if its service allows it, or stop and
+            # delete it otherwise.
+            start_time = time.time()
+            stop_path = 'released'
+            with tracing.span('release'):
+                was_last_user = ServiceVM.release(svm_id)
+            if was_last_user:
+                with tracing.span('hibernate'):
+                    hibernated = get_hibernation_manager().hibernate(svm)
+                    stop_path = 'hibernated'
+                if not hibernated:
+                    with tracing.span('stop'):
+                        svm.stop()
+                        ServiceVM.find_and_remove(svm_id)
+                        stop_path = 'stopped'
+            SVM_STOP_SECONDS.labels(svm.service_id, stop_path).observe(time.time() - start_time)
+
+            log.info("Sending response back to " + request.environ['REMOTE_ADDR'])
             return {}
         except Exception as e:
             # If there was a problem stopping the instance, return that there was an error.
-            print 'Error stopping Service VM Instance: ' + str(e)
+            log.error('Error stopping Service VM Instance: ' + str(e))
             abort(500, '%s' % str(e))
 
     ############################################################################################################
@@ -168,10 +234,107 @@ class ServiceVMController(BaseController):
         try:
             migrator.receive_migrated_svm_disk_file(svm_id, disk_image_object, app_globals.cloudlet.svmInstancesFolder)
         except SVMNotFoundException as e:
-            print e.message
+            log.error(e.message)
+            abort(404, e.message)
+        except MigrationException as e:
+            log.error(e.message)
+            abort(500, e.message)
+        else:
+            return ajaxutils.JSON_OK
+
+    ############################################################################################################
+    # Receives numbered chunks of the disk image file of a migrated SVM. Their data is the body of the request, and
+    # is written into place as it is read.
+    ############################################################################################################
+    @asjson
+    def POST_migration_svm_disk_chunks(self):
+        svm_id = request.params.get('id')
+        chunk_list = json.loads(request.params.get('chunks'))
+        file_size = request.params.get('file_size')
+        file_size = int(file_size) if file_size else None
+        chunks_file_object = request.body_file
+
+        try:
+            migrator.receive_migrated_svm_disk_chunks(svm_id, chunk_list, chunks_file_object, file_size,
+                                                      app_globals.cloudlet.svmInstancesFolder)
+        except SVMNotFoundException as e:
+            log.error(e.message)
+            abort(404, e.message)
+        except DiskPreCopyException as e:
+            log.error(e.message)
+            abort(500, e.message)
+        else:
+            return ajaxutils.JSON_OK
+
+    ############################################################################################################
+    # Receives the manifest of the backing image needed by the disk image of a migrated SVM, in the body of the
+    # request, and starts preparing it. Returns the encodings in which chunks can be sent; the checksums of the chunks
+    # that are not available locally are returned by the disk status once the backing image is ready.
+    ############################################################################################################
+    @asjson
+    def POST_migration_svm_base_negotiate(self):
+        svm_id = request.params.get('id')
+        fingerprint = request.params.get('fingerprint')
+        file_size = int(request.params.get('file_size'))
+        manifest = json.load(request.body_file)
+
+        try:
+            migrator.negotiate_migrated_svm_base_image(svm_id, fingerprint, file_size, manifest,
+                                                       app_globals.cloudlet.svmInstancesFolder)
+        except SVMNotFoundException as e:
+            log.error(e.message)
+            abort(404, e.message)
+        else:
+            return {'encodings': get_supported_encodings()}
+
+    ############################################################################################################
+    # Receives chunks of the backing image of a migrated SVM, identified by their checksums. Their data is the body
+    # of the request.
+    ############################################################################################################
+    @asjson
+    def POST_migration_svm_base_chunks(self):
+        svm_id = request.params.get('id')
+        chunk_list = json.loads(request.params.get('chunks'))
+
+        try:
+            migrator.receive_migrated_svm_base_chunks(svm_id, chunk_list, request.body_file)
+        except SVMNotFoundException as e:
+            log.error(e.message)
+            abort(404, e.message)
+        except DiskPreCopyException as e:
+            log.error(e.message)
+            abort(500, e.message)
+        else:
+            return ajaxutils.JSON_OK
+
+    ############################################################################################################
+    # Returns the progress of the transfer of the disk image file of a migrated SVM, including the number of the last
+    # chunk written, from which the sender can resume after a failure.
+    ############################################################################################################
+    @asjson
+    def POST_migration_svm_disk_status(self):
+        svm_id = request.params.get('id')
+
+        try:
+            return migrator.get_migrated_svm_disk_status(svm_id)
+        except SVMNotFoundException as e:
+            log.error(e.message)
+            abort(404, e.message)
+
+    ############################################################################################################
+    # Finishes receiving the disk image file of a migrated SVM sent in chunks.
+    ############################################################################################################
+    @asjson
+    def POST_migration_svm_disk_finish(self):
+        svm_id = request.params.get('id')
+
+        try:
+            migrator.finish_migrated_svm_disk_file(svm_id)
+        except SVMNotFoundException as e:
+            log.error(e.message)
             abort(404, e.message)
         except MigrationException as e:
-            print e.message
+            log.error(e.message)
             abort(500, e.message)
         else:
             return ajaxutils.JSON_OK
@@ -187,7 +350,7 @@ class ServiceVMController(BaseController):
         try:
             migrator.abort_migration(svm_id)
         except SVMNotFoundException as e:
-            print e.message
+            log.error(e.message)
             abort(404, e.message)
 
         return ajaxutils.JSON_OK
@@ -205,7 +368,7 @@ class ServiceVMController(BaseController):
         try:
             credentials = migrator.generate_migration_device_credentials(device_id, connection_id, svm_id)
         except Exception as e:
-            print 'Error generating credentials: ' + e.message
+            log.error('Error generating credentials: ' + e.message)
             abort(404, e.message)
 
         return credentials
@@ -221,7 +384,7 @@ class ServiceVMController(BaseController):
         try:
             migrator.resume_migrated_svm(svm_id)
         except SVMNotFoundException as e:
-            print e.message
+            log.error(e.message)
             abort(404, e.message)
 
         return ajaxutils.JSON_OK
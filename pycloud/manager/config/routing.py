@@ -46,6 +46,7 @@ def make_map(config):
     connect('/', controller='services', action='index')
     connect('/home', controller='home', action='index')
     connect('/home/state', controller='home', action='state')
+    connect('/metrics', controller='home', action='metrics')
 
     connect('/auth/signin', controller='auth', action='signin')
     connect('/auth/signin_form', controller='auth', action='signin_form')
@@ -60,6 +61,8 @@ def make_map(config):
     connect('/instances/startInstance/{id}', controller='instances', action='startInstance')
     connect('/instances/stopInstance/{id}', controller='instances', action='stopInstance')
     connect('/instances/migrate/{id}', controller='instances', action='migrateInstance')
+    connect('/instances/migrationStatus/{id}', controller='instances', action='migrationStatus')
+    connect('/instances/setMigrationBandwidth/{id}', controller='instances', action='setMigrationBandwidth')
     connect('/instances/wifiConnect', controller='instances', action='wifiConnect')
     connect('/instances/wifiDisconnect', controller='instances', action='wifiDisconnect')
     connect('/instances/getMigrationInfo/{id}', controller='instances', action='getMigrationInfo')
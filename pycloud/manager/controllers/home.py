@@ -35,6 +35,7 @@ from pycloud.manager.lib.pages import HomePage
 
 from pycloud.pycloud.cloudlet import Cloudlet
 from pycloud.pycloud.pylons.lib.util import asjson
+from pycloud.pycloud.utils import metrics
 
 log = logging.getLogger(__name__)
 
@@ -65,3 +66,10 @@ class HomeController(BaseController):
     def GET_state(self):
         machine_state = Cloudlet.system_information()
         return machine_state
+
+    ############################################################################################################
+    # Returns all cloudlet metrics in the Prometheus text exposition format, to be scraped periodically.
+    ############################################################################################################
+    def GET_metrics(self):
+        response.content_type = metrics.CONTENT_TYPE
+        return metrics.REGISTRY.render()
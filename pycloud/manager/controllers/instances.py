@@ -33,6 +33,7 @@ from pylons import response, session, tmpl_context as c
 from pylons import app_globals
 
 from pycloud.pycloud.pylons.lib.base import BaseController
+from pycloud.pycloud.pylons.lib import helpers as h
 from pycloud.manager.lib.pages import InstancesPage
 from pycloud.pycloud.model import Service, ServiceVM, PairedDevice
 from pycloud.pycloud.pylons.lib.util import asjson
@@ -41,7 +42,7 @@ from pycloud.pycloud.utils import ajaxutils
 from pycloud.pycloud.network import wifi, finder
 from pycloud.pycloud.network.wifi import WifiManager
 from pycloud.pycloud.cloudlet import Cloudlet
-from pycloud.pycloud.model import migrator
+from pycloud.pycloud.model.migrationjob import get_migration_job_queue
 
 CLOUDLET_NETWORK_PREFIX = 'cloudlet'
 
@@ -68,6 +69,9 @@ class InstancesController(BaseController):
         current_network = WifiManager.get_current_network(interface=app_globals.cloudlet.wifi_adapter)
         instancesPage.current_network = current_network
 
+        # URL to check the progress of migrations.
+        instancesPage.migrationStatusURL = h.url_for(controller='instances', action='migrationStatus', id='')
+
         # Pass the grid and render the page.
         return instancesPage.render()
 
@@ -173,7 +177,8 @@ class InstancesController(BaseController):
         return ajaxutils.JSON_OK
 
     ############################################################################################################
-    # Command to migrate a machine.
+    # Command to migrate a machine. The migration runs in the background, and its progress can be checked with
+    # migrationStatus. An optional max bandwidth in MB/s can be given, otherwise the configured one is used.
     ############################################################################################################
     @asjson
     def GET_migrateInstance(self, id):
@@ -182,16 +187,69 @@ class InstancesController(BaseController):
             remote_ip = remote_host_info[0]
             remote_host = remote_host_info[1] + ':' + remote_host_info[2]
             encrypted = True if remote_host_info[3] == 'encryption-enabled' else False
-            migrator.migrate_svm(id, remote_host, remote_ip, encrypted)
+            max_bandwidth = self._get_max_bandwidth_param(app_globals.cloudlet.migration_max_bandwidth)
+
+            # The adapter is read here, since app_globals is not available in the thread that runs the migration.
+            wifi_adapter = app_globals.cloudlet.wifi_adapter
+
+            def disconnect_from_cloudlet_network():
+                if WifiManager.is_connected_to_cloudlet_network(interface=wifi_adapter):
+                    print 'Disconnecting from cloudlet Wi-Fi network.'
+                    WifiManager.disconnect_from_network(interface=wifi_adapter)
 
-            if WifiManager.is_connected_to_cloudlet_network(interface=app_globals.cloudlet.wifi_adapter):
-                print 'Disconnecting from cloudlet Wi-Fi network.'
-                WifiManager.disconnect_from_network(interface=app_globals.cloudlet.wifi_adapter)
+            job = get_migration_job_queue().submit(id, remote_host, remote_ip, encrypted, max_bandwidth,
+                                                   after_migration=disconnect_from_cloudlet_network)
         except Exception, e:
             msg = 'Error migrating: ' + str(e)
             return ajaxutils.show_and_return_error_dict(msg)
 
-        return ajaxutils.JSON_OK
+        result = dict(ajaxutils.JSON_OK)
+        result.update(job.get_status())
+        return result
+
+    ############################################################################################################
+    # Returns the progress of a migration started with migrateInstance: bytes sent per phase, current rate and ETA
+    # of the current phase and, once it finished, how long the SVM was paused and how its disk was sent.
+    ############################################################################################################
+    @asjson
+    def GET_migrationStatus(self, id):
+        job = get_migration_job_queue().get_job(id)
+        if not job:
+            return ajaxutils.show_and_return_error_dict('Migration job {} not found'.format(id))
+
+        result = dict(ajaxutils.JSON_OK)
+        result.update(job.get_status())
+        return result
+
+    ############################################################################################################
+    # Changes the max bandwidth in MB/s of a running migration; 0 or no value removes the limit.
+    ############################################################################################################
+    @asjson
+    def GET_setMigrationBandwidth(self, id):
+        job = get_migration_job_queue().get_job(id)
+        if not job:
+            return ajaxutils.show_and_return_error_dict('Migration job {} not found'.format(id))
+
+        try:
+            job.set_bandwidth_limit(self._get_max_bandwidth_param(0))
+        except ValueError, e:
+            msg = 'Invalid bandwidth: ' + str(e)
+            return ajaxutils.show_and_return_error_dict(msg)
+
+        result = dict(ajaxutils.JSON_OK)
+        result.update(job.get_status())
+        return result
+
+    ############################################################################################################
+    # Returns the max bandwidth given in MB/s in the request, or the default, in bytes per second; None if there
+    # is no limit.
+    ############################################################################################################
+    def _get_max_bandwidth_param(self, default):
+        max_bandwidth = request.params.get('maxBandwidth', '')
+        max_bandwidth = float(max_bandwidth) if max_bandwidth.strip() else default
+        if max_bandwidth < 0:
+            raise ValueError('max bandwidth can not be negative')
+        return int(max_bandwidth * 1024 * 1024) or None
 
     ############################################################################################################
     # Returns a list of running svms.
@@ -36,6 +36,8 @@ from pylons import app_globals
 from pycloud.pycloud.pylons.lib.base import BaseController
 from pycloud.pycloud.pylons.lib import helpers as h
 from pycloud.pycloud.model import Service, ServiceVM, VMImage
+from pycloud.pycloud.vm.vmsavedstate import VMSavedState
+from pycloud.pycloud.vm.descriptortemplate import get_descriptor_template_cache
 from pycloud.pycloud.pylons.lib.util import asjson, encoded_json_to_dict
 
 from pycloud.manager.lib.pages import ModifyPage
@@ -109,6 +111,12 @@ class ModifyController(BaseController):
                 page.form_values['numClientsSupported'] = service.num_users
                 page.form_values['reqMinMem'] = service.min_memory
                 page.form_values['reqIdealMem'] = service.ideal_memory
+                page.form_values['warmPoolSize'] = service.warm_pool_size
+                page.form_values['readinessTimeout'] = service.readiness_timeout
+                page.form_values['readinessHttpPath'] = service.readiness_http_path
+                page.form_values['idlePauseTime'] = service.idle_pause_time
+                page.form_values['idleSaveTime'] = service.idle_save_time
+                page.form_values['stateImageFormat'] = service.state_image_format
             
                 # VM Image values. The ...Value fields are for storing data, while the others are for
                 # showing it only. Since the vmDiskImageFile and vmStateImageFile fields are disabled,
@@ -174,6 +182,34 @@ class ModifyController(BaseController):
         service.min_memory   = request.params.get("reqMinMem")
         service.ideal_memory = request.params.get("reqIdealMem")
 
+        # Amount of paused SVMs to keep ready for this service.
+        try:
+            service.warm_pool_size = int(request.params.get("warmPoolSize", ""))
+        except Exception as e:
+            service.warm_pool_size = 0
+
+        # How to check that the service is available when an SVM starts.
+        try:
+            service.readiness_timeout = int(request.params.get("readinessTimeout", ""))
+        except Exception as e:
+            service.readiness_timeout = None
+        service.readiness_http_path = request.params.get("readinessHttpPath") or None
+
+        # How long to keep SVMs paused and then saved after their last user leaves.
+        try:
+            service.idle_pause_time = int(request.params.get("idlePauseTime", ""))
+        except Exception as e:
+            service.idle_pause_time = 0
+        try:
+            service.idle_save_time = int(request.params.get("idleSaveTime", ""))
+        except Exception as e:
+            service.idle_save_time = 0
+
+        # Format the saved state is stored in. It is only changed once the saved state has been converted, below.
+        state_image_format = request.params.get("stateImageFormat", "").strip().lower()
+        if state_image_format not in VMSavedState.FORMATS:
+            state_image_format = VMSavedState.FORMAT_RAW
+
         # VM Image info.
         service.vm_image = VMImage()
         service.vm_image.disk_image = request.params.get("vmDiskImageFileValue")
@@ -181,6 +217,9 @@ class ModifyController(BaseController):
         
         # Create or update the information.
         service.save()
+
+        # Store the saved state in the selected format, converting it in the background if it already exists.
+        service.change_state_image_format(state_image_format)
                
         # Render the page.
         return h.redirect_to(controller='services')
@@ -268,6 +307,7 @@ class ModifyController(BaseController):
             # Permanently store the VM.
             print 'Moving Service VM Image to cache, from folder {} to folder {}.'.format(os.path.dirname(svm.vm_image.disk_image), vm_image_folder)
             svm.vm_image.move(vm_image_folder)
+            get_descriptor_template_cache().invalidate(svm.service_id)
 
             # Make the VM image read only.
             print 'Making VM Image read-only.'
@@ -55,21 +55,77 @@ function showMigrationModal(availableCloudeletsUrl, migrateUrl)
 }
 
 /////////////////////////////////////////////////////////////////////////////////////
-// Function to stop a Service VM through Ajax.
+// Function to start the migration of a Service VM through Ajax, and follow its progress.
 /////////////////////////////////////////////////////////////////////////////////////
-function migrateSVM()
+function migrateSVM(migrationStatusUrl)
 {
     var successHandler = function(response) {
-        reloadPage();
+        $('#modal-migrate').modal('hide');
+        showMigrationProgress(migrationStatusUrl + "/" + response.job_id);
     };
 
-    // Add the target cloudlet.
+    // Add the target cloudlet, and the bandwidth limit if any.
     var migrateUrl = $('#migrateUrl').val();
     var targetCloudlet = $('#targetCloudlet').val();
     migrateUrl = migrateUrl + '?target=' + targetCloudlet;
+    var maxBandwidth = $('#maxBandwidth').val();
+    if(maxBandwidth)
+        migrateUrl = migrateUrl + '&maxBandwidth=' + encodeURIComponent(maxBandwidth);
 
     // Do the post to get data and load the modal.
-    ajaxGet(migrateUrl, "Migrating Service VM Instance", successHandler, $('#modal-migrate'));
+    ajaxGet(migrateUrl, "Starting migration of Service VM Instance", successHandler, $('#modal-migrate'));
+}
+
+/////////////////////////////////////////////////////////////////////////////////////
+// Shows the phase, rate and ETA of a migration until it finishes.
+/////////////////////////////////////////////////////////////////////////////////////
+function showMigrationProgress(statusUrl)
+{
+    var dialog = WaitDialog("Migrating Service VM Instance");
+    dialog.show();
+
+    var checkStatus = function() {
+        $.ajax({
+            url: statusUrl,
+            method: 'GET',
+            success: function(resp) {
+                var migrationStatus = getAsJson(resp);
+                if(!ajaxCallWasSuccessful(migrationStatus) || migrationStatus.phase == 'failed') {
+                    dialog.hide();
+                    showAndLogErrorMessage('There was a problem migrating the Service VM Instance: ' + migrationStatus.error);
+                }
+                else if(migrationStatus.phase == 'finished') {
+                    dialog.hide();
+                    reloadPage();
+                }
+                else {
+                    $('#pleaseWaitDialog h3').text(describeMigrationStatus(migrationStatus));
+                    setTimeout(checkStatus, 1000);
+                }
+            },
+            error: function(req, status, err) {
+                // Keep trying, the migration continues even if we can't check it for a moment.
+                setTimeout(checkStatus, 1000);
+            }
+        });
+    };
+
+    checkStatus();
+}
+
+/////////////////////////////////////////////////////////////////////////////////////
+// Returns a text with the current phase of a migration, how much of it is done, rate and ETA.
+/////////////////////////////////////////////////////////////////////////////////////
+function describeMigrationStatus(migrationStatus)
+{
+    var description = 'Migrating (' + migrationStatus.phase;
+    var progress = migrationStatus.phases[migrationStatus.phase];
+    if(progress && progress.total_bytes)
+        description += ' ' + Math.min(100, Math.round(100 * progress.bytes_done / progress.total_bytes)) + '%';
+    description += ', ' + (migrationStatus.rate / (1024 * 1024)).toFixed(1) + ' MB/s';
+    if(migrationStatus.eta !== null)
+        description += ', ' + Math.round(migrationStatus.eta) + ' s left';
+    return description + ')...';
 }
  
 /////////////////////////////////////////////////////////////////////////////////////
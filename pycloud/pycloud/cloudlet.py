@@ -34,8 +34,8 @@ import psutil
 import os
 import shutil
 from pycloud.pycloud.utils import portmanager
+from pycloud.pycloud.utils import asynclog
 import pycloud.pycloud.mongo.model as model
-import sys
 import socket
 import subprocess
 
@@ -72,8 +72,17 @@ class Cloudlet(object):
         # Detect the app we are running in depending on the config params in the file.
         app = 'api' if 'pycloud.api.encrypted' in config else 'manager'
 
-        # Write output to log file.
-        sys.stdout = Tee(os.path.join(self.data_folder, 'pycloud-' + app + '.log'), 'w')
+        # Logging: min level logged, max size in MB of the log file before it is rotated, amount of rotated files kept,
+        # and max characters of each logged message (to avoid writing whole request payloads).
+        self.log_level = config['pycloud.logging.level'] if 'pycloud.logging.level' in config else 'info'
+        self.log_max_size = int(config['pycloud.logging.max_size']) if 'pycloud.logging.max_size' in config else 10
+        self.log_backup_count = int(config['pycloud.logging.backup_count']) if 'pycloud.logging.backup_count' in config else 3
+        self.log_max_payload = int(config['pycloud.logging.max_payload']) if 'pycloud.logging.max_payload' in config else asynclog.DEFAULT_MAX_PAYLOAD
+
+        # Write output to log file, from a background thread.
+        asynclog.start_logging(os.path.join(self.data_folder, 'pycloud-' + app + '.log'),
+                               asynclog.parse_level(self.log_level), self.log_max_size * 1024 * 1024,
+                               self.log_backup_count, self.log_max_payload)
 
         print 'Loading cloudlet configuration...'
 
@@ -109,6 +118,14 @@ class Cloudlet(object):
         self.network_bridge_enabled = False #config['pycloud.network.bridge_enabled'].upper() in ['T', 'TRUE', 'Y', 'YES']
         self.network_adapter = config['pycloud.network.adapter']
 
+        # DHCP lease files (comma separated) used to find the IPs of bridged VMs, and how long found IPs are cached.
+        self.dhcp_lease_files = [lease_file.strip() for lease_file in config['pycloud.network.dhcp_lease_files'].split(',')] if 'pycloud.network.dhcp_lease_files' in config else None
+        self.ip_cache_ttl = int(config['pycloud.network.ip_cache_ttl']) if 'pycloud.network.ip_cache_ttl' in config else 300
+
+        # Range scanned with ARP pings when the IP of a bridged VM is not found in the tables above, such as the DHCP
+        # pool (CIDR or first-last IP). If not set, the adapter's network is scanned, up to the /24 around its address.
+        self.ip_scan_range = config['pycloud.network.ip_scan_range'] if 'pycloud.network.ip_scan_range' in config else None
+
         # Wi-Fi adapter to use to connect to other cloudlets.
         self.wifi_adapter = config['pycloud.network.wifi_adapter'] if 'pycloud.network.wifi_adapter' in config else ''
 
@@ -127,6 +144,65 @@ class Cloudlet(object):
         # DNS
         self.dns_enabled = config['pycloud.dns.enabled'] == 'True' if 'pycloud.dns.enabled' in config else False
 
+        # Warm pool of paused SVMs. Max memory is in MB, and 0 means no limit.
+        self.warm_pool_enabled = config['pycloud.warm_pool.enabled'].upper() in ['T', 'TRUE', 'Y', 'YES'] if 'pycloud.warm_pool.enabled' in config else False
+        self.warm_pool_max_memory = int(config['pycloud.warm_pool.max_memory']) if 'pycloud.warm_pool.max_memory' in config else 0
+
+        # Weight of the recent CPU usage of shared SVMs when choosing which one a new user joins (0 to only use the
+        # amount of users).
+        self.placement_cpu_weight = float(config['pycloud.placement.cpu_weight']) if 'pycloud.placement.cpu_weight' in config else 0.0
+
+        # Asynchronous SVM starts: amount of starts executed in parallel, max amount of starts waiting, and seconds
+        # after which clients should retry if the queue is full.
+        self.async_start_workers = int(config['pycloud.async_start.workers']) if 'pycloud.async_start.workers' in config else 2
+        self.async_start_queue_size = int(config['pycloud.async_start.queue_size']) if 'pycloud.async_start.queue_size' in config else 10
+        self.async_start_retry_after = int(config['pycloud.async_start.retry_after']) if 'pycloud.async_start.retry_after' in config else 5
+
+        # Connections to the local hypervisor: URI, amount of pooled connections, and keepalive interval (in seconds)
+        # and amount of unanswered keepalive messages after which the connection is considered broken.
+        self.libvirt_uri = config['pycloud.libvirt.uri'] if 'pycloud.libvirt.uri' in config else 'qemu:///system'
+        self.libvirt_pool_size = int(config['pycloud.libvirt.pool_size']) if 'pycloud.libvirt.pool_size' in config else 4
+        self.libvirt_keepalive_interval = int(config['pycloud.libvirt.keepalive_interval']) if 'pycloud.libvirt.keepalive_interval' in config else 5
+        self.libvirt_keepalive_count = int(config['pycloud.libvirt.keepalive_count']) if 'pycloud.libvirt.keepalive_count' in config else 5
+
+        # Whether to listen for VMs that stop or crash on their own, to keep the DB in sync.
+        self.libvirt_events_enabled = config['pycloud.libvirt.events_enabled'].upper() in ['T', 'TRUE', 'Y', 'YES'] if 'pycloud.libvirt.events_enabled' in config else True
+        self.domain_event_listener = None
+
+        # Prewarming of the images of popular services into the page cache. Budget is in MB, and interval and window
+        # (how far back starts are counted to rank services) are in seconds.
+        self.prewarm_enabled = config['pycloud.prewarm.enabled'].upper() in ['T', 'TRUE', 'Y', 'YES'] if 'pycloud.prewarm.enabled' in config else False
+        self.prewarm_top_services = int(config['pycloud.prewarm.top_services']) if 'pycloud.prewarm.top_services' in config else 3
+        self.prewarm_budget = int(config['pycloud.prewarm.budget']) if 'pycloud.prewarm.budget' in config else 1024
+        self.prewarm_interval = int(config['pycloud.prewarm.interval']) if 'pycloud.prewarm.interval' in config else 60
+        self.prewarm_window = int(config['pycloud.prewarm.window']) if 'pycloud.prewarm.window' in config else 3600
+
+        # Range of host ports reserved for port forwarding to SVMs.
+        self.port_range_start = int(config['pycloud.ports.range_start']) if 'pycloud.ports.range_start' in config else portmanager.DEFAULT_RANGE_START
+        self.port_range_end = int(config['pycloud.ports.range_end']) if 'pycloud.ports.range_end' in config else portmanager.DEFAULT_RANGE_END
+
+        # Migration: whether the disk image is copied while the SVM is still running, before pausing it to send what
+        # changed since then, max rounds of that live copy, and MB left to send below which the SVM is paused.
+        self.migration_precopy_enabled = config['pycloud.migration.precopy_enabled'].upper() in ['T', 'TRUE', 'Y', 'YES'] if 'pycloud.migration.precopy_enabled' in config else True
+        self.migration_precopy_max_rounds = int(config['pycloud.migration.precopy_max_rounds']) if 'pycloud.migration.precopy_max_rounds' in config else 5
+        self.migration_precopy_min_delta = int(config['pycloud.migration.precopy_min_delta']) if 'pycloud.migration.precopy_min_delta' in config else 16
+
+        # Migration: amount of parallel streams (HTTP connections, and libvirt connections for memory where supported)
+        # used to send the disk and memory of an SVM.
+        self.migration_streams = int(config['pycloud.migration.streams']) if 'pycloud.migration.streams' in config else 4
+
+        # Migration: default max bandwidth in MB/s used by each migration (0 for no limit), which can be changed while
+        # it runs, and amount of migrations run at the same time.
+        self.migration_max_bandwidth = float(config['pycloud.migration.max_bandwidth']) if 'pycloud.migration.max_bandwidth' in config else 0
+        self.migration_workers = int(config['pycloud.migration.workers']) if 'pycloud.migration.workers' in config else 2
+
+        # Tracing of requests: fraction of requests traced, where traces are written (file or mongo), and max size in
+        # MB of each trace file or of the capped trace collection.
+        self.tracing_sample_rate = float(config['pycloud.tracing.sample_rate']) if 'pycloud.tracing.sample_rate' in config else 0.1
+        self.tracing_destination = config['pycloud.tracing.destination'] if 'pycloud.tracing.destination' in config else 'file'
+        self.tracing_max_size = int(config['pycloud.tracing.max_size']) if 'pycloud.tracing.max_size' in config else 10
+        self.tracing_file = os.path.join(self.data_folder, 'traces-' + app + '.log')
+
         # Load version information.
         base_folder = os.path.dirname(os.path.realpath(__file__))
         self.version = ''
@@ -165,6 +241,7 @@ class Cloudlet(object):
 
     def cleanup_system(self):
         Cloudlet._remove_service_vms()
+        Cloudlet._reconcile_ports()
         Cloudlet._clean_temp_folder(self.svmInstancesFolder)
         Cloudlet._clean_temp_folder(self.newVmFolder)
         if not os.path.exists(self.export_path):
@@ -174,6 +251,27 @@ class Cloudlet(object):
         if not os.path.exists(self.cloudletCredentialsFolder):
             os.makedirs(self.cloudletCredentialsFolder)
 
+    ################################################################################################################
+    # Starts background services that depend on the system being already cleaned up.
+    ################################################################################################################
+    def start_background_services(self):
+        if self.libvirt_events_enabled:
+            from pycloud.pycloud.model.servicevm import ServiceVM
+            from pycloud.pycloud.vm.domainevents import DomainEventListener
+            self.domain_event_listener = DomainEventListener(self.libvirt_uri, ServiceVM.handle_domain_event)
+            self.domain_event_listener.start()
+
+        if self.warm_pool_enabled:
+            from pycloud.pycloud.model.warmpool import get_warm_pool_instance
+            get_warm_pool_instance().start()
+
+        from pycloud.pycloud.model.hibernation import get_hibernation_manager
+        get_hibernation_manager().start()
+
+        if self.prewarm_enabled:
+            from pycloud.pycloud.model.prewarm import get_prewarmer
+            get_prewarmer().start()
+
     @staticmethod
     def _clean_temp_folder(folder):
         print 'Cleaning up \'%s\'' % folder
@@ -190,6 +288,19 @@ class Cloudlet(object):
         from pycloud.pycloud.model import ServiceVM
         ServiceVM.clear_all_svms()
 
+    ################################################################################################################
+    # Frees port allocations left behind by VMs that no longer exist in the hypervisor.
+    ################################################################################################################
+    @staticmethod
+    def _reconcile_ports():
+        from pycloud.pycloud.vm.vmutils import VirtualMachine, VirtualMachineException
+        try:
+            live_ids = VirtualMachine.get_all_domain_uuids()
+        except VirtualMachineException as e:
+            print 'Could not list domains to reconcile ports: {}'.format(e.message)
+            return
+        portmanager.get_port_manager().reconcile(live_ids)
+
 
 class Cpu_Info(model.AttrDict):
 
@@ -216,20 +327,6 @@ class Cloudlet_Metadata(model.AttrDict):
         self.cpu_info = Cpu_Info()
 
 
-class Tee(object):
-
-    def __init__(self, name, mode):
-        self.file = open(name, mode)
-        self.stdout = sys.stdout
-
-    def __del__(self):
-        self.file.close()
-
-    def write(self, data):
-        self.file.write(data)
-        self.stdout.write(data)
-
-
 from collections import OrderedDict
 
 ##########################################################################################
@@ -0,0 +1,243 @@
+# KVM-based Discoverable Cloudlet (KD-Cloudlet) 
+# Copyright (c) 2015 Carnegie Mellon University.
+# All Rights Reserved.
+# 
+# THIS SOFTWARE IS PROVIDED "AS IS," WITH NO WARRANTIES WHATSOEVER. CARNEGIE MELLON UNIVERSITY EXPRESSLY DISCLAIMS TO THE FULLEST EXTENT PERMITTEDBY LAW ALL EXPRESS, IMPLIED, AND STATUTORY WARRANTIES, INCLUDING, WITHOUT LIMITATION, THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, AND NON-INFRINGEMENT OF PROPRIETARY RIGHTS.
+# 
+# Released under a modified BSD license, please see license.txt for full terms.
+# DM-0002138
+# 
+# KD-Cloudlet includes and/or makes use of the following Third-Party Software subject to their own licenses:
+# MiniMongo
+# Copyright (c) 2010-2014, Steve Lacy 
+# All rights reserved. Released under BSD license.
+# https://github.com/MiniMongo/minimongo/blob/master/LICENSE
+# 
+# Bootstrap
+# Copyright (c) 2011-2015 Twitter, Inc.
+# Released under the MIT License
+# https://github.com/twbs/bootstrap/blob/master/LICENSE
+# 
+# jQuery JavaScript Library v1.11.0
+# http://jquery.com/
+# Includes Sizzle.js
+# http://sizzlejs.com/
+# Copyright 2005, 2014 jQuery Foundation, Inc. and other contributors
+# Released under the MIT license
+# http://jquery.org/license
+
+import threading
+import time
+
+from pycloud.pycloud.model.servicevm import ServiceVM
+
+# Singleton object to handle idle SVMs for this process.
+_g_singletonHibernationManager = None
+
+
+################################################################################################################
+# Creates the HibernationManager singleton, or gets an instance of it if it had been already created.
+################################################################################################################
+def get_hibernation_manager():
+    global _g_singletonHibernationManager
+    if not _g_singletonHibernationManager:
+        _g_singletonHibernationManager = HibernationManager()
+
+    return _g_singletonHibernationManager
+
+
+################################################################################################################
+# Keeps SVMs whose last user left around for a while, so that they can be reused without a cold start. Following
+# the idle policy of its service, an idle SVM is first kept paused for idle_pause_time seconds, then its memory
+# state is saved to its own state file for idle_save_time seconds, and only then it is destroyed. Idle SVMs are not
+# ready, so they are only visible to reclaim(). All state changes are done with conditional updates, so that an SVM
+# being reclaimed is never saved or destroyed at the same time, even from another app.
+################################################################################################################
+class HibernationManager(object):
+
+    # Time between checks of idle SVMs.
+    CHECK_INTERVAL_IN_S = 5
+
+    ################################################################################################################
+    # Constructor.
+    ################################################################################################################
+    def __init__(self):
+        self.check_thread = None
+        self.stats_lock = threading.Lock()
+        self.stats = {}
+
+    ################################################################################################################
+    # Starts the background thread that moves idle SVMs through their states, if it was not started already.
+    ################################################################################################################
+    def start(self):
+        if self.check_thread is not None:
+            return
+
+        print 'Starting idle SVM checker.'
+        self.check_thread = threading.Thread(target=self._check_loop, name='idle-svm-checker')
+        self.check_thread.daemon = True
+        self.check_thread.start()
+
+    ################################################################################################################
+    # Returns the times an SVM of the service is kept paused and saved when idle, in seconds.
+    ################################################################################################################
+    @staticmethod
+    def _get_idle_times(service):
+        if not service:
+            return 0, 0
+        return max(service.idle_pause_time or 0, 0), max(service.idle_save_time or 0, 0)
+
+    ################################################################################################################
+    # Pauses an SVM whose last user just left, if its service has an idle policy. Returns False if the SVM should be
+    # stopped instead.
+    ################################################################################################################
+    def hibernate(self, svm):
+        from pycloud.pycloud.model.service import Service
+        pause_time, save_time = HibernationManager._get_idle_times(Service.by_id(svm.service_id))
+        if pause_time <= 0 and save_time <= 0:
+            return False
+
+        try:
+            if not svm.vm or not svm.pause():
+                raise Exception('SVM could not be paused.')
+        except Exception as e:
+            print 'Error pausing idle SVM with id {}: {}'.format(svm._id, str(e))
+            return False
+
+        ServiceVM.find_and_modify(query={'_id': svm._id},
+                                  update={'$set': {'running': False, 'idle_state': ServiceVM.IDLE_PAUSED,
+                                                   'idle_since': time.time()}})
+        print 'SVM with id {} is now idle and paused.'.format(svm._id)
+        self._count(svm.service_id, 'hibernated')
+        return True
+
+    ################################################################################################################
+    # Returns an idle SVM of the service, resumed and ready, or None if there was none. Paused ones are preferred,
+    # since they only have to be unpaused.
+    ################################################################################################################
+    def reclaim(self, service):
+        svm = ServiceVM.find_and_modify(query={'service_id': service.service_id,
+                                               'idle_state': {'$in': [ServiceVM.IDLE_PAUSED, ServiceVM.IDLE_SAVED]}},
+                                        update={'$set': {'idle_state': ServiceVM.IDLE_RECLAIMING}},
+                                        sort=[('idle_state', 1)])
+        if not svm:
+            return None
+
+        previous_state = svm.idle_state
+        print 'Reclaiming {} idle SVM with id {}.'.format(previous_state, svm._id)
+        try:
+            if previous_state == ServiceVM.IDLE_PAUSED:
+                svm.connect_to_vm()
+                if not svm.vm or not svm.unpause():
+                    raise Exception('SVM could not be unpaused.')
+            else:
+                # Restore it from its own saved state.
+                svm.start()
+
+            svm.idle_state = None
+            svm.idle_since = None
+            svm.save()
+        except Exception as e:
+            print 'Error reclaiming idle SVM with id {}: {}'.format(svm._id, str(e))
+            svm.idle_state = previous_state
+            svm.stop()
+            self._count(service.service_id, 'reclaim_errors')
+            return None
+
+        self._count(service.service_id, 'reclaimed_' + previous_state)
+        return svm
+
+    ################################################################################################################
+    # Returns a copy of the idle SVM stats, by service id.
+    ################################################################################################################
+    def get_stats(self):
+        with self.stats_lock:
+            stats = {}
+            for service_id in self.stats:
+                stats[service_id] = dict(self.stats[service_id])
+        for service_id in stats:
+            service_stats = stats[service_id]
+            service_stats['cold_starts_avoided'] = service_stats['reclaimed_paused'] + service_stats['reclaimed_saved']
+            stats[service_id]['idle'] = ServiceVM.find({'service_id': service_id,
+                                                        'idle_state': {'$in': [ServiceVM.IDLE_PAUSED,
+                                                                               ServiceVM.IDLE_SAVED]}}).count()
+        return stats
+
+    ################################################################################################################
+    # Main loop of the checker thread.
+    ################################################################################################################
+    def _check_loop(self):
+        while True:
+            time.sleep(self.CHECK_INTERVAL_IN_S)
+            try:
+                self._check_idle_svms()
+            except Exception as e:
+                print 'Error checking idle SVMs: ' + str(e)
+
+    ################################################################################################################
+    # Saves or destroys the idle SVMs that have been idle for long enough.
+    ################################################################################################################
+    def _check_idle_svms(self):
+        from pycloud.pycloud.model.service import Service
+        services = {}
+        now = time.time()
+        idle_svms = ServiceVM.find_all({'idle_state': {'$in': [ServiceVM.IDLE_PAUSED, ServiceVM.IDLE_SAVED]}},
+                                       only_find_ready_ones=False)
+        for svm in idle_svms:
+            if svm.service_id not in services:
+                services[svm.service_id] = Service.by_id(svm.service_id)
+            pause_time, save_time = HibernationManager._get_idle_times(services[svm.service_id])
+            idle_time = now - (svm.idle_since or 0)
+
+            if svm.idle_state == ServiceVM.IDLE_PAUSED and idle_time >= pause_time:
+                if save_time > 0:
+                    self._save(svm, services[svm.service_id])
+                else:
+                    self._expire(svm)
+            elif svm.idle_state == ServiceVM.IDLE_SAVED and idle_time >= pause_time + save_time:
+                self._expire(svm)
+
+    ################################################################################################################
+    # Saves the memory state of a paused idle SVM to its state file, in the service's format, which also removes the VM.
+    ################################################################################################################
+    def _save(self, svm, service):
+        if not ServiceVM.find_and_modify(query={'_id': svm._id, 'idle_state': ServiceVM.IDLE_PAUSED},
+                                         update={'$set': {'idle_state': ServiceVM.IDLE_SAVING}}):
+            return
+
+        print 'Saving state of idle SVM with id {}.'.format(svm._id)
+        try:
+            svm._save_state()
+            if service:
+                svm.vm_image.convert_state_image(service.state_image_format)
+        except Exception as e:
+            print 'Error saving state of idle SVM with id {}: {}'.format(svm._id, str(e))
+            svm.stop()
+            self._count(svm.service_id, 'expired')
+            return
+
+        ServiceVM.find_and_modify(query={'_id': svm._id, 'idle_state': ServiceVM.IDLE_SAVING},
+                                  update={'$set': {'idle_state': ServiceVM.IDLE_SAVED}})
+        self._count(svm.service_id, 'saved')
+
+    ################################################################################################################
+    # Stops an idle SVM that was not reclaimed in time.
+    ################################################################################################################
+    def _expire(self, svm):
+        if not ServiceVM.find_and_modify(query={'_id': svm._id, 'idle_state': svm.idle_state},
+                                         update={'$set': {'idle_state': ServiceVM.IDLE_EXPIRED}}):
+            return
+
+        print 'Idle SVM with id {} was not reclaimed in time, stopping it.'.format(svm._id)
+        svm.stop()
+        self._count(svm.service_id, 'expired')
+
+    ################################################################################################################
+    # Updates a counter for the given service.
+    ################################################################################################################
+    def _count(self, service_id, counter):
+        with self.stats_lock:
+            if service_id not in self.stats:
+                self.stats[service_id] = {'hibernated': 0, 'saved': 0, 'expired': 0, 'reclaimed_paused': 0,
+                                          'reclaimed_saved': 0, 'reclaim_errors': 0}
+            self.stats[service_id][counter] += 1
@@ -0,0 +1,238 @@
+# KVM-based Discoverable Cloudlet (KD-Cloudlet) 
+# Copyright (c) 2015 Carnegie Mellon University.
+# All Rights Reserved.
+# 
+# THIS SOFTWARE IS PROVIDED "AS IS," WITH NO WARRANTIES WHATSOEVER. CARNEGIE MELLON UNIVERSITY EXPRESSLY DISCLAIMS TO THE FULLEST EXTENT PERMITTEDBY LAW ALL EXPRESS, IMPLIED, AND STATUTORY WARRANTIES, INCLUDING, WITHOUT LIMITATION, THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, AND NON-INFRINGEMENT OF PROPRIETARY RIGHTS.
+# 
+# Released under a modified BSD license, please see license.txt for full terms.
+# DM-0002138
+# 
+# KD-Cloudlet includes and/or makes use of the following Third-Party Software subject to their own licenses:
+# MiniMongo
+# Copyright (c) 2010-2014, Steve Lacy 
+# All rights reserved. Released under BSD license.
+# https://github.com/MiniMongo/minimongo/blob/master/LICENSE
+# 
+# Bootstrap
+# Copyright (c) 2011-2015 Twitter, Inc.
+# Released under the MIT License
+# https://github.com/twbs/bootstrap/blob/master/LICENSE
+# 
+# jQuery JavaScript Library v1.11.0
+# http://jquery.com/
+# Includes Sizzle.js
+# http://sizzlejs.com/
+# Copyright 2005, 2014 jQuery Foundation, Inc. and other contributors
+# Released under the MIT license
+# http://jquery.org/license
+
+
+import collections
+import logging
+import threading
+import time
+
+from pycloud.pycloud.cloudlet import get_cloudlet_instance
+from pycloud.pycloud.utils.jobqueue import Job, JobQueue
+from pycloud.pycloud.utils.ratelimit import RateLimiter
+
+log = logging.getLogger(__name__)
+
+# Singleton object with the queue of migration jobs for this process.
+_g_singletonMigrationJobQueue = None
+_g_singletonLock = threading.Lock()
+
+
+################################################################################################################
+# Creates the MigrationJobQueue singleton, or gets an instance of it if it had been already created.
+################################################################################################################
+def get_migration_job_queue():
+    global _g_singletonMigrationJobQueue
+    with _g_singletonLock:
+        if not _g_singletonMigrationJobQueue:
+            _g_singletonMigrationJobQueue = MigrationJobQueue(get_cloudlet_instance().migration_workers)
+
+    return _g_singletonMigrationJobQueue
+
+
+################################################################################################################
+# Progress of a migration of an SVM to another cloudlet, which may be executed in the background. Keeps the bytes
+# processed and sent in each phase, from which the current rate and the time left in the current phase are estimated,
+# and the bandwidth cap of the migration, which can be changed while it runs.
+################################################################################################################
+class MigrationJob(Job):
+
+    # Phases that indicate the job has finished.
+    PHASE_FINISHED = 'finished'
+    PHASE_FAILED = 'failed'
+
+    # Seconds of samples used to calculate the current rate.
+    RATE_WINDOW_IN_S = 5.0
+
+    ################################################################################################################
+    # Constructor. The max bandwidth is in bytes per second, None or 0 for no limit.
+    ################################################################################################################
+    def __init__(self, svm_id, remote_host, remote_ip, encrypted, max_bandwidth=None):
+        super(MigrationJob, self).__init__()
+        self.svm_id = svm_id
+        self.remote_host = remote_host
+        self.remote_ip = remote_ip
+        self.encrypted = encrypted
+        self.rate_limiter = RateLimiter(max_bandwidth)
+        self.phases = collections.OrderedDict()
+        self.result = None
+
+        # Samples of the total bytes processed, (time, bytes), to calculate the current rate.
+        self.bytes_done = 0
+        self.samples = collections.deque()
+        self.lock = threading.Lock()
+
+    ################################################################################################################
+    # Updates the current phase, and the amount of bytes it has to process if known. Called by the migration.
+    ################################################################################################################
+    def set_phase(self, phase, total_bytes=None):
+        log.info('Migration job {} is now in phase {}'.format(self.job_id, phase))
+        with self.lock:
+            self.phase = phase
+            if phase in [self.PHASE_FINISHED, self.PHASE_FAILED]:
+                return
+            progress = self._get_phase_progress(phase)
+            if total_bytes is not None:
+                progress['total_bytes'] = total_bytes
+
+    ################################################################################################################
+    # Adds to a phase bytes of data it processed, and the bytes actually sent for them, once compressed.
+    ################################################################################################################
+    def add_bytes(self, phase, bytes_done, bytes_sent=None):
+        with self.lock:
+            progress = self._get_phase_progress(phase)
+            progress['bytes_done'] += bytes_done
+            progress['bytes_sent'] += bytes_done if bytes_sent is None else bytes_sent
+            self._add_sample(bytes_done)
+
+    ################################################################################################################
+    # Sets the progress of a phase tracked by someone else, such as libvirt for the memory. Remaining bytes can be
+    # given when they are not simply the total minus the bytes processed, like when memory changes while it is sent.
+    ################################################################################################################
+    def set_phase_progress(self, phase, bytes_done, total_bytes, bytes_remaining=None):
+        with self.lock:
+            progress = self._get_phase_progress(phase)
+            self._add_sample(max(0, bytes_done - progress['bytes_done']))
+            progress['bytes_done'] = bytes_done
+            progress['bytes_sent'] = bytes_done
+            progress['total_bytes'] = total_bytes
+            if bytes_remaining is not None:
+                progress['bytes_remaining'] = bytes_remaining
+
+    ################################################################################################################
+    # Changes the max bandwidth of the migration, in bytes per second; None or 0 removes the limit.
+    ################################################################################################################
+    def set_bandwidth_limit(self, max_bandwidth):
+        log.info('Migration job {} bandwidth limit set to {}'.format(self.job_id, max_bandwidth))
+        self.rate_limiter.set_max_rate(max_bandwidth)
+
+    ################################################################################################################
+    # Returns the max bandwidth of the migration, in bytes per second, or None if there is no limit.
+    ################################################################################################################
+    def get_bandwidth_limit(self):
+        return self.rate_limiter.get_max_rate()
+
+    ################################################################################################################
+    # Migrates the SVM. Executed by a worker of the job queue. If given, after_migration is called once the SVM is
+    # running on the remote cloudlet.
+    ################################################################################################################
+    def run(self, after_migration=None):
+        try:
+            # Imported here since the migrator uses this module.
+            from pycloud.pycloud.model import migrator
+
+            self.result = migrator.migrate_svm(self.svm_id, self.remote_host, self.remote_ip, self.encrypted, job=self)
+            if after_migration:
+                after_migration()
+            self.set_phase(self.PHASE_FINISHED)
+        except Exception as e:
+            log.exception('Error migrating Service VM Instance: ' + str(e))
+            self.error = str(e)
+            self.set_phase(self.PHASE_FAILED)
+        finally:
+            self.end_time = time.time()
+
+    ################################################################################################################
+    # Returns a dict with the status of the job: the bytes processed and sent in each phase, the current rate and
+    # estimated seconds left in the current phase (None if unknown), and, once it finished, its result.
+    ################################################################################################################
+    def get_status(self):
+        end_time = self.end_time if self.end_time else time.time()
+        with self.lock:
+            rate = self._get_rate() if not self.is_finished() else 0.0
+            phases = collections.OrderedDict((phase, dict(progress)) for phase, progress in self.phases.iteritems())
+            eta = None
+            current_progress = phases.get(self.phase)
+            if current_progress and rate > 0:
+                bytes_remaining = current_progress.get('bytes_remaining')
+                if bytes_remaining is None and current_progress['total_bytes'] is not None:
+                    bytes_remaining = max(0, current_progress['total_bytes'] - current_progress['bytes_done'])
+                if bytes_remaining is not None:
+                    eta = bytes_remaining / rate
+
+        status = {'job_id': self.job_id,
+                  'svm_id': self.svm_id,
+                  'phase': self.phase,
+                  'phases': phases,
+                  'rate': rate,
+                  'eta': eta,
+                  'max_bandwidth': self.get_bandwidth_limit(),
+                  'elapsed_time': end_time - self.start_time}
+        if self.error:
+            status['error'] = self.error
+        if self.result:
+            status['result'] = self.result
+        return status
+
+    ################################################################################################################
+    # Returns the progress of a phase, adding it if it had no progress yet. Must be called with the lock held.
+    ################################################################################################################
+    def _get_phase_progress(self, phase):
+        if phase not in self.phases:
+            self.phases[phase] = {'bytes_done': 0, 'bytes_sent': 0, 'total_bytes': None}
+        return self.phases[phase]
+
+    ################################################################################################################
+    # Adds processed bytes to the samples used for the rate, dropping the ones that are too old. Must be called with
+    # the lock held.
+    ################################################################################################################
+    def _add_sample(self, bytes_done):
+        now = time.time()
+        self.bytes_done += bytes_done
+        self.samples.append((now, self.bytes_done))
+        while len(self.samples) > 2 and now - self.samples[1][0] > self.RATE_WINDOW_IN_S:
+            self.samples.popleft()
+
+    ################################################################################################################
+    # Returns the bytes processed per second over the last samples. Must be called with the lock held.
+    ################################################################################################################
+    def _get_rate(self):
+        if not self.samples:
+            return 0.0
+        first_time, first_bytes = self.samples[0]
+        elapsed = max(time.time() - first_time, 1.0)
+        return (self.bytes_done - first_bytes) / elapsed
+
+
+################################################################################################################
+# Queue of migration jobs, executed by a fixed amount of workers.
+################################################################################################################
+class MigrationJobQueue(JobQueue):
+
+    ################################################################################################################
+    # Constructor.
+    ################################################################################################################
+    def __init__(self, num_workers):
+        super(MigrationJobQueue, self).__init__(num_workers, name='svm-migration')
+
+    ################################################################################################################
+    # Queues a new job to migrate an SVM, capped to max_bandwidth bytes per second if given. If given, after_migration
+    # is called once the SVM is running on the remote cloudlet.
+    ################################################################################################################
+    def submit(self, svm_id, remote_host, remote_ip, encrypted, max_bandwidth=None, after_migration=None):
+        return self._submit_job(MigrationJob(svm_id, remote_host, remote_ip, encrypted, max_bandwidth), after_migration)
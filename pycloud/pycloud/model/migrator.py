@@ -27,7 +27,10 @@
 # http://jquery.org/license
 
 import json
+import logging
 import os
+import threading
+import time
 
 # External library for creating HTTP requests.
 import requests
@@ -43,14 +46,68 @@ from pycloud.pycloud.model.message import AddTrustedCloudletDeviceMessage, Conne
 from pycloud.pycloud.model.servicevm import SVMNotFoundException
 from pycloud.pycloud.model.cloudlet_credential import CloudletCredential
 from pycloud.pycloud.model.deployment import DeviceAlreadyPairedException
+from pycloud.pycloud.model.migrationjob import MigrationJob
+from pycloud.pycloud.utils import metrics
+from pycloud.pycloud.utils.threadpool import ThreadPool
+from pycloud.pycloud.utils.ratelimit import ThrottledStream
+from pycloud.pycloud.vm.diskprecopy import DiskPreCopier, ChunkReceiver, describe_chunks, DEFAULT_CHUNK_SIZE
+from pycloud.pycloud.vm.chunkstore import ManifestReceiver, get_manifest, get_fingerprint, send_missing_chunks, \
+    describe_missing_chunks
+from pycloud.pycloud.vm.chunkcodec import AdaptiveEncoder, ENCODING_RAW
+
+log = logging.getLogger(__name__)
 
 # API migration commands
 MIGRATE_METADATA_CMD = '/servicevm/migration_svm_metadata'
-MIGRATE_DISK_CMD = '/servicevm/migration_svm_disk_file'
+MIGRATE_DISK_CHUNKS_CMD = '/servicevm/migration_svm_disk_chunks'
+MIGRATE_DISK_FINISH_CMD = '/servicevm/migration_svm_disk_finish'
+MIGRATE_DISK_STATUS_CMD = '/servicevm/migration_svm_disk_status'
+MIGRATE_BASE_NEGOTIATE_CMD = '/servicevm/migration_svm_base_negotiate'
+MIGRATE_BASE_CHUNKS_CMD = '/servicevm/migration_svm_base_chunks'
 MIGRATE_CREDENTIALS_CMD = '/servicevm/migration_generate_credentials'
 MIGRATE_RESUME_CMD = '/servicevm/migration_svm_resume'
 MIGRATE_ABORT_CMD = '/servicevm/abort_migration'
 
+# Seconds between checks of the progress of the memory migration, and of changes to its bandwidth limit.
+MEMORY_MONITOR_INTERVAL_IN_S = 1
+
+# The remote cloudlet prepares the backing image in the background, since that means hashing its local images; the
+# sender checks every few seconds whether it is ready, for a limited time. Each request waits a limited time for a reply.
+BASE_NEGOTIATION_POLL_INTERVAL_IN_S = 2
+BASE_NEGOTIATION_TIMEOUT_IN_S = 30 * 60
+API_REQUEST_TIMEOUT_IN_S = 60
+
+# Time taken and bytes sent by each phase of outgoing migrations (metadata, disk and memory), and total time of
+# successful ones.
+MIGRATION_SECONDS = metrics.histogram('pycloud_migration_seconds', 'Time taken by a phase of a migration.', ['phase'])
+MIGRATION_BYTES = metrics.counter('pycloud_migration_bytes_total', 'Bytes sent by migrations.', ['phase'])
+
+# Bytes of disk and backing images actually sent by migrations, once compressed, and the compression ratio achieved.
+MIGRATION_WIRE_BYTES = metrics.counter('pycloud_migration_wire_bytes_total',
+                                       'Bytes of disk images sent by migrations, after compression.')
+MIGRATION_COMPRESSION_RATIO = metrics.histogram('pycloud_migration_compression_ratio',
+                                                'Original bytes per byte sent of the disk images of a migration.',
+                                                buckets=(1, 1.25, 1.5, 2, 3, 5, 10, 20, 50))
+
+# Time migrated SVMs are paused, from the moment they are paused here until they are resumed on the remote cloudlet.
+MIGRATION_DOWNTIME_SECONDS = metrics.histogram('pycloud_migration_downtime_seconds', 'Time a migrated SVM is paused.')
+
+# HTTP sessions used to send API commands, one per thread, so that each stream of a migration keeps its connection open.
+_sessions = threading.local()
+
+# Pool of workers that send the batches of the disk images of outgoing migrations over parallel streams, and the
+# requests pipelined with them.
+_streams_pool = None
+_streams_pool_lock = threading.Lock()
+
+# Transfers of disk image files, and of the backing images they need when they are not the same as the ones of the
+# local service, of SVMs being migrated to this cloudlet, by SVM id. The negotiations of the backing images being
+# prepared are kept until they are ready, with the error that stopped them if any.
+_disk_receivers = {}
+_base_receivers = {}
+_base_negotiations = {}
+_disk_receivers_lock = threading.Lock()
+
 
 ################################################################################################################
 # Exception type used in this module.
@@ -61,11 +118,22 @@ class MigrationException(Exception):
         self.message = message
 
 
+############################################################################################################
+# Returns the pool of workers used to send migration data, creating it if needed.
+############################################################################################################
+def __get_streams_pool():
+    global _streams_pool
+    with _streams_pool_lock:
+        if _streams_pool is None:
+            _streams_pool = ThreadPool(get_cloudlet_instance().migration_streams, name='migration-streams')
+    return _streams_pool
+
+
 ############################################################################################################
 #
 ############################################################################################################
 def __print_request(prepared):
-    print('{}\n{}\n{}\n\n{}'.format(
+    log.debug('{}\n{}\n{}\n\n{}'.format(
         '-----------START-----------',
         prepared.method + ' ' + prepared.url,
         '\n'.join('{}: {}'.format(k, v) for k, v in prepared.headers.items()),
@@ -76,7 +144,9 @@ def __print_request(prepared):
 ############################################################################################################
 # Creates the appropriate URL for an API command.
 ############################################################################################################
-def __send_api_command(host, command, encrypted, payload, headers={}, files={}):
+def __send_api_command(host, command, encrypted, payload, headers={}, files={}, body=None, timeout=None):
+    # Copy the headers, to avoid changing the default dict shared by all calls.
+    headers = dict(headers)
     if encrypted:
         # We need to send our id so that the remote API will be able to decrypt our requests properly.
         headers['X-Device-ID'] = Cloudlet.get_id()
@@ -102,12 +172,20 @@ def __send_api_command(host, command, encrypted, payload, headers={}, files={}):
         payload = {}
         payload['command'] = encrypted_command
 
-    req = requests.Request('POST', remote_url, data=payload, headers=headers, files=files)
+    if body is None:
+        req = requests.Request('POST', remote_url, data=payload, headers=headers, files=files)
+    else:
+        # Raw data is sent as the body, with the params in the URL, so that the receiver can read it as a stream.
+        headers['Content-Type'] = 'application/octet-stream'
+        req = requests.Request('POST', remote_url, params=payload, data=body, headers=headers)
     prepared = req.prepare()
-    print remote_url
+    log.info(remote_url)
 
-    session = requests.Session()
-    response = session.send(prepared)
+    session = getattr(_sessions, 'session', None)
+    if session is None:
+        session = requests.Session()
+        _sessions.session = session
+    response = session.send(prepared, timeout=timeout)
 
     if response.status_code != requests.codes.ok:
         raise Exception('Error sending request {}: {} - {}'.format(command, response.status_code, response.text))
@@ -120,66 +198,270 @@ def __send_api_command(host, command, encrypted, payload, headers={}, files={}):
 
 
 ############################################################################################################
-# Command to migrate a machine.
+# Sends chunks encoded with the given encoder, described with describe(chunks, encoded_chunks), within the bandwidth
+# limit of the migration job, and tells the encoder how long that took. The bytes sent are added to the current phase
+# of the job.
+############################################################################################################
+def __send_encoded_chunks(remote_host, command, encrypted, payload, chunks, describe, encoder, job):
+    encode_start_time = time.time()
+    encoded_chunks = [encoder.encode(chunk.data) for chunk in chunks]
+    payload = dict(payload)
+    payload['chunks'] = json.dumps(describe(chunks, encoded_chunks))
+    body = ''.join(encoded_data for encoding, encoded_data in encoded_chunks)
+    original_bytes = sum(len(chunk.data) for chunk in chunks)
+    wire_bytes = len(body) + len(payload['chunks'])
+
+    start_time = time.time()
+    __send_api_command(remote_host, command, encrypted, payload, body=ThrottledStream(body, job.rate_limiter))
+    encoder.record_transfer(original_bytes, wire_bytes, time.time() - start_time, encode_start_time)
+    job.add_bytes(job.phase, original_bytes, wire_bytes)
+
+
+############################################################################################################
+# Returns a function that sends chunks of the disk image file of an SVM being migrated to the remote cloudlet.
+############################################################################################################
+def __get_disk_chunks_sender(remote_host, encrypted, svm_id, encoder, job):
+    def send_chunks(chunks, file_size):
+        payload = {'id': svm_id, 'file_size': file_size if file_size is not None else ''}
+        __send_encoded_chunks(remote_host, MIGRATE_DISK_CHUNKS_CMD, encrypted, payload, chunks, describe_chunks,
+                              encoder, job)
+    return send_chunks
+
+
+############################################################################################################
+# Returns a function that gets which chunks of the disk image file the remote cloudlet has written.
+############################################################################################################
+def __get_disk_status_getter(remote_host, encrypted, svm_id):
+    def get_receiver_status():
+        result, response_text = __send_api_command(remote_host, MIGRATE_DISK_STATUS_CMD, encrypted, {'id': svm_id})
+        status = json.loads(response_text)
+        status.setdefault('last_chunk', -1)
+        return status
+    return get_receiver_status
+
+
+############################################################################################################
+# Tells the remote cloudlet which backing image the disk image of the SVM needs, given by its manifest, and waits until
+# it has prepared it. Failed requests are retried until the negotiation times out. Returns the encodings the remote
+# cloudlet can decode, and the checksums of the chunks it does not have.
+############################################################################################################
+def __negotiate_base_image(remote_host, encrypted, svm_id, base_image_path, manifest):
+    payload = {'id': svm_id, 'fingerprint': get_fingerprint(manifest), 'file_size': os.path.getsize(base_image_path)}
+    deadline = time.time() + BASE_NEGOTIATION_TIMEOUT_IN_S
+    negotiation = None
+    while True:
+        try:
+            if negotiation is None:
+                result, response_text = __send_api_command(remote_host, MIGRATE_BASE_NEGOTIATE_CMD, encrypted, payload,
+                                                           body=json.dumps(manifest), timeout=API_REQUEST_TIMEOUT_IN_S)
+                negotiation = json.loads(response_text)
+
+            result, response_text = __send_api_command(remote_host, MIGRATE_DISK_STATUS_CMD, encrypted, {'id': svm_id},
+                                                       timeout=API_REQUEST_TIMEOUT_IN_S)
+            base_status = json.loads(response_text).get('base', {})
+            if base_status.get('error'):
+                raise MigrationException('Remote cloudlet could not prepare the backing image: ' + base_status['error'])
+            if base_status.get('ready'):
+                return negotiation.get('encodings', [ENCODING_RAW]), base_status['missing_chunks']
+        except MigrationException:
+            raise
+        except Exception as e:
+            log.warning('Error negotiating backing image with remote cloudlet, will retry: ' + str(e))
+
+        if time.time() > deadline:
+            raise MigrationException('Timed out waiting for remote cloudlet to prepare the backing image')
+        time.sleep(BASE_NEGOTIATION_POLL_INTERVAL_IN_S)
+
+
 ############################################################################################################
-def migrate_svm(svm_id, remote_host, remote_ip, encrypted):
+# Negotiates the backing image the disk image of the SVM needs with the remote cloudlet, and sends the chunks of it
+# that the remote cloudlet does not have over parallel streams. The encoder is limited to the encodings the remote
+# cloudlet can decode. Returns the amount of bytes sent.
+############################################################################################################
+def __send_base_image(remote_host, encrypted, svm_id, base_image_path, manifest, encoder, job, pool, max_streams):
+    encodings, missing_chunks = __negotiate_base_image(remote_host, encrypted, svm_id, base_image_path, manifest)
+    encoder.set_encodings(encodings)
+    if not missing_chunks:
+        log.info('Remote cloudlet already has the backing image.')
+        return 0
+    log.info('Remote cloudlet lacks {} of {} chunks of the backing image.'.format(len(missing_chunks), len(manifest)))
+    job.set_phase(job.phase, total_bytes=len(missing_chunks) * DEFAULT_CHUNK_SIZE)
+
+    def send_chunks(chunks, file_size):
+        __send_encoded_chunks(remote_host, MIGRATE_BASE_CHUNKS_CMD, encrypted, {'id': svm_id}, chunks,
+                              describe_missing_chunks, encoder, job)
+
+    def get_pending_chunks(chunks):
+        status_result, status_text = __send_api_command(remote_host, MIGRATE_DISK_STATUS_CMD, encrypted, {'id': svm_id})
+        still_missing = set(json.loads(status_text)['base']['missing_chunks'])
+        return [chunk for chunk in chunks if chunk.checksum in still_missing]
+
+    return send_missing_chunks(base_image_path, manifest, missing_chunks, send_chunks, get_pending_chunks, pool=pool,
+                               max_streams=max_streams)
+
+
+############################################################################################################
+# Asks the remote cloudlet for credentials for a device paired to an SVM being migrated there. Returns them
+# serialized.
+############################################################################################################
+def __request_device_credentials(remote_host, encrypted, svm_id, device_id, job):
+    # So that the paired device has a connection id on the remote cloudlet, we set it as this cloudlet's id
+    # plus the device id. Connection id is commonly used with USB or Bluetooth pairing as a way to identify
+    # the ID of the physical connection used when pairing. This gives similar auditing possibilities.
+    log.info('Starting remote credentials generation for device {}...'.format(device_id))
+    deployment = Deployment.get_instance()
+    connection_id = deployment.cloudlet.get_id() + "-" + device_id
+    payload = {'device_id': device_id, 'connection_id': connection_id, 'svm_id': svm_id}
+    response, serialized_credentials = __send_api_command(remote_host, MIGRATE_CREDENTIALS_CMD, encrypted, payload)
+    job.add_bytes('credentials', len(serialized_credentials))
+    return serialized_credentials
+
+
+############################################################################################################
+# Adds the progress of the memory migration of an SVM, as reported by libvirt, to the migration job, and applies
+# changes to the bandwidth limit of the job, until the stop event is set.
+############################################################################################################
+def __monitor_memory_migration(svm, job, max_rate, stop_event):
+    while not stop_event.wait(MEMORY_MONITOR_INTERVAL_IN_S):
+        try:
+            if job.get_bandwidth_limit() != max_rate:
+                max_rate = job.get_bandwidth_limit()
+                svm.vm.set_migration_max_speed(max_rate)
+
+            bytes_processed, bytes_remaining, bytes_total = svm.vm.get_job_progress()
+            if bytes_total:
+                job.set_phase_progress('memory', bytes_processed, bytes_total, bytes_remaining)
+        except Exception as e:
+            log.warning('Could not check progress of memory migration: {}'.format(str(e)))
+
+
+############################################################################################################
+# Command to migrate a machine. Returns the time the SVM was paused in seconds ('downtime'), and how the disk and
+# backing images were sent, including the compression ratio and effective bandwidth achieved (see AdaptiveEncoder).
+# The progress of each phase is kept in the given migration job, whose bandwidth limit is applied to all data sent.
+############################################################################################################
+def migrate_svm(svm_id, remote_host, remote_ip, encrypted, job=None):
+    if job is None:
+        job = MigrationJob(svm_id, remote_host, remote_ip, encrypted)
+
     # Find the SVM.
     svm = ServiceVM.by_id(svm_id)
     if svm is None:
         raise MigrationException("SVM with id %s was not found" % str(svm_id))
 
     # remote_host has host and port.
-    print 'VM found: ' + str(svm)
-    print 'Migrating to remote cloudlet: ' + remote_host
+    log.info('VM found: ' + str(svm))
+    log.info('Migrating to remote cloudlet: ' + remote_host)
 
-    # Transfer the metadata.
-    print 'Starting metadata file transfer...'
-    payload = {'svm_json_string': svm.to_json_string()}
-    result, response_text = __send_api_command(remote_host, MIGRATE_METADATA_CMD, encrypted, payload)
-    print 'Metadata was transferred: ' + str(result)
+    service = Service.by_id(svm.service_id)
+    if not service:
+        raise MigrationException("Service {} of SVM {} was not found".format(svm.service_id, svm_id))
 
-    # We pause the VM before transferring its disk and memory state.
-    print 'Pausing VM...'
-    was_pause_successful = svm.pause()
-    if not was_pause_successful:
-        raise MigrationException("Cannot pause VM: %s" % str(svm_id))
-    print 'VM paused.'
+    # The manifest of the backing image, needed to negotiate it, is calculated while the metadata is sent.
+    cloudlet = get_cloudlet_instance()
+    pool = __get_streams_pool()
+    base_image_path = os.path.abspath(service.vm_image.disk_image)
+    manifest_future = pool.submit(get_manifest, base_image_path)
 
+    # Transfer the metadata.
+    log.info('Starting metadata file transfer...')
+    migration_start_time = time.time()
+    payload = {'svm_json_string': svm.to_json_string()}
+    job.set_phase('metadata', total_bytes=len(payload['svm_json_string']))
+    with MIGRATION_SECONDS.labels('metadata').time():
+        result, response_text = __send_api_command(remote_host, MIGRATE_METADATA_CMD, encrypted, payload)
+    MIGRATION_BYTES.labels('metadata').inc(len(payload['svm_json_string']))
+    job.add_bytes('metadata', len(payload['svm_json_string']))
+    log.info('Metadata was transferred: ' + str(result))
+
+    # Once the remote cloudlet has the metadata, credentials for the devices paired to the SVM are requested while the
+    # disk is sent; they are only given to the devices once the migration succeeds.
+    credential_requests = [(device, pool.submit(__request_device_credentials, remote_host, encrypted, svm_id,
+                                                device.device_id, job))
+                           for device in PairedDevice.by_instance(svm_id)]
+
+    disk_image_full_path = os.path.abspath(svm.vm_image.disk_image)
+    disk_image_size = os.path.getsize(disk_image_full_path)
+    encoder = AdaptiveEncoder()
+    precopier = DiskPreCopier(disk_image_full_path,
+                              __get_disk_chunks_sender(remote_host, encrypted, svm_id, encoder, job),
+                              __get_disk_status_getter(remote_host, encrypted, svm_id), pool=pool,
+                              max_streams=cloudlet.migration_streams)
     try:
-        # Transfer the disk image file.
-        print 'Starting disk image file transfer...'
-        payload = {'id': svm_id}
-        disk_image_full_path = os.path.abspath(svm.vm_image.disk_image)
-        files = {'disk_image_file': open(disk_image_full_path, 'rb')}
-        result, response_text = __send_api_command(remote_host, MIGRATE_DISK_CMD, encrypted, payload, files=files)
-        print 'Disk image file was transferred: ' + str(result)
+        # Make sure the remote cloudlet has the backing image of the disk before sending the disk itself.
+        log.info('Negotiating backing image with remote cloudlet...')
+        job.set_phase('base')
+        with MIGRATION_SECONDS.labels('base').time():
+            base_bytes_sent = __send_base_image(remote_host, encrypted, svm_id, base_image_path, manifest_future.result(),
+                                                encoder, job, pool, cloudlet.migration_streams)
+        MIGRATION_BYTES.labels('base').inc(base_bytes_sent)
+        log.info('Backing image is available in remote cloudlet, {} bytes sent.'.format(base_bytes_sent))
+
+        if cloudlet.migration_precopy_enabled:
+            # Copy the disk image while the VM keeps running, then only what changes meanwhile, until little is left.
+            log.info('Starting live pre-copy of disk image file...')
+            job.set_phase('disk_precopy', total_bytes=disk_image_size)
+            with MIGRATION_SECONDS.labels('disk_precopy').time():
+                precopier.precopy(cloudlet.migration_precopy_max_rounds,
+                                  cloudlet.migration_precopy_min_delta * 1024 * 1024)
+            MIGRATION_BYTES.labels('disk_precopy').inc(precopier.get_bytes_sent())
+            log.info('Disk image pre-copied, bytes sent per round: {}'.format(precopier.round_bytes))
+
+        # We pause the VM before transferring the rest of its disk and its memory state.
+        log.info('Pausing VM...')
+        was_pause_successful = svm.pause()
+        if not was_pause_successful:
+            raise MigrationException("Cannot pause VM: %s" % str(svm_id))
+        downtime_start_time = time.time()
+        log.info('VM paused.')
+
+        # Transfer the disk image file, or the blocks changed since the last pre-copy round.
+        log.info('Starting disk image file transfer...')
+        bytes_sent_live = precopier.get_bytes_sent()
+        job.set_phase('disk', total_bytes=disk_image_size if bytes_sent_live == 0 else None)
+        with MIGRATION_SECONDS.labels('disk').time():
+            precopier.copy_round()
+            result, response_text = __send_api_command(remote_host, MIGRATE_DISK_FINISH_CMD, encrypted, {'id': svm_id})
+        MIGRATION_BYTES.labels('disk').inc(precopier.get_bytes_sent() - bytes_sent_live)
+        log.info('Disk image file was transferred: ' + str(result))
+
+        transfer_stats = encoder.get_stats()
+        MIGRATION_WIRE_BYTES.labels().inc(transfer_stats['bytes_sent'])
+        MIGRATION_COMPRESSION_RATIO.labels().observe(transfer_stats['compression_ratio'])
+        log.info('Disk images sent with compression ratio {:.2f} at {:.0f} bytes/s, chunks per encoding: {}'.format(
+            transfer_stats['compression_ratio'], transfer_stats['effective_bandwidth'], transfer_stats['chunks']))
 
         # Do the memory state migration.
         remote_host_name = remote_host.split(':')[0]
         remote_host_port = remote_host.split(':')[1]
-        print 'Migrating through libvirtd to {} ({})'.format(remote_host_name, remote_ip)
-        svm.migrate(remote_host_name)
-        print 'Memory migration through libvirtd completed'
-
-        # If needed, ask the remote cloudlet for credentials for the devices associated to the SVM.
-        devices = PairedDevice.by_instance(svm_id)
-        for device in devices:
-            # So that the paired device has a connection id on the remote cloudlet, we set it as this cloudlet's id
-            # plus the device id. Connection id is commonly used with USB or Bluetooth pairing as a way to identify
-            # the ID of the physical connection used when pairing. This gives similar auditing possibilities.
-            print 'Starting remote credentials generation for device {}...'.format(device.device_id)
-            deployment = Deployment.get_instance()
-            connection_id = deployment.cloudlet.get_id() + "-" + device.device_id
-            payload = {'device_id': device.device_id, 'connection_id': connection_id, 'svm_id': svm_id}
-            response, serialized_credentials = __send_api_command(remote_host, MIGRATE_CREDENTIALS_CMD, encrypted, payload)
+        log.info('Migrating through libvirtd to {} ({})'.format(remote_host_name, remote_ip))
+        job.set_phase('memory')
+        max_rate = job.get_bandwidth_limit()
+        stop_monitor = threading.Event()
+        monitor = threading.Thread(target=__monitor_memory_migration, args=(svm, job, max_rate, stop_monitor),
+                                   name='migration-monitor-' + svm_id)
+        monitor.daemon = True
+        monitor.start()
+        try:
+            with MIGRATION_SECONDS.labels('memory').time():
+                svm.migrate(remote_host_name, streams=cloudlet.migration_streams, max_rate=max_rate)
+        finally:
+            stop_monitor.set()
+            monitor.join()
+        log.info('Memory migration through libvirtd completed')
+
+        # Give the devices associated to the SVM the credentials obtained from the remote cloudlet.
+        job.set_phase('credentials')
+        for device, credentials_request in credential_requests:
+            serialized_credentials = credentials_request.result()
 
             # De-serializing generated data.
-            print serialized_credentials
+            log.debug(serialized_credentials)
             paired_device_data_bundle = PairedDeviceDataBundle()
             paired_device_data_bundle.fill_from_dict(json.loads(serialized_credentials))
             paired_device_data_bundle.cloudlet_ip = remote_ip
             paired_device_data_bundle.cloudlet_port = remote_host_port
-            print 'Remote credentials to be sent: ' + str(paired_device_data_bundle)
+            log.debug('Remote credentials to be sent: ' + str(paired_device_data_bundle))
 
             # Create the appropriate command.
             data_contains_only_cloudlet_info = paired_device_data_bundle.auth_password is None
@@ -193,9 +475,16 @@ def migrate_svm(svm_id, remote_host, remote_ip, encrypted):
             device_command.service_id = svm.service_id
             device_command.save()
     except Exception as e:
-        # If migration fails, ask remote to remove svm.
-        print 'Error migrating: {}'.format(e.message)
-        print 'Requesting migration abort for cleanup...'
+        # If migration fails, ask remote to remove svm, once it is done generating credentials so that they are
+        # removed too.
+        log.error('Error migrating: {}'.format(e.message))
+        for device, credentials_request in credential_requests:
+            try:
+                credentials_request.result()
+            except Exception as credentials_error:
+                log.warning('Credentials for device {} were not generated: {}'.format(device.device_id,
+                                                                                     str(credentials_error)))
+        log.info('Requesting migration abort for cleanup...')
         payload = {'svm_id': svm_id}
         result, response_text = __send_api_command(remote_host, MIGRATE_ABORT_CMD, encrypted, payload)
 
@@ -204,18 +493,27 @@ def migrate_svm(svm_id, remote_host, remote_ip, encrypted):
         for device in devices:
             AddTrustedCloudletDeviceMessage.clear_messages(device.device_id)
 
-        print 'Migration aborted: ' + str(result)
+        log.info('Migration aborted: ' + str(result))
         raise e
 
     # Notify remote cloudlet that migration finished.
-    print 'Asking remote cloudlet to resume migrated VM.'
+    log.info('Asking remote cloudlet to resume migrated VM.')
+    job.set_phase('resume')
     payload = {'id': svm_id}
     result, response_text = __send_api_command(remote_host, MIGRATE_RESUME_CMD, encrypted, payload)
-    print 'Cloudlet notified: ' + str(result)
+    log.info('Cloudlet notified: ' + str(result))
+    downtime = time.time() - downtime_start_time
+    MIGRATION_DOWNTIME_SECONDS.labels().observe(downtime)
+    log.info('SVM was paused for {:.2f} seconds.'.format(downtime))
 
     # Remove the local VM.
     svm = ServiceVM.by_id(svm_id)
     svm.stop()
+    MIGRATION_SECONDS.labels('total').observe(time.time() - migration_start_time)
+
+    migration_result = dict(transfer_stats)
+    migration_result['downtime'] = downtime
+    return migration_result
 
 
 ############################################################################################################
@@ -228,17 +526,18 @@ def receive_migrated_svm_metadata(svm_json_string):
         raise MigrationException("No SVM metadata was received")
 
     # Get information about the SVM.
-    print 'Obtaining metadata of SVM to be received (json string: {}).'.format(svm_json_string)
+    log.info('Obtaining metadata of SVM to be received (json string: {}).'.format(svm_json_string))
     migrated_svm = ServiceVM()
     migrated_svm.fill_from_dict(json_svm_dict)
     migrated_svm.ready = False
 
     # Update network data, especially needed in non-bridged mode.
     migrated_svm.setup_network(update_mac_if_needed=False)
+    migrated_svm.reserve_port_mappings()
 
     # Save to internal DB.
     migrated_svm.save()
-    print 'SVM metadata stored for SVM with id {}'.format(migrated_svm._id)
+    log.info('SVM metadata stored for SVM with id {}'.format(migrated_svm._id))
 
 
 ############################################################################################################
@@ -251,24 +550,184 @@ def receive_migrated_svm_disk_file(svm_id, disk_image_object, svm_instances_fold
         raise SVMNotFoundException("No SVM found with the given id: {}".format(svm_id))
 
     # Receive the transferred file and update its path.
-    print 'Storing disk image file of SVM in migration.'
+    log.info('Storing disk image file of SVM in migration.')
     destination_folder = os.path.join(svm_instances_folder, svm_id)
     migrated_svm.vm_image.store(destination_folder, disk_image_object)
-    print 'Migrated SVM disk image file stored.'
+    log.info('Migrated SVM disk image file stored.')
 
-    # Check that we have the backing file, and rebase the new file so it will point to the correct backing file.
-    service = Service.by_id(migrated_svm.service_id)
-    if service:
-        print 'Rebasing backing file for service %s.' % migrated_svm.service_id
-        backing_disk_file = service.vm_image.disk_image
-        migrated_svm.vm_image.rebase_disk_image(backing_disk_file)
-    else:
-        raise MigrationException("No backing file found for service {}".format(migrated_svm.service_id))
+    __rebase_migrated_disk_file(migrated_svm)
 
     # Save to internal DB.
     migrated_svm.save()
 
 
+############################################################################################################
+# Receives chunks of the disk image file of a migrated SVM, writing them directly into place. The first chunks received
+# for an SVM prepare the folder for its files.
+############################################################################################################
+def receive_migrated_svm_disk_chunks(svm_id, chunk_list, chunks_file_object, file_size, svm_instances_folder):
+    with _disk_receivers_lock:
+        receiver = _disk_receivers.get(svm_id)
+        if receiver is None:
+            migrated_svm = ServiceVM.by_id(svm_id, only_find_ready_ones=False)
+            if not migrated_svm:
+                raise SVMNotFoundException("No SVM found with the given id: {}".format(svm_id))
+
+            log.info('Receiving disk image file of SVM in migration.')
+            destination_folder = os.path.join(svm_instances_folder, svm_id)
+            receiver = ChunkReceiver(migrated_svm.vm_image.prepare_chunked_store(destination_folder))
+            migrated_svm.save()
+            _disk_receivers[svm_id] = receiver
+
+    receiver.receive(chunk_list, chunks_file_object, file_size)
+
+
+############################################################################################################
+# Returns the progress of the transfer of the disk image file of a migrated SVM, and of its backing image if needed.
+############################################################################################################
+def get_migrated_svm_disk_status(svm_id):
+    with _disk_receivers_lock:
+        receiver = _disk_receivers.get(svm_id)
+        base_receiver = _base_receivers.get(svm_id)
+        negotiation = _base_negotiations.get(svm_id)
+    if receiver is None and base_receiver is None and negotiation is None:
+        raise SVMNotFoundException("No disk image file transfer found for SVM with id: {}".format(svm_id))
+
+    status = receiver.get_status() if receiver else {}
+    if base_receiver:
+        status['base'] = base_receiver.get_status()
+        status['base']['ready'] = True
+    elif negotiation:
+        status['base'] = dict(negotiation)
+        if negotiation['ready']:
+            # The local backing image is used, so no chunks are needed.
+            status['base']['missing_chunks'] = []
+    return status
+
+
+############################################################################################################
+# Starts preparing, in the background, the backing image needed by the disk image of a migrated SVM, given by its
+# manifest (see chunkstore). Its progress is returned with the status of the disk image, under 'base', until it is
+# ready. Negotiating again while it is being prepared has no effect, so that senders can retry.
+############################################################################################################
+def negotiate_migrated_svm_base_image(svm_id, fingerprint, file_size, manifest, svm_instances_folder):
+    migrated_svm = ServiceVM.by_id(svm_id, only_find_ready_ones=False)
+    if not migrated_svm:
+        raise SVMNotFoundException("No SVM found with the given id: {}".format(svm_id))
+
+    with _disk_receivers_lock:
+        negotiation = _base_negotiations.get(svm_id)
+        if negotiation is not None and not negotiation.get('error'):
+            return
+        _base_negotiations[svm_id] = {'ready': False}
+
+    preparer = threading.Thread(target=__prepare_migrated_svm_base_image,
+                                args=(migrated_svm, fingerprint, file_size, manifest, svm_instances_folder),
+                                name='migration-base-' + svm_id)
+    preparer.daemon = True
+    preparer.start()
+
+
+############################################################################################################
+# Compares the backing image needed by the disk image of a migrated SVM with the one of the local service. If they
+# differ, or there is none, rebuilds it from chunks in the local images of all services, leaving the rest of the chunks
+# to be received. Runs in a background thread, and records in the negotiation when it is done or why it failed.
+############################################################################################################
+def __prepare_migrated_svm_base_image(migrated_svm, fingerprint, file_size, manifest, svm_instances_folder):
+    svm_id = migrated_svm._id
+    try:
+        base_receiver = __build_base_receiver(migrated_svm, fingerprint, file_size, manifest, svm_instances_folder)
+    except Exception as e:
+        log.exception('Error preparing backing image of migrated SVM {}.'.format(svm_id))
+        with _disk_receivers_lock:
+            if svm_id in _base_negotiations:
+                _base_negotiations[svm_id] = {'ready': False, 'error': str(e)}
+        return
+
+    with _disk_receivers_lock:
+        # The migration may have been aborted meanwhile.
+        if svm_id not in _base_negotiations:
+            return
+        if base_receiver:
+            _base_receivers[svm_id] = base_receiver
+        _base_negotiations[svm_id] = {'ready': True}
+
+
+############################################################################################################
+# Returns a receiver for the rest of the backing image needed by a migrated SVM, or None if the one of the local service
+# is the same.
+############################################################################################################
+def __build_base_receiver(migrated_svm, fingerprint, file_size, manifest, svm_instances_folder):
+    svm_id = migrated_svm._id
+    service = Service.by_id(migrated_svm.service_id)
+    if service and os.path.exists(service.vm_image.disk_image) and \
+            get_fingerprint(get_manifest(service.vm_image.disk_image)) == fingerprint:
+        log.info('Backing image of migrated SVM is the same as the one of local service {}.'.format(service.service_id))
+        return None
+
+    log.info('Backing image of migrated SVM is not available locally, rebuilding it.')
+    destination_folder = os.path.join(svm_instances_folder, svm_id)
+    migrated_svm.vm_image.prepare_chunked_store(destination_folder)
+    migrated_svm.save()
+
+    base_image_path = os.path.join(destination_folder, 'backing-{}.qcow2'.format(fingerprint))
+    local_images = [local_service.vm_image.disk_image for local_service in Service.find()
+                    if os.path.exists(local_service.vm_image.disk_image)]
+    base_receiver = ManifestReceiver(base_image_path, manifest, file_size, local_images)
+    log.info('{} bytes of the backing image were found locally.'.format(base_receiver.bytes_reused))
+    return base_receiver
+
+
+############################################################################################################
+# Receives chunks of the backing image of a migrated SVM, identified by their checksums.
+############################################################################################################
+def receive_migrated_svm_base_chunks(svm_id, chunk_list, chunks_file_object):
+    with _disk_receivers_lock:
+        base_receiver = _base_receivers.get(svm_id)
+    if base_receiver is None:
+        raise SVMNotFoundException("No backing image transfer found for SVM with id: {}".format(svm_id))
+    base_receiver.receive(chunk_list, chunks_file_object)
+
+
+############################################################################################################
+# Finishes receiving the disk image file of a migrated SVM sent in chunks, once all of them have been received.
+############################################################################################################
+def finish_migrated_svm_disk_file(svm_id):
+    migrated_svm = ServiceVM.by_id(svm_id, only_find_ready_ones=False)
+    if not migrated_svm:
+        raise SVMNotFoundException("No SVM found with the given id: {}".format(svm_id))
+
+    log.info('Migrated SVM disk image file received.')
+    __rebase_migrated_disk_file(migrated_svm)
+    migrated_svm.save()
+
+    # The status is kept until the migration ends, in case the sender asks for it.
+    with _disk_receivers_lock:
+        if svm_id in _disk_receivers:
+            _disk_receivers[svm_id].finished = True
+
+
+############################################################################################################
+# Checks that we have the backing file, and rebases the received disk image file so it will point to it. The backing
+# file is the image of the local service, unless a different one was received for this SVM.
+############################################################################################################
+def __rebase_migrated_disk_file(migrated_svm):
+    with _disk_receivers_lock:
+        base_receiver = _base_receivers.get(migrated_svm._id)
+    if base_receiver:
+        if base_receiver.missing:
+            raise MigrationException("Backing image is missing {} chunks".format(len(base_receiver.missing)))
+        backing_disk_file = base_receiver.file_path
+    else:
+        service = Service.by_id(migrated_svm.service_id)
+        if not service:
+            raise MigrationException("No backing file found for service {}".format(migrated_svm.service_id))
+        backing_disk_file = service.vm_image.disk_image
+
+    log.info('Rebasing disk image file on backing file {}.'.format(backing_disk_file))
+    migrated_svm.vm_image.rebase_disk_image(backing_disk_file)
+
+
 ############################################################################################################
 # Aborts a migration by removing already created SVM data.
 ############################################################################################################
@@ -278,26 +737,30 @@ def abort_migration(svm_id):
     if not migrated_svm:
         raise SVMNotFoundException("No SVM found with the given id {}".format(svm_id))
 
-    print 'Aborting migration, cleaning up...'
+    log.info('Aborting migration, cleaning up...')
     migrated_svm.stop()
+    with _disk_receivers_lock:
+        _disk_receivers.pop(svm_id, None)
+        _base_receivers.pop(svm_id, None)
+        _base_negotiations.pop(svm_id, None)
 
     # Unpairing all paired devices that were using this VM.
     deployment = Deployment.get_instance()
     paired_devices = PairedDevice.by_instance(svm_id)
     for paired_device in paired_devices:
         deployment.unpair_device(paired_device.device_id)
-    print 'Cleanup finished.'
+    log.info('Cleanup finished.')
 
 
 ############################################################################################################
 # Generates and returns credentials for the given device.
 ############################################################################################################
 def generate_migration_device_credentials(device_id, connection_id, svm_id):
-    print 'Preparing credentials and cloudlet information.'
+    log.info('Preparing credentials and cloudlet information.')
     device_credentials = PairedDeviceDataBundle()
     try:
         # Get the new credentials for the device on the current deployment.
-        print 'Generating credentials for device that will migrate to our cloudlet.'
+        log.info('Generating credentials for device that will migrate to our cloudlet.')
         deployment = Deployment.get_instance()
         device_type = 'mobile'
         device_keys = deployment.pair_device(device_id, connection_id, device_type)
@@ -308,23 +771,23 @@ def generate_migration_device_credentials(device_id, connection_id, svm_id):
         paired_device.save()
 
         # Bundle the credentials for a newly paired device.
-        print 'Bundling credentials for device.'
+        log.info('Bundling credentials for device.')
         device_credentials.auth_password = device_keys.auth_password
         device_credentials.server_public_key = device_keys.server_public_key
         device_credentials.device_private_key = device_keys.private_key
         device_credentials.load_certificate(deployment.radius_server.cert_file_path)
     except DeviceAlreadyPairedException as e:
-        print 'Credentials not generated: ' + e.message
+        log.warning('Credentials not generated: ' + e.message)
 
     # Bundle common cloudlet information.
-    print 'Bundling cloudlet information for device.'
+    log.info('Bundling cloudlet information for device.')
     cloudlet = get_cloudlet_instance()
     device_credentials.cloudlet_name = Cloudlet.get_hostname()
     device_credentials.cloudlet_fqdn = Cloudlet.get_fqdn()
     device_credentials.cloudlet_encryption_enabled = cloudlet.api_encrypted
     device_credentials.ssid = cloudlet.ssid
 
-    print 'Returning credentials and cloudlet data.'
+    log.info('Returning credentials and cloudlet data.')
     return device_credentials.__dict__
 
 
@@ -337,12 +800,17 @@ def resume_migrated_svm(svm_id):
     if not migrated_svm:
         raise SVMNotFoundException("No SVM found with the given id: {}".format(svm_id))
 
+    with _disk_receivers_lock:
+        _disk_receivers.pop(svm_id, None)
+        _base_receivers.pop(svm_id, None)
+        _base_negotiations.pop(svm_id, None)
+
     # Restart the VM, and load network data since it might be in a new network.
-    print 'Unpausing VM...'
+    log.info('Unpausing VM...')
     migrated_svm.unpause()
     migrated_svm.load_network_data()
     migrated_svm.register_with_dns()
-    print 'VM running'
+    log.info('VM running')
 
     # Save to internal DB.
     migrated_svm.save()
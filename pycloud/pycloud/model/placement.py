@@ -0,0 +1,141 @@
+# KVM-based Discoverable Cloudlet (KD-Cloudlet) 
+# Copyright (c) 2015 Carnegie Mellon University.
+# All Rights Reserved.
+# 
+# THIS SOFTWARE IS PROVIDED "AS IS," WITH NO WARRANTIES WHATSOEVER. CARNEGIE MELLON UNIVERSITY EXPRESSLY DISCLAIMS TO THE FULLEST EXTENT PERMITTEDBY LAW ALL EXPRESS, IMPLIED, AND STATUTORY WARRANTIES, INCLUDING, WITHOUT LIMITATION, THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, AND NON-INFRINGEMENT OF PROPRIETARY RIGHTS.
+# 
+# Released under a modified BSD license, please see license.txt for full terms.
+# DM-0002138
+# 
+# KD-Cloudlet includes and/or makes use of the following Third-Party Software subject to their own licenses:
+# MiniMongo
+# Copyright (c) 2010-2014, Steve Lacy 
+# All rights reserved. Released under BSD license.
+# https://github.com/MiniMongo/minimongo/blob/master/LICENSE
+# 
+# Bootstrap
+# Copyright (c) 2011-2015 Twitter, Inc.
+# Released under the MIT License
+# https://github.com/twbs/bootstrap/blob/master/LICENSE
+# 
+# jQuery JavaScript Library v1.11.0
+# http://jquery.com/
+# Includes Sizzle.js
+# http://sizzlejs.com/
+# Copyright 2005, 2014 jQuery Foundation, Inc. and other contributors
+# Released under the MIT license
+# http://jquery.org/license
+
+import threading
+import time
+
+from pycloud.pycloud.model.servicevm import ServiceVM
+from pycloud.pycloud.vm.vmutils import VirtualMachineException
+from pycloud.pycloud.cloudlet import get_cloudlet_instance
+
+# Singleton object to choose which shared SVM new users join.
+_g_singletonPlacement = None
+
+
+################################################################################################################
+# Creates the LeastLoadedPlacement singleton, or gets an instance of it if it had been already created.
+################################################################################################################
+def get_placement_instance():
+    global _g_singletonPlacement
+    if not _g_singletonPlacement:
+        _g_singletonPlacement = LeastLoadedPlacement(get_cloudlet_instance().placement_cpu_weight)
+
+    return _g_singletonPlacement
+
+
+################################################################################################################
+# Chooses, for a new user of a shared service, the ready SVM with the lowest load among those which are under the
+# service's capacity. Load is the fraction of the capacity in use, plus optionally the recent CPU usage of the VM
+# multiplied by a weight. The user is registered on the chosen SVM with a conditional update, so that concurrent
+# requests can never take an SVM over its capacity.
+################################################################################################################
+class LeastLoadedPlacement(object):
+
+    ################################################################################################################
+    # Constructor.
+    ################################################################################################################
+    def __init__(self, cpu_weight=0.0):
+        self.cpu_weight = cpu_weight
+
+        # Last CPU time sample for each SVM, as (cpu time in ns, wall time in s), by service id and SVM id.
+        self.cpu_samples = {}
+        self.cpu_samples_lock = threading.Lock()
+
+    ################################################################################################################
+    # Registers a new user on the least loaded SVM of the service that has capacity left. Returns the SVM, or None if
+    # all of them are full.
+    ################################################################################################################
+    def join(self, service):
+        max_users = service.num_users
+        if not max_users or max_users <= 0:
+            return None
+
+        candidates = ServiceVM.find_all({'service_id': service.service_id,
+                                         'num_current_users': {'$lt': max_users}},
+                                        connect_to_vm=self.cpu_weight > 0)
+        if self.cpu_weight > 0:
+            self._drop_old_cpu_samples(service.service_id, candidates)
+        candidates.sort(key=lambda svm: self._get_load(svm, max_users))
+
+        # Another request may fill a candidate after we read it, in which case we move on to the next one.
+        for candidate in candidates:
+            svm = ServiceVM.acquire(candidate._id, max_users=max_users)
+            if svm:
+                svm.vm = candidate.vm
+                print 'Joining SVM with id {} ({} of {} users)'.format(svm._id, svm.num_current_users, max_users)
+                return svm
+
+        print 'All SVMs of service {} are at capacity.'.format(service.service_id)
+        return None
+
+    ################################################################################################################
+    # Returns the load of an SVM, from 0 (idle) upwards.
+    ################################################################################################################
+    def _get_load(self, svm, max_users):
+        load = float(svm.num_current_users) / max_users
+        if self.cpu_weight > 0:
+            load += self.cpu_weight * self._get_cpu_usage(svm)
+        return load
+
+    ################################################################################################################
+    # Returns the fraction of its CPUs an SVM has used since the last time we checked. Returns 0 the first time, or
+    # if the VM's stats are not available.
+    ################################################################################################################
+    def _get_cpu_usage(self, svm):
+        if not svm.vm:
+            return 0.0
+
+        try:
+            cpu_time, num_cpus = svm.vm.get_cpu_time()
+        except VirtualMachineException as e:
+            print 'Could not get CPU stats of SVM {}: {}'.format(svm._id, e.message)
+            return 0.0
+
+        now = time.time()
+        with self.cpu_samples_lock:
+            service_samples = self.cpu_samples.setdefault(svm.service_id, {})
+            previous_sample = service_samples.get(svm._id)
+            service_samples[svm._id] = (cpu_time, now)
+
+        if not previous_sample or now <= previous_sample[1]:
+            return 0.0
+
+        elapsed_cpu_time = (cpu_time - previous_sample[0]) / 1e9
+        elapsed_time = now - previous_sample[1]
+        return min(1.0, max(0.0, elapsed_cpu_time / (elapsed_time * max(num_cpus, 1))))
+
+    ################################################################################################################
+    # Removes stored CPU samples of SVMs of the service that are no longer candidates (stopped or full).
+    ################################################################################################################
+    def _drop_old_cpu_samples(self, service_id, candidates):
+        candidate_ids = set(candidate._id for candidate in candidates)
+        with self.cpu_samples_lock:
+            service_samples = self.cpu_samples.get(service_id, {})
+            for svm_id in service_samples.keys():
+                if svm_id not in candidate_ids:
+                    del service_samples[svm_id]
@@ -0,0 +1,334 @@
+# KVM-based Discoverable Cloudlet (KD-Cloudlet) 
+# Copyright (c) 2015 Carnegie Mellon University.
+# All Rights Reserved.
+# 
+# THIS SOFTWARE IS PROVIDED "AS IS," WITH NO WARRANTIES WHATSOEVER. CARNEGIE MELLON UNIVERSITY EXPRESSLY DISCLAIMS TO THE FULLEST EXTENT PERMITTEDBY LAW ALL EXPRESS, IMPLIED, AND STATUTORY WARRANTIES, INCLUDING, WITHOUT LIMITATION, THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, AND NON-INFRINGEMENT OF PROPRIETARY RIGHTS.
+# 
+# Released under a modified BSD license, please see license.txt for full terms.
+# DM-0002138
+# 
+# KD-Cloudlet includes and/or makes use of the following Third-Party Software subject to their own licenses:
+# MiniMongo
+# Copyright (c) 2010-2014, Steve Lacy 
+# All rights reserved. Released under BSD license.
+# https://github.com/MiniMongo/minimongo/blob/master/LICENSE
+# 
+# Bootstrap
+# Copyright (c) 2011-2015 Twitter, Inc.
+# Released under the MIT License
+# https://github.com/twbs/bootstrap/blob/master/LICENSE
+# 
+# jQuery JavaScript Library v1.11.0
+# http://jquery.com/
+# Includes Sizzle.js
+# http://sizzlejs.com/
+# Copyright 2005, 2014 jQuery Foundation, Inc. and other contributors
+# Released under the MIT license
+# http://jquery.org/license
+
+
+import collections
+import os
+import threading
+import time
+
+from pycloud.pycloud.model.servicevm import ServiceVM
+from pycloud.pycloud.cloudlet import get_cloudlet_instance
+from pycloud.pycloud.utils import fileutils
+
+# Singleton object to keep popular service images in the page cache for this process.
+_g_singletonPrewarmer = None
+
+
+################################################################################################################
+# Creates the Prewarmer singleton, or gets an instance of it if it had been already created.
+################################################################################################################
+def get_prewarmer():
+    global _g_singletonPrewarmer
+    if not _g_singletonPrewarmer:
+        _g_singletonPrewarmer = Prewarmer()
+
+    return _g_singletonPrewarmer
+
+
+################################################################################################################
+# Converts a bytearray of page flags into a list of (offset, length) byte ranges covering the pages that are set.
+################################################################################################################
+def pages_to_ranges(pages):
+    ranges = []
+    start = None
+    for page_number, page in enumerate(pages):
+        if page and start is None:
+            start = page_number
+        elif not page and start is not None:
+            ranges.append((start * fileutils.PAGE_SIZE, (page_number - start) * fileutils.PAGE_SIZE))
+            start = None
+    if start is not None:
+        ranges.append((start * fileutils.PAGE_SIZE, (len(pages) - start) * fileutils.PAGE_SIZE))
+    return ranges
+
+
+################################################################################################################
+# Keeps the image files of the services that were started most often recently in the page cache, so that restoring
+# an SVM from them does not have to wait for disk reads. The whole state image is loaded, but only the extents of
+# the base disk image that were seen in the page cache while SVMs of the service were running ("hot" extents), since
+# guests only read a small part of their disk. Files are loaded in order of service popularity until the memory
+# budget is used up. Loading is only advice to the kernel, which can still evict the pages under memory pressure.
+################################################################################################################
+class Prewarmer(object):
+
+    ################################################################################################################
+    # Constructor.
+    ################################################################################################################
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.starts = {}            # Times of recent starts, by service id.
+        self.hot_pages = {}         # Pages of disk images seen in the page cache while in use, by file path.
+        self.warmed = {}            # Bytes requested to be loaded in the last run, by file path.
+        self.last_run = None
+        self.prewarm_thread = None
+        self.prewarm_event = threading.Event()
+
+    ################################################################################################################
+    # Starts the background prewarming thread, if it was not started already.
+    ################################################################################################################
+    def start(self):
+        if self.prewarm_thread is not None:
+            return
+
+        print 'Starting image prewarmer.'
+        self.prewarm_thread = threading.Thread(target=self._prewarm_loop, name='image-prewarmer')
+        self.prewarm_thread.daemon = True
+        self.prewarm_thread.start()
+
+    ################################################################################################################
+    # Records that an instance of the given service was requested, to rank services by popularity. Starts older than
+    # the ranking window are dropped here too, since the ranking is never calculated if prewarming is disabled.
+    ################################################################################################################
+    def record_start(self, service_id):
+        now = time.time()
+        oldest_start = now - get_cloudlet_instance().prewarm_window
+        with self.lock:
+            if service_id not in self.starts:
+                self.starts[service_id] = collections.deque()
+            start_times = self.starts[service_id]
+            start_times.append(now)
+            while start_times[0] < oldest_start:
+                start_times.popleft()
+
+    ################################################################################################################
+    # Returns a list of (service id, amount of starts) for the services started in the ranking window, most
+    # started first.
+    ################################################################################################################
+    def get_ranking(self):
+        oldest_start = time.time() - get_cloudlet_instance().prewarm_window
+        ranking = []
+        with self.lock:
+            for service_id, start_times in self.starts.items():
+                while start_times and start_times[0] < oldest_start:
+                    start_times.popleft()
+                if start_times:
+                    ranking.append((service_id, len(start_times)))
+                else:
+                    del self.starts[service_id]
+        ranking.sort(key=lambda service_starts: service_starts[1], reverse=True)
+        return ranking
+
+    ################################################################################################################
+    # Loads the images of the most popular services into the page cache, within the memory budget.
+    ################################################################################################################
+    def prewarm(self):
+        from pycloud.pycloud.model.service import Service
+        cloudlet = get_cloudlet_instance()
+        remaining_budget = cloudlet.prewarm_budget * 1024 * 1024
+        warmed = {}
+        for service_id, num_starts in self.get_ranking()[:cloudlet.prewarm_top_services]:
+            service = Service.by_id(service_id)
+            if not service or not service.vm_image:
+                continue
+
+            self._learn_hot_pages(service)
+            for file_path, ranges in self._get_ranges_to_warm(service):
+                for offset, length in ranges:
+                    length = min(length, remaining_budget)
+                    if length <= 0:
+                        break
+                    try:
+                        fileutils.fadvise(file_path, fileutils.POSIX_FADV_WILLNEED, offset, length)
+                    except OSError as e:
+                        print 'Error prewarming file {}: {}'.format(file_path, str(e))
+                        break
+                    warmed[file_path] = warmed.get(file_path, 0) + length
+                    remaining_budget -= length
+
+        with self.lock:
+            self.warmed = warmed
+            self.last_run = time.time()
+
+    ################################################################################################################
+    # Returns the popularity of each service, and how much of each of its image files is in the page cache.
+    ################################################################################################################
+    def get_status(self):
+        from pycloud.pycloud.model.service import Service
+        cloudlet = get_cloudlet_instance()
+        ranking = self.get_ranking()
+        top_services = [service_id for service_id, num_starts in ranking[:cloudlet.prewarm_top_services]]
+        ranking = dict(ranking)
+        with self.lock:
+            warmed = dict(self.warmed)
+            hot_bytes = dict((file_path, sum(pages) * fileutils.PAGE_SIZE)
+                             for file_path, pages in self.hot_pages.iteritems())
+            last_run = self.last_run
+
+        services = {}
+        for service in Service.find():
+            if not service.vm_image:
+                continue
+            files = {}
+            for file_path in [service.vm_image.state_image, service.vm_image.disk_image]:
+                if not file_path or not os.path.exists(file_path):
+                    continue
+                try:
+                    resident_bytes = sum(fileutils.get_resident_pages(file_path)) * fileutils.PAGE_SIZE
+                except OSError as e:
+                    print 'Error checking residency of file {}: {}'.format(file_path, str(e))
+                    resident_bytes = None
+                files[os.path.basename(file_path)] = {'size': os.path.getsize(file_path),
+                                                      'resident': resident_bytes,
+                                                      'hot': hot_bytes.get(file_path, 0),
+                                                      'warmed': warmed.get(file_path, 0)}
+            services[service.service_id] = {'recent_starts': ranking.get(service.service_id, 0),
+                                            'prewarmed': service.service_id in top_services,
+                                            'files': files}
+
+        return {'budget': cloudlet.prewarm_budget * 1024 * 1024,
+                'used': sum(warmed.values()),
+                'last_run': last_run,
+                'services': services}
+
+    ################################################################################################################
+    # Main loop of the prewarming thread.
+    ################################################################################################################
+    def _prewarm_loop(self):
+        while True:
+            try:
+                self.prewarm()
+            except Exception as e:
+                print 'Error prewarming images: ' + str(e)
+            self.prewarm_event.wait(get_cloudlet_instance().prewarm_interval)
+            self.prewarm_event.clear()
+
+    ################################################################################################################
+    # Adds the pages of the service's disk image that are in the page cache to its hot pages, if SVMs of the service
+    # are running, since then they are the pages guests actually read.
+    ################################################################################################################
+    def _learn_hot_pages(self, service):
+        disk_image = service.vm_image.disk_image
+        if not disk_image or not os.path.exists(disk_image):
+            return
+        if ServiceVM.find({'service_id': service.service_id, 'running': True}).count() == 0:
+            return
+
+        try:
+            resident_pages = fileutils.get_resident_pages(disk_image)
+        except OSError as e:
+            print 'Error checking residency of file {}: {}'.format(disk_image, str(e))
+            return
+
+        with self.lock:
+            hot_pages = self.hot_pages.get(disk_image)
+            if hot_pages is None or len(hot_pages) != len(resident_pages):
+                # New or modified image; forget what was learned about its previous contents.
+                self.hot_pages[disk_image] = resident_pages
+            else:
+                for page_number, page in enumerate(resident_pages):
+                    if page:
+                        hot_pages[page_number] = 1
+
+    ################################################################################################################
+    # Returns a list of (file path, list of (offset, length)) with the parts of the service's images to load, in order.
+    ################################################################################################################
+    def _get_ranges_to_warm(self, service):
+        files = []
+        state_image = service.vm_image.state_image
+        if state_image and os.path.exists(state_image):
+            files.append((state_image, [(0, os.path.getsize(state_image))]))
+
+        disk_image = service.vm_image.disk_image
+        with self.lock:
+            hot_pages = self.hot_pages.get(disk_image)
+            if hot_pages is not None:
+                files.append((disk_image, pages_to_ranges(hot_pages)))
+        return files
+
+
+################################################################################################################
+# Functions to test the class.
+################################################################################################################
+
+################################################################################################################
+# Get the command line arguments.
+################################################################################################################
+import argparse
+def get_args():
+    parser = argparse.ArgumentParser(description='Compare SVM start latency with cold and prewarmed images.')
+    parser.add_argument('-config', required=True, action='store', help='Config file of the API app.')
+    parser.add_argument('-service', required=True, action='store', help='Id of the service to start.')
+    parser.add_argument('-repetitions', type=int, default=3, action='store', help='Starts per mode.')
+    parsedArguments = parser.parse_args()
+    return parsedArguments
+
+################################################################################################################
+# Waits until the page cache stops growing for the given files, since loading them is asynchronous.
+################################################################################################################
+def wait_for_readahead(file_paths, timeout=120):
+    previous_resident = -1
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        resident = sum(sum(fileutils.get_resident_pages(file_path)) for file_path in file_paths)
+        if resident == previous_resident:
+            return
+        previous_resident = resident
+        time.sleep(0.5)
+
+################################################################################################################
+# Command line benchmark: starts new SVMs of a service after dropping its image files from the page cache, and
+# after prewarming them, and compares how long the starts took.
+################################################################################################################
+def benchmark_start_latency():
+    from paste.deploy import appconfig
+    from pycloud.pycloud.model.service import Service
+
+    parsedArguments = get_args()
+    get_cloudlet_instance(appconfig('config:' + os.path.abspath(parsedArguments.config)))
+    service = Service.by_id(parsedArguments.service)
+    if not service:
+        raise Exception('Service {} not found.'.format(parsedArguments.service))
+    image_files = [service.vm_image.state_image, service.vm_image.disk_image]
+    prewarmer = get_prewarmer()
+
+    start_times = {'cold': [], 'warm': []}
+    for mode in ['cold', 'warm']:
+        for repetition in range(parsedArguments.repetitions):
+            for file_path in image_files:
+                fileutils.fadvise(file_path, fileutils.POSIX_FADV_DONTNEED)
+            if mode == 'warm':
+                prewarmer.record_start(service.service_id)
+                prewarmer.prewarm()
+                wait_for_readahead(image_files)
+
+            start_time = time.time()
+            svm = service.create_vm_instance()
+            start_times[mode].append(time.time() - start_time)
+
+            # Learn which parts of the disk image the guest uses while it runs.
+            prewarmer._learn_hot_pages(service)
+            svm.stop()
+
+    for mode in ['cold', 'warm']:
+        times = start_times[mode]
+        print '{}: average start time {:.2f} s (min {:.2f} s, max {:.2f} s)'.format(mode, sum(times) / len(times),
+                                                                                      min(times), max(times))
+
+if __name__ == '__main__':
+    benchmark_start_latency()
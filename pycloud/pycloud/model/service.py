@@ -31,10 +31,28 @@ __author__ = 'jdroot'
 from pycloud.pycloud.mongo import Model, ObjectID
 from pycloud.pycloud.model.vmimage import VMImage
 from pycloud.pycloud.model.servicevm import ServiceVM
+from pycloud.pycloud.model.warmpool import get_warm_pool_instance
+from pycloud.pycloud.model.placement import get_placement_instance
+from pycloud.pycloud.model.hibernation import get_hibernation_manager
+from pycloud.pycloud.model.prewarm import get_prewarmer
+from pycloud.pycloud.cloudlet import get_cloudlet_instance
+from pycloud.pycloud.vm.descriptortemplate import get_descriptor_template_cache
+from pycloud.pycloud.utils import tracing
+from pycloud.pycloud.utils import metrics
 import os
 import time
+import threading
 from pylons import app_globals
 
+# Time to get an SVM for a new user, by how it was obtained: joined a shared one, reclaimed an idle one, claimed from
+# the warm pool, or started a new one from the saved state (cold).
+SVM_START_SECONDS = metrics.histogram('pycloud_svm_start_seconds', 'Time to get an SVM for a new user.',
+                                      ['service_id', 'path'])
+
+# Internal ids of the services whose saved state is being converted to another format in the background.
+_converting_services = set()
+_converting_services_lock = threading.Lock()
+
 # ###############################################################################################################
 # Represents a Service in the system.
 ################################################################################################################
@@ -60,6 +78,12 @@ class Service(Model):
         self.num_users = None
         self.ideal_memory = None
         self.min_memory = None
+        self.warm_pool_size = 0
+        self.readiness_timeout = None
+        self.readiness_http_path = None
+        self.idle_pause_time = 0    # Seconds an SVM is kept paused after its last user leaves.
+        self.idle_save_time = 0     # Seconds an SVM is then kept saved to disk before it is destroyed.
+        self.state_image_format = 'raw'     # Format the saved state is stored in, see VMSavedState.FORMATS.
         super(Service, self).__init__(*args, **kwargs)
         
     ################################################################################################################
@@ -98,36 +122,81 @@ class Service(Model):
         return Service.find_and_modify(query={'service_id': sid}, remove=True)
 
     ################################################################################################################
-    # Returns a new or existing Service VM instance associated to this service.
+    # Returns a new or existing Service VM instance associated to this service, with the new user registered on it.
+    # - progress: optional function that will be called with the name of each phase of the start process.
     ################################################################################################################
-    def get_vm_instance(self, join=False, clone_full_image=False):
+    def get_vm_instance(self, join=False, clone_full_image=False, progress=None):
+        start_time = time.time()
         service_supports_sharing = (self.num_users > 0)
         print 'Sharing supported: ' + str(service_supports_sharing)
         print 'Share requested: ' + str(join)
         if service_supports_sharing and join:
-            # Return the first ServiceVM we find.
+            # Join the least loaded SVM that still has capacity, if any; the user is registered on it atomically.
             print 'Looking for available SVMs...'
-            service_vms = ServiceVM.by_service(self.service_id)
-            if len(service_vms) > 0:
-                svm = service_vms[0]
+            with tracing.span('placement'):
+                svm = get_placement_instance().join(self)
+            if svm:
                 print 'Returning SVM with id {}'.format(svm._id)
+                SVM_START_SECONDS.labels(self.service_id, 'joined').observe(time.time() - start_time)
                 return svm
 
-        # If no ServiceVMs for that ID were found, or service is not shared, or join=False, create a new one.
-        print 'No SVM was available or a new instance was requested; starting a new instance.'
+        # Try to reuse an idle instance, or to get an already restored one from the warm pool. Full clones are never
+        # reused nor pooled.
+        svm = None
+        if not clone_full_image:
+            get_prewarmer().record_start(self.service_id)
+            if progress:
+                progress('claiming')
+            with tracing.span('reclaim'):
+                svm = get_hibernation_manager().reclaim(self)
+                start_path = 'reclaimed'
+            if not svm:
+                with tracing.span('warm_pool'):
+                    svm = get_warm_pool_instance().claim(self)
+                    start_path = 'warm_pool'
+
+        # If no ServiceVMs with capacity were found, or service is not shared, or join=False, create a new one.
+        if not svm:
+            print 'No SVM was available or a new instance was requested; starting a new instance.'
+            svm = self.create_vm_instance(clone_full_image=clone_full_image, progress=progress)
+            start_path = 'cold'
+
+        # Register the user on the new SVM.
+        with tracing.span('acquire'):
+            updated_svm = ServiceVM.acquire(svm._id)
+        if not updated_svm:
+            svm.stop()
+            raise Exception('SVM {} stopped before its first user could be registered.'.format(svm._id))
+        svm.num_current_users = updated_svm.num_current_users
+
+        SVM_START_SECONDS.labels(self.service_id, start_path).observe(time.time() - start_time)
+        return svm
+
+    ################################################################################################################
+    # Creates and starts a new Service VM instance of this service. If it is for the warm pool, it is stored as not
+    # ready, so that no user can join it before it is paused and put in the pool.
+    ################################################################################################################
+    def create_vm_instance(self, clone_full_image=False, progress=None, pooled=False):
         svm = ServiceVM()
         svm.generate_random_id()
         svm.service_id = self.service_id
         svm.service_port = self.port
 
-        # Set up the new SVM's image files based on the service's template.
-        new_svm_folder = os.path.join(app_globals.cloudlet.svmInstancesFolder, svm['_id'])
-        svm.vm_image = self.vm_image.clone(new_svm_folder, clone_full_image=clone_full_image)
+        # Set up the new SVM's image files based on the service's template. Note that the cloudlet is obtained directly
+        # from its singleton since this may be called from background threads, outside of a request.
+        new_svm_folder = os.path.join(get_cloudlet_instance().svmInstancesFolder, svm['_id'])
+        if progress:
+            progress('cloning')
+        with tracing.span('clone'):
+            svm.vm_image = self.vm_image.clone(new_svm_folder, clone_full_image=clone_full_image)
 
         # Start the SVM.
         try:
-            svm.start()
-            svm.save()
+            with tracing.span('start', svm_id=svm._id):
+                svm.start(progress=progress)
+                if pooled:
+                    svm.ready = False
+                svm.save()
         except Exception as e:
             svm.stop()
             raise e
@@ -158,6 +227,8 @@ class Service(Model):
 
         # Stop and store the memory image state.
         svm.stop(foce_save_state=True, cleanup_files=False)
+        svm.vm_image.convert_state_image(self.state_image_format)
+        get_descriptor_template_cache().invalidate(self.service_id)
         print "VM info and state created from template."
 
     ####################################################################################################################
@@ -176,6 +247,7 @@ class Service(Model):
 
             svm.stop(foce_save_state=True, cleanup_files=False)
             print "Service VM stopped, and machine state saved."
+            svm.vm_image.convert_state_image(self.state_image_format)
 
             # Permanently store the VM.
             vm_image_folder = os.path.dirname(self.vm_image.disk_image)
@@ -183,6 +255,7 @@ class Service(Model):
                 os.path.dirname(svm.vm_image.disk_image), vm_image_folder)
             svm.vm_image.move(vm_image_folder)
             svm.vm_image.protect()
+            get_descriptor_template_cache().invalidate(self.service_id)
             print 'VM Image updated.'
         except Exception as e:
             if svm:
@@ -191,6 +264,57 @@ class Service(Model):
             error_msg = "Exception updating SVM memory state: " + str(e)
             raise Exception(error_msg)
 
+    ################################################################################################################
+    # Changes the format the saved state of this service is stored in. If the saved state exists in another format,
+    # it is recompressed in a background thread, since that can take minutes, and the new format is only stored once
+    # the conversion succeeds, so that the database always matches the file. Returns True if a conversion was started.
+    ################################################################################################################
+    def change_state_image_format(self, image_format):
+        if image_format == self.state_image_format:
+            return False
+
+        state_image = self.vm_image.state_image if self.vm_image else None
+        if not state_image or not os.path.exists(state_image):
+            # Nothing to convert, the format will be used the next time the state is saved.
+            self._store_state_image_format(image_format)
+            return False
+
+        with _converting_services_lock:
+            if self._id in _converting_services:
+                print 'Saved state of service {} is already being converted.'.format(self.service_id)
+                return False
+            _converting_services.add(self._id)
+
+        conversion_thread = threading.Thread(target=self._convert_state_image, args=(image_format,),
+                                             name='state-image-conversion')
+        conversion_thread.daemon = True
+        conversion_thread.start()
+        return True
+
+    ################################################################################################################
+    # Converts the saved state to the given format, and stores the format if it worked. Runs in a background thread.
+    ################################################################################################################
+    def _convert_state_image(self, image_format):
+        try:
+            print 'Converting saved state of service {} to format {}.'.format(self.service_id, image_format)
+            self.vm_image.convert_state_image(image_format)
+            self._store_state_image_format(image_format)
+            get_descriptor_template_cache().invalidate(self.service_id)
+            print 'Saved state of service {} converted to format {}.'.format(self.service_id, image_format)
+        except Exception as e:
+            print 'Error converting saved state of service {} to format {}: {}'.format(self.service_id,
+                                                                                    image_format, str(e))
+        finally:
+            with _converting_services_lock:
+                _converting_services.discard(self._id)
+
+    ################################################################################################################
+    # Stores only the saved state format, so that other fields changed meanwhile are not overwritten.
+    ################################################################################################################
+    def _store_state_image_format(self, image_format):
+        self.state_image_format = image_format
+        Service.find_and_modify(query={'_id': self._id}, update={'$set': {'state_image_format': image_format}})
+
     ################################################################################################################
     # Returns a VM linked to the original VM image so that it can be modified.
     ################################################################################################################
@@ -208,6 +332,7 @@ class Service(Model):
     def destroy(self, force=False):
         # Make sure we are no longer in the database
         Service.find_and_remove(self.service_id)
+        get_descriptor_template_cache().invalidate(self.service_id)
 
         # Delete our backing files
         self.vm_image.cleanup(force)
@@ -228,6 +353,12 @@ class Service(Model):
                 "port": self.port,
                 "num_users": self.num_users,
                 "ideal_memory": self.ideal_memory,
-                "min_memory": self.min_memory
+                "min_memory": self.min_memory,
+                "warm_pool_size": self.warm_pool_size,
+                "readiness_timeout": self.readiness_timeout,
+                "readiness_http_path": self.readiness_http_path,
+                "idle_pause_time": self.idle_pause_time,
+                "idle_save_time": self.idle_save_time,
+                "state_image_format": self.state_image_format
             }
         )
@@ -29,23 +29,42 @@
 import time
 import os
 import json
+import logging
+import threading
 
 # Used to generate unique IDs for the VMs.
 from uuid import uuid4
 
-from pycloud.pycloud.utils.netutils import generate_random_mac, find_ip_for_mac, is_port_open, get_adapter_ip_address
+from pycloud.pycloud.utils.netutils import generate_random_mac, get_adapter_ip_address
 
 from pycloud.pycloud.mongo import Model
 from pycloud.pycloud.model.vmimage import VMImage
 from pycloud.pycloud.vm.vmsavedstate import VMSavedState
 from pycloud.pycloud.vm.virtualmachinedescriptor import VirtualMachineDescriptor
+from pycloud.pycloud.vm.descriptortemplate import get_descriptor_template_cache
 from pycloud.pycloud.vm.vmutils import VirtualMachineException
 from pycloud.pycloud.utils import portmanager
 from pycloud.pycloud.cloudlet import get_cloudlet_instance
 from pycloud.pycloud.vm.vmutils import VirtualMachine
+from pycloud.pycloud.vm import domainevents
 
 from pycloud.pycloud.network import cloudlet_dns
+from pycloud.pycloud.network.readiness import get_readiness_monitor
+from pycloud.pycloud.network.ipresolver import get_ip_resolver
+from pycloud.pycloud.utils.phasegraph import PhaseGraph
+from pycloud.pycloud.utils.threadpool import ThreadPool
+from pycloud.pycloud.utils import metrics
 
+log = logging.getLogger(__name__)
+
+# Amount of running SVMs of each service, obtained from the DB when metrics are collected.
+ACTIVE_SVMS = metrics.gauge('pycloud_active_svms', 'Running SVMs per service.', ['service_id'],
+                            function=lambda: dict(((service_id,), count) for service_id, count
+                                                  in ServiceVM.count_running_by_service().iteritems()))
+
+# Thread pool shared by all SVMs to run the phases of their start process, created when first needed.
+_start_phases_pool = None
+_start_phases_pool_lock = threading.Lock()
 
 ################################################################################################################
 #
@@ -72,6 +91,22 @@ class ServiceVM(Model):
     SSH_INTERNAL_PORT = 22
     VM_NAME_PREFIX = 'VM'
 
+    # Time to wait for the service to be available, if the service does not define it.
+    DEFAULT_READINESS_TIMEOUT_IN_S = 10
+
+    # Time to wait for the IP of a bridged VM to show up in the neighbor table or DHCP leases.
+    IP_RESOLVE_TIMEOUT_IN_S = 10
+
+    # Amount of threads used to run phases of SVM start processes in parallel.
+    START_PHASE_WORKERS = 8
+
+    # States of SVMs kept after their last user left, waiting to be reused (see hibernation.py).
+    IDLE_PAUSED = 'paused'
+    IDLE_SAVING = 'saving'
+    IDLE_SAVED = 'saved'
+    IDLE_RECLAIMING = 'reclaiming'
+    IDLE_EXPIRED = 'expired'
+
     ################################################################################################################
     # Constructor.
     ################################################################################################################
@@ -96,25 +131,59 @@ class ServiceVM(Model):
         self.network_mode = None
         self.adapter = None
         self.num_current_users = 0
+        self.idle_state = None
+        self.idle_since = None
+        self.pooled = False     # True while the SVM is paused in a service's warm pool.
         super(ServiceVM, self).__init__(*args, **kwargs)
 
     ################################################################################################################
     # Finds all SVMs given some search criteria.
     ################################################################################################################
     @staticmethod
-    def find_all(search_dict={}, only_find_ready_ones=True, connect_to_vm=True):
-        service_vms_array = []
+    def find_all(search_dict=None, only_find_ready_ones=True, connect_to_vm=True):
+        search_dict = dict(search_dict) if search_dict else {}
         if only_find_ready_ones:
             search_dict['ready'] = True
-        svm_list = ServiceVM.find(search_dict)
-        for service_vm in svm_list:
-            if connect_to_vm:
-                service_vm.connect_to_vm()
-            else:
+        service_vms_array = list(ServiceVM.find(search_dict))
+
+        if not connect_to_vm:
+            for service_vm in service_vms_array:
+                service_vm.vm = None
+            return service_vms_array
+
+        # Get all domains with one call to the hypervisor, and join them with the DB records.
+        try:
+            virtual_machines = VirtualMachine.get_all_virtual_machines()
+        except VirtualMachineException as e:
+            log.error('Error listing VMs: {}'.format(e.message))
+            for service_vm in service_vms_array:
                 service_vm.vm = None
-            service_vms_array.append(service_vm)
+            return service_vms_array
+
+        records_without_domains = []
+        for service_vm in service_vms_array:
+            service_vm.vm = virtual_machines.pop(service_vm._id, None)
+            if service_vm.vm is None and (service_vm.running or service_vm.pooled):
+                records_without_domains.append(service_vm._id)
+
+        ServiceVM._report_orphans(records_without_domains, virtual_machines.keys())
         return service_vms_array
 
+    ################################################################################################################
+    # Logs DB records of running SVMs that have no VM, and VMs in the hypervisor with no record in the DB. The
+    # candidate VMs are the ones that were not matched by a query, so they are checked against the whole collection.
+    ################################################################################################################
+    @staticmethod
+    def _report_orphans(records_without_domains, unmatched_domain_ids):
+        for svm_id in records_without_domains:
+            log.warning('SVM {} is marked as running, but it has no VM in the hypervisor.'.format(svm_id))
+
+        if unmatched_domain_ids:
+            known_ids = set(record._id for record in ServiceVM.find({'_id': {'$in': unmatched_domain_ids}}, fields=['_id']))
+            for domain_id in unmatched_domain_ids:
+                if domain_id not in known_ids:
+                    log.warning('VM {} in the hypervisor has no SVM record.'.format(domain_id))
+
     ################################################################################################################
     # Locate a ServiceVM by its ID
     ################################################################################################################
@@ -135,15 +204,12 @@ class ServiceVM(Model):
         return service_vm
 
     ################################################################################################################
-    # Connects to a libvirt vm.
+    # Binds the SVM to its libvirt VM. The VM is not looked up here: domain events keep the flags in the DB in sync
+    # with the hypervisor, and each operation on the VM looks it up anyway, failing if it no longer exists.
     ################################################################################################################
     def connect_to_vm(self):
         self.vm = VirtualMachine()
-        try:
-            self.vm.connect_to_virtual_machine(self._id)
-        except VirtualMachineException as e:
-            print 'Error connecting to VM with id {}: {}'.format(self._id, e.message)
-            self.vm = None
+        self.vm.uuid = self._id
 
     ################################################################################################################
     #
@@ -194,13 +260,13 @@ class ServiceVM(Model):
             if VirtualMachineDescriptor.does_name_fit(xml_string, default_new_name):
                 new_name = default_new_name
             else:
-                print 'Truncating new VM name.'
+                log.info('Truncating new VM name.')
                 new_name = default_new_name[:len(original_name)]
 
             self.name = new_name
 
-            print 'Original VM Name: {}'.format(original_name)
-            print 'New VM Name: {}'.format(self.name)
+            log.info('Original VM Name: {}'.format(original_name))
+            log.info('New VM Name: {}'.format(self.name))
 
         if not self.name:
             self.name = ''
@@ -238,116 +304,145 @@ class ServiceVM(Model):
 
     ################################################################################################################
     # Start this service VM. 
+    # - progress: optional function that will be called with the name of each phase of the start process.
     ################################################################################################################
-    def start(self):
+    def start(self, progress=None):
         # Check if we are already running.
         if self.running:
             return self
 
         # Setup network params.
         self.setup_network()
-
-        # Make sure the hypervisor can write to our files (since the disk image will be modified by the VM).
-        self.vm_image.unprotect()
+        bridged = self.network_mode == "bridged"
 
         # Get the saved state and make sure it is populated
         saved_state = VMSavedState(self.vm_image.state_image)
 
+        # Intermediate results shared between phases.
+        start_data = {}
+
+        # Reads the original descriptor from the saved state, and gets our name from it.
+        def read_header():
+            start_data['raw_descriptor'] = saved_state.getRawStoredVmDescription()
+            self.set_default_name(start_data['raw_descriptor'])
+
         # Update the state image with the updated descriptor.
-        # NOTE: this is only needed since libvirt wont allow us to change the ID of a VM being restored through its API. 
+        # NOTE: this is only needed since libvirt wont allow us to change the ID of a VM being restored through its API.
         # Instead, we trick it by manually changing the ID of the saved state file, so the API won't know we changed it.
-        raw_saved_xml_descriptor = saved_state.getRawStoredVmDescription()
-        self.set_default_name(raw_saved_xml_descriptor)
-        updated_xml_descriptor_id_only = VirtualMachineDescriptor.update_raw_name_and_id(raw_saved_xml_descriptor,
-                                                                                         self._id, self.name)
-        saved_state.updateStoredVmDescription(updated_xml_descriptor_id_only)
+        def write_header():
+            updated_xml_descriptor_id_only = VirtualMachineDescriptor.update_raw_name_and_id(start_data['raw_descriptor'],
+                                                                                             self._id, self.name)
+            saved_state.updateStoredVmDescription(updated_xml_descriptor_id_only)
 
-        # Get the descriptor and update it to include the current disk image path, port mappings, etc.
-        saved_xml_descriptor = saved_state.getStoredVmDescription()
-        updated_xml_descriptor = self._update_descriptor(saved_xml_descriptor)
+        # Update the descriptor to include the current disk image path, port mappings, etc. The descriptor is taken
+        # from the header we already read, so it does not have to wait for the header to be written.
+        def build_descriptor():
+            start_data['descriptor'] = self._update_descriptor(start_data['raw_descriptor'])
 
         # Restore a VM to the state indicated in the associated memory image file, in running mode.
         # The XML descriptor is given since some things need to be changed for the instance, mainly the disk image file and the mapped ports.
-        try:
-            print "Resuming from VM image..."
-            VirtualMachine.restore_saved_vm(saved_state.savedStateFilename, updated_xml_descriptor)
-            self.vm.connect_to_virtual_machine(self._id)
-            print "Resumed from VM image."
-            self.running = True
-            self.ready = True
-        except VirtualMachineException as e:
-            # If we could not resume the VM, discard the memory state and try to boot the VM from scratch.
-            print "Error resuming VM: %s for VM; error is: %s" % (str(self._id), str(e))
-            print "Discarding saved state and attempting to cold boot VM."
-            
-            # Simply try creating a new VM with the same disk and the updated XML descriptor from the saved state file.
-            self._cold_boot(updated_xml_descriptor)
-
-        # Ensure network is working and load network data.
-        self.load_network_data()
-        self.register_with_dns()
+        def restore():
+            updated_xml_descriptor = start_data['descriptor']
+            try:
+                log.info("Resuming from VM image...")
+                VirtualMachine.restore_saved_vm(saved_state.savedStateFilename, updated_xml_descriptor)
+                self.vm.connect_to_virtual_machine(self._id)
+                log.info("Resumed from VM image.")
+                self.running = True
+                self.ready = True
+            except VirtualMachineException as e:
+                # If we could not resume the VM, discard the memory state and try to boot the VM from scratch.
+                log.error("Error resuming VM: %s for VM; error is: %s" % (str(self._id), str(e)))
+                log.info("Discarding saved state and attempting to cold boot VM.")
 
-        # Check if the service is available, wait for it for a bit.
-        # CURRENT IMPLEMENTATION ONLY WORKS IN BRIDGED MODE.
-        if self.network_mode == "bridged":
-            self._check_service()
+                # Simply try creating a new VM with the same disk and the updated XML descriptor from the saved state file.
+                self._cold_boot(updated_xml_descriptor)
 
+        # Set up the phases of the start process, and run them, executing independent phases in parallel.
+        # Make sure the hypervisor can write to our files (since the disk image will be modified by the VM).
+        graph = PhaseGraph('start of SVM ' + self._id, progress)
+        graph.add('unprotect', self.vm_image.unprotect)
+        graph.add('read_header', read_header)
+        graph.add('ports', self._setup_port_mappings)
+        graph.add('write_header', write_header, ['unprotect', 'read_header'])
+        graph.add('descriptor', build_descriptor, ['read_header', 'ports'])
+        graph.add('restore', restore, ['write_header', 'descriptor'])
+
+        # Ensure network is working and load network data. If we are not on bridged mode, the IP is the cloudlet's,
+        # so we don't have to wait for the VM to get it.
+        graph.add('ip_address', self._load_ip_address, ['restore'] if bridged else [])
+        graph.add('vnc_address', self._load_vnc_address_from_running_instance, ['restore'])
+        graph.add('dns', self.register_with_dns, ['ip_address'])
+
+        # Check if the service is available, wait for it for a bit. In non-bridged mode, this is only useful if an
+        # application-level check was set up for the service.
+        if bridged or self._get_readiness_settings()[1]:
+            graph.add('service_check', self._check_service, ['ip_address', 'restore'])
+
+        graph.run(ServiceVM._get_start_phases_pool())
         return self
 
+    ################################################################################################################
+    # Returns the thread pool used to run the phases of the start process, creating it if needed.
+    ################################################################################################################
+    @staticmethod
+    def _get_start_phases_pool():
+        global _start_phases_pool
+        with _start_phases_pool_lock:
+            if _start_phases_pool is None:
+                _start_phases_pool = ThreadPool(ServiceVM.START_PHASE_WORKERS, name='svm-start-phases')
+        return _start_phases_pool
+
     ################################################################################################################
     # Updates an XML containing the description of the VM with the current info of this VM.
     ################################################################################################################
     def _update_descriptor(self, saved_xml_descriptor):
-        # Get the descriptor and inflate it to something we can work with.
-        xml_descriptor = VirtualMachineDescriptor(saved_xml_descriptor)
-
-        # Change the ID and Name (note: not currently that useful since they are changed in the saved state file).
-        xml_descriptor.setUuid(self._id)
-        xml_descriptor.setName(self.name)
-
-        # Set the disk image in the description of the VM.
-        xml_descriptor.setDiskImage(self.vm_image.disk_image, 'qcow2')
-
-        # Disabling remote VNC access for now.
-        xml_descriptor.enableLocalVNC()
+        # Get the compiled template for this descriptor, which already has all changes that do not depend on this
+        # instance, such as local VNC access, the network driver and mode, and no security label.
+        template = get_descriptor_template_cache().get(self.service_id, saved_xml_descriptor, self.os,
+                                                       self.network_mode, self.adapter)
 
-        # Sets the Realtek network driver, needed for Windows-based VMs.
-        if self.os != "lin":
-            print "Setting Realtek network driver."
-            xml_descriptor.setRealtekNetworkDriver()
-
-        # Configure bridged mode if enabled
         if self.network_mode == "bridged":
-            print 'Setting bridged mode'
-            xml_descriptor.enableBridgedMode(self.adapter)
-
             # In bridge mode we need a new MAC in case we are a clone.
-            print 'Setting mac address \'%s\'' % self.mac_address
-            xml_descriptor.setMACAddress(self.mac_address)
+            log.info('Setting bridged mode with mac address \'%s\'' % self.mac_address)
 
             # Set external ports same as internal ones.
             self.port = self.service_port
             self.ssh_port = self.SSH_INTERNAL_PORT
         else:
-            # No bridge mode, means we have to setup port forwarding.
-            # Ensure we are not using bridged mode.
-            xml_descriptor.enableNonBridgedMode(self.adapter)
-
-            # Create a new port if we do not have an external port already.
-            print 'Setting up port forwarding'
-            if not self.port:
-                self._add_port_mapping(portmanager.PortManager.generate_random_available_port(), self.service_port)
-            if not self.ssh_port:
-                self._add_port_mapping(portmanager.PortManager.generate_random_available_port(), self.SSH_INTERNAL_PORT)
-            xml_descriptor.setPortRedirection(self.port_mappings)
-
-        # Remove seclabel item.
-        xml_descriptor.removeSecLabel()
-
-        # Get the resulting XML string and return it.
-        updated_xml_descriptor = xml_descriptor.getAsString()
+            # No bridge mode, means we have to setup port forwarding. Create a new port if we do not have an external
+            # port already.
+            log.info('Setting up port forwarding')
+            self._setup_port_mappings()
+
+        # Fill in the ID, name, disk image, MAC and port mappings of this instance.
+        updated_xml_descriptor = template.render(self._id, self.name, self.vm_image.disk_image,
+                                                 mac_address=self.mac_address, port_mappings=self.port_mappings)
         return updated_xml_descriptor
 
+    ################################################################################################################
+    # Gets host ports for the service and SSH, if we are not in bridged mode and we do not have them already.
+    ################################################################################################################
+    def _setup_port_mappings(self):
+        if self.network_mode == "bridged":
+            return
+
+        if not self.port:
+            self._add_port_mapping(portmanager.get_port_manager().allocate(self._id), self.service_port)
+        if not self.ssh_port:
+            self._add_port_mapping(portmanager.get_port_manager().allocate(self._id), self.SSH_INTERNAL_PORT)
+
+    ################################################################################################################
+    # Marks the host ports we already have (i.e., if we were migrated here) as allocated to us.
+    ################################################################################################################
+    def reserve_port_mappings(self):
+        if not self.port_mappings:
+            return
+
+        for host_port in self.port_mappings:
+            if not portmanager.get_port_manager().reserve(int(host_port), self._id):
+                log.warning('Host port {} of SVM {} is already allocated.'.format(host_port, self._id))
+
     ################################################################################################################
     # Add a port mapping
     ################################################################################################################
@@ -365,17 +460,17 @@ class ServiceVM(Model):
 
         # Add the actual mapping. Keys need to be stored as string so that MongoDB will accept and store them.
         self.port_mappings[str(host_port)] = int(guest_port)
-        print('Setting up port forwarding from host port ' + str(host_port) + ' to guest port ' + str(guest_port))
+        log.info('Setting up port forwarding from host port ' + str(host_port) + ' to guest port ' + str(guest_port))
 
     ################################################################################################################
     # Boots a VM using a defined disk image and a state XML.
     ################################################################################################################
     def _cold_boot(self, xml_descriptor):
         # Create a VM ("domain") through the hypervisor.
-        print "Booting up a VM..."
+        log.info("Booting up a VM...")
         try:
             self.vm.create_and_start_vm(xml_descriptor)
-            print "VM object successfully created, VM started."
+            log.info("VM object successfully created, VM started.")
             self.running = True
             self.ready = True
         except:
@@ -389,8 +484,8 @@ class ServiceVM(Model):
     def setup_network(self, update_mac_if_needed=True):
         # Configure bridged mode if enabled
         c = get_cloudlet_instance()
-        print 'Bridge enabled: ', c.network_bridge_enabled
-        print 'Network Adapter: ', c.network_adapter
+        log.info('Bridge enabled: %s', c.network_bridge_enabled)
+        log.info('Network Adapter: %s', c.network_adapter)
         if c.network_bridge_enabled:
             self.network_mode = "bridged"
             self.adapter = c.network_adapter
@@ -398,7 +493,7 @@ class ServiceVM(Model):
             if update_mac_if_needed:
                 # In bridge mode we need a new MAC in case we are a clone.
                 self.mac_address = generate_random_mac()
-                print 'Generated new mac address: ' + self.mac_address
+                log.info('Generated new mac address: ' + self.mac_address)
         else:
             self.network_mode = "user"
             self.adapter = c.network_adapter
@@ -430,7 +525,7 @@ class ServiceVM(Model):
             message = "Error getting IP of new SVM: " + str(e)
             raise Exception(message)
 
-        print "SSH available on {}:{}".format(str(self.ip_address), str(self.ssh_port))
+        log.info("SSH available on {}:{}".format(str(self.ip_address), str(self.ssh_port)))
 
     ################################################################################################################
     # Will locate the IP address from our MAC.
@@ -440,10 +535,10 @@ class ServiceVM(Model):
         if self.mac_address is None:
             raise Exception("IP address could not be obtained since the VM has no MAC address set up.")
 
-        print "Retrieving IP for MAC: %s" % self.mac_address
-        ip = find_ip_for_mac(self.mac_address, self.adapter)
+        log.info("Retrieving IP for MAC: %s" % self.mac_address)
+        ip = get_ip_resolver().resolve(self.mac_address, self.adapter, timeout=self.IP_RESOLVE_TIMEOUT_IN_S)
         if not ip:
-            print "Failed to locate the IP of the VM."
+            log.error("Failed to locate the IP of the VM.")
             raise Exception('Failed to locate the IP of the VM.')
 
         return ip
@@ -458,17 +553,18 @@ class ServiceVM(Model):
             # We will only allow local VNC access from now on.
             #self.vnc_address = get_adapter_ip_address(self.adapter) + ":" + self.vnc_port
             self.vnc_address = "127.0.0.1:" + self.vnc_port
-            print "VNC available on {}".format(str(self.vnc_address))
+            log.info("VNC available on {}".format(str(self.vnc_address)))
         except Exception, e:
-            print 'Could not load VNC address: ' + str(e)
+            log.error('Could not load VNC address: ' + str(e))
 
     ################################################################################################################
     # Gets the host port the VNC server is listening on for this vm, which was automatically allocated.
     ################################################################################################################
     def _get_vnc_port(self):
         vm_xml_string = self.vm.get_running_vm_xml_string()
-        xml_descriptor = VirtualMachineDescriptor(vm_xml_string)
-        vnc_port = xml_descriptor.getVNCPort()
+        vnc_port = VirtualMachineDescriptor.get_raw_vnc_port(vm_xml_string)
+        if vnc_port is None:
+            vnc_port = VirtualMachineDescriptor(vm_xml_string).getVNCPort()
         return vnc_port
 
     ################################################################################################################
@@ -479,28 +575,33 @@ class ServiceVM(Model):
         service_available = self._wait_for_service()
         if not service_available:
             # TODO: throw exception.
-            print 'Service was not found running inside the SVM. Check if it is configured to start at boot time.'
+            log.info('Service was not found running inside the SVM. Check if it is configured to start at boot time.')
 
     ################################################################################################################
-    # Waits for the service to boot up.
-    # TODO: this method does not work as intended in non-bridged mode. It properly checks that the external,
-    # TODO: port-fowarding port is open, but if there is no forwarded internal port open, it succeeds as well (the
-    # TODO: connection is just closed right away, but that is not checked here).
+    # Waits for the service to boot up, or until the service's readiness timeout runs out.
+    # NOTE: in non-bridged mode, qemu accepts connections to the external port-forwarding port even if there is no
+    # internal port open, so the check is only meaningful if the service has an HTTP readiness path.
     ################################################################################################################
-    def _wait_for_service(self, retries=5):
-        if retries == 0:
-            print 'Service is not available, stopping retries.'
-            return False
+    def _wait_for_service(self):
+        timeout, http_path = self._get_readiness_settings()
+        log.info('Waiting up to {} seconds for service to be available inside VM.'.format(timeout))
+        service_ready = get_readiness_monitor().watch(self.ip_address, int(self.port), timeout, http_path)
+        return service_ready.result()
 
-        print 'Checking if service is available inside VM.'
-        result = is_port_open(self.ip_address, int(self.port))
-        if not result:
-            print 'Service is not yet available, waiting...'
-            time.sleep(2)
-            return self._wait_for_service(retries=(retries - 1))
-        else:
-            print 'Successful connection, service is available.'
-            return True
+    ################################################################################################################
+    # Returns the readiness timeout and optional HTTP path to check, as configured for our service.
+    ################################################################################################################
+    def _get_readiness_settings(self):
+        from pycloud.pycloud.model.service import Service
+        service = Service.by_id(self.service_id)
+
+        timeout = self.DEFAULT_READINESS_TIMEOUT_IN_S
+        http_path = None
+        if service:
+            if service.readiness_timeout:
+                timeout = float(service.readiness_timeout)
+            http_path = service.readiness_http_path or None
+        return timeout, http_path
 
     ################################################################################################################
     # Generates a FQDN for the SVM.
@@ -526,7 +627,10 @@ class ServiceVM(Model):
     # Stop this service VM, removing its files, database records, and other related records.
     ################################################################################################################
     def stop(self, foce_save_state=False, cleanup_files=True):
-        print "Stopping or cleaning up Service VM with instance id %s" % self._id
+        log.info("Stopping or cleaning up Service VM with instance id %s" % self._id)
+
+        # Mark it as unavailable first, so that the domain events caused by stopping it are not handled again.
+        ServiceVM._mark_as_unavailable(self._id)
 
         # First save memory state if needed.
         if self.running:
@@ -535,28 +639,46 @@ class ServiceVM(Model):
                 if not self.vm_image.cloned or foce_save_state:
                     self._save_state()
             except Exception, e:
-                print "Warning: error while saving VM: " + str(e)
+                log.warning("Error while saving VM: " + str(e))
 
-        # Destroy the VM if it exists.
-        if self.running:
+        # Destroy the VM if it exists. Pooled and idle paused VMs are paused, but still exist.
+        if self.running or self.pooled or self.idle_state == self.IDLE_PAUSED:
             try:
                 if self.vm:
-                    print "Stopping Service VM with instance id %s" % self._id
+                    log.info("Stopping Service VM with instance id %s" % self._id)
                     self.vm.destroy()
                 else:
-                    print 'VM with id %s not found while stopping it.' % self._id
+                    log.info('VM with id %s not found while stopping it.' % self._id)
             except Exception, e:
-                print "Warning: error while cleaning up VM: " + str(e)
+                log.warning("Error while cleaning up VM: " + str(e))
 
         # Ensure we are marked as not running nor ready.
         self.running = False
         self.ready = False
 
+        self._release_resources(cleanup_files)
+        log.info("Service VM has finished stopping and cleaning up")
+
+    ################################################################################################################
+    # Releases what an SVM whose VM no longer exists was using: its DNS record, IP, host ports, DB record and,
+    # optionally, its files.
+    ################################################################################################################
+    def _release_resources(self, cleanup_files=True):
         # Unregister from DNS.
         try:
             self._unregister_from_dns()
         except Exception, e:
-            print "Warning: error while removing DNS record: " + str(e)
+            log.warning("Error while removing DNS record: " + str(e))
+
+        # Our MAC may get a different IP the next time it is used.
+        if self.network_mode == "bridged" and self.mac_address:
+            get_ip_resolver().forget(self.mac_address)
+
+        # Return our host ports.
+        try:
+            portmanager.get_port_manager().free_all(self._id)
+        except Exception, e:
+            log.warning("Error while freeing ports: " + str(e))
 
         # Remove it from the database of running VMs.
         ServiceVM.find_and_remove(self._id)
@@ -565,16 +687,14 @@ class ServiceVM(Model):
             # Remove VM files
             self.vm_image.cleanup()
 
-        print "Service VM has finished stopping and cleaning up"
-
     ################################################################################################################
     # Pauses a VM and stores its memory state to a disk file.
     ################################################################################################################
     def _save_state(self):
-        print "Storing VM memory state to file %s" % self.vm_image.state_image
+        log.info("Storing VM memory state to file %s" % self.vm_image.state_image)
         self.vm.save_state(self.vm_image.state_image)
         self.running = False
-        print "Memory state successfully saved."
+        log.info("Memory state successfully saved.")
 
     ################################################################################################################
     # Unregister from DNS server.
@@ -606,31 +726,106 @@ class ServiceVM(Model):
     ################################################################################################################
     # Migrates a vm.
     ################################################################################################################
-    def migrate(self, remote_host):
+    def migrate(self, remote_host, streams=1, max_rate=None):
         # Set flags that depend on migration type.
-        print 'Starting memory and state migration...'
+        log.info('Starting memory and state migration...')
         start_time = time.time()
 
         # Migrate the state and memory.
-        self.vm.perform_memory_migration(remote_host)
+        self.vm.perform_memory_migration(remote_host, streams=streams, max_rate=max_rate)
 
         # Unregister from DNS server.
         self._unregister_from_dns()
 
         elapsed_time = time.time() - start_time
-        print 'Migration finished successfully. It took ' + str(elapsed_time) + ' seconds.'
+        log.info('Migration finished successfully. It took ' + str(elapsed_time) + ' seconds.')
+
+    ################################################################################################################
+    # Atomically registers a new user on a ready SVM. If max_users is given, the user is only registered if the SVM
+    # has less users than that. Returns the updated SVM, or None if it was not ready or was full.
+    ################################################################################################################
+    @staticmethod
+    def acquire(svm_id, max_users=None):
+        query = {'_id': svm_id, 'ready': True}
+        if max_users:
+            query['num_current_users'] = {'$lt': max_users}
+        return ServiceVM.find_and_modify(query=query, update={'$inc': {'num_current_users': 1}}, new=True)
+
+    ################################################################################################################
+    # Atomically unregisters a user from an SVM. Returns True if there are no users left and the caller is the one
+    # that has to shut it down; the SVM is marked as not ready, so that no one can join it and only one caller gets
+    # True, even if several releases reach zero at the same time.
+    ################################################################################################################
+    @staticmethod
+    def release(svm_id):
+        svm = ServiceVM.find_and_modify(query={'_id': svm_id, 'num_current_users': {'$gt': 0}},
+                                        update={'$inc': {'num_current_users': -1}}, new=True)
+        if svm and svm.num_current_users > 0:
+            return False
+
+        # Nobody is left. If someone joined in the meantime, this will not match and the SVM is kept.
+        last_user = ServiceVM.find_and_modify(query={'_id': svm_id, 'num_current_users': {'$lte': 0}, 'ready': True},
+                                              update={'$set': {'ready': False}})
+        return last_user is not None
+
+    ################################################################################################################
+    # Marks an SVM as not running nor available in the DB, if it was. Returns the previous record if it was changed.
+    ################################################################################################################
+    @staticmethod
+    def _mark_as_unavailable(svm_id):
+        return ServiceVM.find_and_modify(query={'_id': svm_id,
+                                                '$or': [{'running': True}, {'ready': True}, {'pooled': True},
+                                                        {'idle_state': ServiceVM.IDLE_PAUSED}]},
+                                         update={'$set': {'running': False, 'ready': False, 'pooled': False,
+                                                          'idle_state': None}})
+
+    ################################################################################################################
+    # Handles lifecycle events of VMs. If a VM stopped or crashed without us stopping it, marks the SVM as not
+    # available, and removes it as stop would: its ports, DNS record, DB record and files, and the links of paired
+    # devices to it. Only the first app to get the event does this.
+    ################################################################################################################
+    @staticmethod
+    def handle_domain_event(svm_id, event_name):
+        if event_name not in [domainevents.EVENT_STOPPED, domainevents.EVENT_CRASHED]:
+            return
+
+        svm = ServiceVM._mark_as_unavailable(svm_id)
+        if not svm:
+            return
+
+        log.info('VM of SVM {} was {} outside of the cloudlet, removing it.'.format(svm_id, event_name))
+        try:
+            svm._release_resources()
+        except Exception, e:
+            log.warning('Error while removing SVM {}: {}'.format(svm_id, str(e)))
+
+        # Imported here since paired devices refer to this module.
+        from pycloud.pycloud.model.paired_device import PairedDevice
+        for paired_device in PairedDevice.by_instance(svm_id):
+            paired_device.instance = None
+            paired_device.save()
+
+    ################################################################################################################
+    # Returns a dict with the amount of running SVMs of each service, by service id.
+    ################################################################################################################
+    @staticmethod
+    def count_running_by_service():
+        counts = {}
+        for svm in ServiceVM.find({'running': True}):
+            counts[svm.service_id] = counts.get(svm.service_id, 0) + 1
+        return counts
 
     ################################################################################################################
     # Stops and clears all registered SVMs.
     ################################################################################################################
     @staticmethod
     def clear_all_svms():
-        print 'Shutting down all running virtual machines'
+        log.info('Shutting down all running virtual machines')
         svm_list = ServiceVM.find_all(only_find_ready_ones=False)
         for svm in svm_list:
             try:
                 svm.stop()
             except VirtualMachineException as e:
-                print 'Problem shutting down vm with id {}: {}'.format(svm._id, e.message)
+                log.error('Problem shutting down vm with id {}: {}'.format(svm._id, e.message))
 
-        print 'All machines shutdown.'
+        log.info('All machines shutdown.')
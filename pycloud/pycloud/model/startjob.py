@@ -0,0 +1,130 @@
+# KVM-based Discoverable Cloudlet (KD-Cloudlet) 
+# Copyright (c) 2015 Carnegie Mellon University.
+# All Rights Reserved.
+# 
+# THIS SOFTWARE IS PROVIDED "AS IS," WITH NO WARRANTIES WHATSOEVER. CARNEGIE MELLON UNIVERSITY EXPRESSLY DISCLAIMS TO THE FULLEST EXTENT PERMITTEDBY LAW ALL EXPRESS, IMPLIED, AND STATUTORY WARRANTIES, INCLUDING, WITHOUT LIMITATION, THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, AND NON-INFRINGEMENT OF PROPRIETARY RIGHTS.
+# 
+# Released under a modified BSD license, please see license.txt for full terms.
+# DM-0002138
+# 
+# KD-Cloudlet includes and/or makes use of the following Third-Party Software subject to their own licenses:
+# MiniMongo
+# Copyright (c) 2010-2014, Steve Lacy 
+# All rights reserved. Released under BSD license.
+# https://github.com/MiniMongo/minimongo/blob/master/LICENSE
+# 
+# Bootstrap
+# Copyright (c) 2011-2015 Twitter, Inc.
+# Released under the MIT License
+# https://github.com/twbs/bootstrap/blob/master/LICENSE
+# 
+# jQuery JavaScript Library v1.11.0
+# http://jquery.com/
+# Includes Sizzle.js
+# http://sizzlejs.com/
+# Copyright 2005, 2014 jQuery Foundation, Inc. and other contributors
+# Released under the MIT license
+# http://jquery.org/license
+
+
+import time
+
+from pycloud.pycloud.cloudlet import get_cloudlet_instance
+from pycloud.pycloud.utils.jobqueue import Job, JobQueue
+from pycloud.pycloud.utils.tracing import get_tracer
+
+# Singleton object with the queue of start jobs for this process.
+_g_singletonStartJobQueue = None
+
+
+################################################################################################################
+# Creates the StartJobQueue singleton, or gets an instance of it if it had been already created.
+################################################################################################################
+def get_start_job_queue():
+    global _g_singletonStartJobQueue
+    if not _g_singletonStartJobQueue:
+        cloudlet = get_cloudlet_instance()
+        _g_singletonStartJobQueue = StartJobQueue(cloudlet.async_start_workers, cloudlet.async_start_queue_size)
+
+    return _g_singletonStartJobQueue
+
+
+################################################################################################################
+# Represents a request to start a Service VM that is executed in the background.
+################################################################################################################
+class StartJob(Job):
+
+    # Phases that indicate the job has finished.
+    PHASE_READY = 'ready'
+    PHASE_FAILED = 'failed'
+
+    ################################################################################################################
+    # Constructor.
+    ################################################################################################################
+    def __init__(self, service, join=False):
+        super(StartJob, self).__init__()
+        self.service = service
+        self.join = join
+        self.svm = None
+
+    ################################################################################################################
+    # Updates the current phase. Called by the start process.
+    ################################################################################################################
+    def set_phase(self, phase):
+        print 'Start job {} is now in phase {}'.format(self.job_id, phase)
+        self.phase = phase
+
+    ################################################################################################################
+    # Gets an SVM for the service and registers the new user on it. Executed by a worker of the job queue.
+    ################################################################################################################
+    def run(self):
+        self.set_phase('starting')
+        svm = None
+        try:
+            # Jobs outlive the request that created them, so they have their own trace.
+            with get_tracer().trace('StartJob.run', job_id=self.job_id, service_id=self.service.service_id):
+                svm = self.service.get_vm_instance(join=self.join, progress=self.set_phase)
+            self.svm = svm
+            self.set_phase(self.PHASE_READY)
+        except Exception as e:
+            if svm:
+                # If there was a problem starting the instance, stop it.
+                svm.stop()
+            print 'Error starting Service VM Instance: ' + str(e)
+            self.error = str(e)
+            self.set_phase(self.PHASE_FAILED)
+        finally:
+            self.end_time = time.time()
+
+    ################################################################################################################
+    # Returns a dict with the status of the job, which will include the SVM if it was started.
+    ################################################################################################################
+    def get_status(self):
+        end_time = self.end_time if self.end_time else time.time()
+        status = {'job_id': self.job_id,
+                  'service_id': self.service.service_id,
+                  'phase': self.phase,
+                  'elapsed_time': end_time - self.start_time}
+        if self.error:
+            status['error'] = self.error
+        if self.svm:
+            status['svm'] = self.svm
+        return status
+
+
+################################################################################################################
+# Bounded queue of start jobs, executed by a fixed amount of workers.
+################################################################################################################
+class StartJobQueue(JobQueue):
+
+    ################################################################################################################
+    # Constructor.
+    ################################################################################################################
+    def __init__(self, num_workers, max_queue_size):
+        super(StartJobQueue, self).__init__(num_workers, max_queue_size, name='svm-start')
+
+    ################################################################################################################
+    # Queues a new job to start an SVM for the given service. Raises ThreadPoolFullException if the queue is full.
+    ################################################################################################################
+    def submit(self, service, join=False):
+        return self._submit_job(StartJob(service, join))
@@ -76,10 +76,12 @@ class VMImage(DictObject):
 
         new_file = os.path.abspath(os.path.join(destination_folder, os.path.basename(original)))
 
-        # Simply copy the file.
+        # Copy the file, sharing its data blocks with the original if the filesystem supports it.
         print "Copying image %s to new disk image %s..." % (os.path.basename(original), destination_folder)
-        shutil.copyfile(original, new_file)
-        print 'Image copied.'
+        if fileutils.copy_file_cow(original, new_file):
+            print 'Image cloned through reflink.'
+        else:
+            print 'Image copied.'
 
         return new_file
 
@@ -211,6 +213,18 @@ class VMImage(DictObject):
             shutil.rmtree(destination_folder, ignore_errors=True)
             raise
 
+    ################################################################################################################
+    # Prepares the given location to receive the disk image file in parts (see diskprecopy), and updates the paths
+    # internally. Does nothing if it was already prepared. Returns the new path of the disk image file.
+    ################################################################################################################
+    def prepare_chunked_store(self, destination_folder):
+        new_disk_image_path = os.path.abspath(os.path.join(destination_folder, os.path.basename(self.disk_image)))
+        if self.disk_image != new_disk_image_path:
+            fileutils.recreate_folder(destination_folder)
+            self.disk_image = new_disk_image_path
+            self.state_image = os.path.abspath(os.path.join(destination_folder, os.path.basename(self.state_image)))
+        return self.disk_image
+
     ################################################################################################################
     # Creates a VM Image from a source file. This converts the source image from whatever format into qcow2.
     ################################################################################################################ 
@@ -254,6 +268,14 @@ class VMImage(DictObject):
                 # Nothing to do here.
                 return
 
+    ################################################################################################################
+    # Converts the saved state image to the given format (see VMSavedState.FORMATS), if it is not already in it.
+    ################################################################################################################
+    def convert_state_image(self, image_format):
+        if self.state_image is None or not os.path.exists(self.state_image):
+            return
+        VMSavedState(self.state_image).convertFormat(image_format)
+
     ################################################################################################################
     # Protects a VM Image by making it read-only.
     ################################################################################################################
@@ -0,0 +1,287 @@
+# KVM-based Discoverable Cloudlet (KD-Cloudlet) 
+# Copyright (c) 2015 Carnegie Mellon University.
+# All Rights Reserved.
+# 
+# THIS SOFTWARE IS PROVIDED "AS IS," WITH NO WARRANTIES WHATSOEVER. CARNEGIE MELLON UNIVERSITY EXPRESSLY DISCLAIMS TO THE FULLEST EXTENT PERMITTEDBY LAW ALL EXPRESS, IMPLIED, AND STATUTORY WARRANTIES, INCLUDING, WITHOUT LIMITATION, THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, AND NON-INFRINGEMENT OF PROPRIETARY RIGHTS.
+# 
+# Released under a modified BSD license, please see license.txt for full terms.
+# DM-0002138
+# 
+# KD-Cloudlet includes and/or makes use of the following Third-Party Software subject to their own licenses:
+# MiniMongo
+# Copyright (c) 2010-2014, Steve Lacy 
+# All rights reserved. Released under BSD license.
+# https://github.com/MiniMongo/minimongo/blob/master/LICENSE
+# 
+# Bootstrap
+# Copyright (c) 2011-2015 Twitter, Inc.
+# Released under the MIT License
+# https://github.com/twbs/bootstrap/blob/master/LICENSE
+# 
+# jQuery JavaScript Library v1.11.0
+# http://jquery.com/
+# Includes Sizzle.js
+# http://sizzlejs.com/
+# Copyright 2005, 2014 jQuery Foundation, Inc. and other contributors
+# Released under the MIT license
+# http://jquery.org/license
+
+
+import threading
+import time
+
+from pycloud.pycloud.model.servicevm import ServiceVM
+from pycloud.pycloud.cloudlet import get_cloudlet_instance
+
+# Singleton object to maintain the warm pool of SVMs for this process.
+_g_singletonWarmPool = None
+
+
+################################################################################################################
+# Creates the WarmPool singleton, or gets an instance of it if it had been already created.
+################################################################################################################
+def get_warm_pool_instance():
+    global _g_singletonWarmPool
+    if not _g_singletonWarmPool:
+        _g_singletonWarmPool = WarmPool()
+
+    return _g_singletonWarmPool
+
+
+################################################################################################################
+# Keeps a number of already restored and paused Service VMs per Service, so that a new instance only has to be
+# unpaused when requested. Pooled SVMs are stored in the DB with pooled=True and ready=False, so they are not
+# visible to the rest of the system until they are claimed.
+################################################################################################################
+class WarmPool(object):
+
+    # Max time between refill checks, even if no refill was requested.
+    REFILL_CHECK_INTERVAL_IN_S = 30
+
+    ################################################################################################################
+    # Constructor.
+    ################################################################################################################
+    def __init__(self):
+        self.refill_event = threading.Event()
+        self.refill_thread = None
+        self.stats_lock = threading.Lock()
+        self.stats = {}
+
+    ################################################################################################################
+    # Starts the background refiller thread, if it was not started already.
+    ################################################################################################################
+    def start(self):
+        if self.refill_thread is not None:
+            return
+
+        print 'Starting warm pool refiller.'
+        self.refill_thread = threading.Thread(target=self._refill_loop, name='warm-pool-refiller')
+        self.refill_thread.daemon = True
+        self.refill_thread.start()
+        self.request_refill()
+
+    ################################################################################################################
+    # Wakes up the refiller so that it checks if pools need to be filled.
+    ################################################################################################################
+    def request_refill(self):
+        self.refill_event.set()
+
+    ################################################################################################################
+    # Returns a pooled SVM for the given service, already unpaused, or None if the pool had no SVM available.
+    ################################################################################################################
+    def claim(self, service):
+        if not get_cloudlet_instance().warm_pool_enabled or WarmPool._get_pool_size(service) <= 0:
+            return None
+
+        # Atomically take the SVM out of the pool, so that no other request can claim it.
+        svm = ServiceVM.find_and_modify(query={'service_id': service.service_id, 'pooled': True},
+                                        update={'$set': {'pooled': False}}, new=True)
+        if not svm:
+            print 'Warm pool for service {} is empty.'.format(service.service_id)
+            self._count(service.service_id, 'misses')
+            self.request_refill()
+            return None
+
+        try:
+            svm.connect_to_vm()
+            if not svm.vm or not svm.unpause():
+                raise Exception('SVM could not be unpaused.')
+            svm.save()
+        except Exception as e:
+            print 'Error resuming pooled SVM with id {}: {}'.format(svm._id, str(e))
+            svm.stop()
+            self._count(service.service_id, 'misses')
+            self.request_refill()
+            return None
+
+        print 'Returning pooled SVM with id {}'.format(svm._id)
+        self._count(service.service_id, 'hits')
+        self.request_refill()
+        return svm
+
+    ################################################################################################################
+    # Returns a copy of the pool stats, by service id.
+    ################################################################################################################
+    def get_stats(self):
+        with self.stats_lock:
+            stats = {}
+            for service_id in self.stats:
+                stats[service_id] = dict(self.stats[service_id])
+        for service_id in stats:
+            stats[service_id]['pooled'] = WarmPool._get_pooled_count(service_id)
+        return stats
+
+    ################################################################################################################
+    # Main loop of the refiller thread.
+    ################################################################################################################
+    def _refill_loop(self):
+        while True:
+            self.refill_event.wait(self.REFILL_CHECK_INTERVAL_IN_S)
+            self.refill_event.clear()
+            try:
+                self._refill_all()
+            except Exception as e:
+                print 'Error refilling warm pool: ' + str(e)
+
+    ################################################################################################################
+    # Brings all pools to their target size, as long as the memory budget allows it.
+    ################################################################################################################
+    def _refill_all(self):
+        from pycloud.pycloud.model.service import Service
+        services = list(Service.find())
+
+        # Remove pooled SVMs that are no longer needed, since their service was removed or its pool was reduced.
+        self._trim(services)
+
+        max_memory = get_cloudlet_instance().warm_pool_max_memory
+        used_memory = WarmPool._get_pooled_memory(services)
+        for service in services:
+            target_size = WarmPool._get_pool_size(service)
+            pooled_count = WarmPool._get_pooled_count(service.service_id)
+            service_memory = WarmPool._get_service_memory(service)
+            while pooled_count < target_size:
+                if max_memory > 0 and used_memory + service_memory > max_memory:
+                    print 'Warm pool memory limit reached, not adding SVMs for service {}.'.format(service.service_id)
+                    break
+
+                try:
+                    self._add_to_pool(service)
+                except Exception as e:
+                    # Don't keep on trying for this service if it failed, it will be retried on the next check.
+                    print 'Error adding SVM to warm pool of service {}: {}'.format(service.service_id, str(e))
+                    break
+
+                pooled_count += 1
+                used_memory += service_memory
+
+    ################################################################################################################
+    # Creates a new SVM for the service, pauses it and puts it in the pool.
+    ################################################################################################################
+    def _add_to_pool(self, service):
+        print 'Adding new SVM to warm pool of service {}.'.format(service.service_id)
+        start_time = time.time()
+        svm = service.create_vm_instance(pooled=True)
+
+        try:
+            if not svm.pause():
+                raise Exception('SVM could not be paused.')
+
+            # Only the pool fields are updated, and only if nothing else took the SVM meanwhile (e.g., it died).
+            pooled_svm = ServiceVM.find_and_modify(query={'_id': svm._id, 'ready': False, 'pooled': False},
+                                                   update={'$set': {'running': False, 'pooled': True}}, new=True)
+            if not pooled_svm:
+                raise Exception('SVM was removed before it could be put in the pool.')
+            svm.pooled = True
+        except:
+            svm.stop()
+            raise
+
+        elapsed_time = time.time() - start_time
+        self._record_refill(service.service_id, elapsed_time)
+        print 'SVM with id {} added to warm pool in {} seconds.'.format(svm._id, elapsed_time)
+
+    ################################################################################################################
+    # Stops pooled SVMs that exceed their service's pool size.
+    ################################################################################################################
+    def _trim(self, services):
+        target_sizes = {}
+        for service in services:
+            target_sizes[service.service_id] = WarmPool._get_pool_size(service)
+
+        pooled_counts = {}
+        for svm in ServiceVM.find_all({'pooled': True}, only_find_ready_ones=False):
+            pooled_counts[svm.service_id] = pooled_counts.get(svm.service_id, 0) + 1
+            if pooled_counts[svm.service_id] <= target_sizes.get(svm.service_id, 0):
+                continue
+
+            # Take it out of the pool first, so that it can't be claimed while we stop it.
+            if ServiceVM.find_and_modify(query={'_id': svm._id, 'pooled': True}, update={'$set': {'pooled': False}}):
+                print 'Removing SVM with id {} from warm pool.'.format(svm._id)
+                svm.stop()
+
+    ################################################################################################################
+    # Updates a counter for the given service.
+    ################################################################################################################
+    def _count(self, service_id, counter):
+        with self.stats_lock:
+            service_stats = self._get_service_stats(service_id)
+            service_stats[counter] += 1
+
+    ################################################################################################################
+    # Stores the time it took to add an SVM to the pool.
+    ################################################################################################################
+    def _record_refill(self, service_id, elapsed_time):
+        with self.stats_lock:
+            service_stats = self._get_service_stats(service_id)
+            service_stats['refills'] += 1
+            service_stats['last_refill_time'] = elapsed_time
+            service_stats['total_refill_time'] += elapsed_time
+            service_stats['avg_refill_time'] = service_stats['total_refill_time'] / service_stats['refills']
+
+    ################################################################################################################
+    # Returns the stats dict for a service, creating it if needed. Must be called with the stats lock held.
+    ################################################################################################################
+    def _get_service_stats(self, service_id):
+        if service_id not in self.stats:
+            self.stats[service_id] = {'hits': 0, 'misses': 0, 'refills': 0, 'last_refill_time': 0,
+                                      'total_refill_time': 0, 'avg_refill_time': 0}
+        return self.stats[service_id]
+
+    ################################################################################################################
+    # Returns the amount of paused SVMs currently in the pool of a service.
+    ################################################################################################################
+    @staticmethod
+    def _get_pooled_count(service_id):
+        return ServiceVM.find({'service_id': service_id, 'pooled': True}).count()
+
+    ################################################################################################################
+    # Returns the memory, in MB, used by all the pooled SVMs.
+    ################################################################################################################
+    @staticmethod
+    def _get_pooled_memory(services):
+        used_memory = 0
+        for service in services:
+            used_memory += WarmPool._get_pooled_count(service.service_id) * WarmPool._get_service_memory(service)
+        return used_memory
+
+    ################################################################################################################
+    # Returns the target pool size of a service.
+    ################################################################################################################
+    @staticmethod
+    def _get_pool_size(service):
+        try:
+            return int(service.warm_pool_size)
+        except (AttributeError, TypeError, ValueError):
+            return 0
+
+    ################################################################################################################
+    # Returns the memory, in MB, an SVM of the given service will use, based on its ideal or min memory.
+    ################################################################################################################
+    @staticmethod
+    def _get_service_memory(service):
+        for memory in [service.ideal_memory, service.min_memory]:
+            try:
+                return int(memory)
+            except (TypeError, ValueError):
+                continue
+        return 0
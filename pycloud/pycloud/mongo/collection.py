@@ -29,7 +29,7 @@
 __author__ = 'jdroot'
 
 from pymongo.collection import Collection
-from cursor import MongoCursor
+from cursor import MongoCursor, MONGO_OPERATION_SECONDS
 
 
 class MongoCollection(Collection):
@@ -50,7 +50,20 @@ class MongoCollection(Collection):
         return None
 
     def find_and_modify(self, *args, **kwargs):
-        document = super(MongoCollection, self).find_and_modify(*args, **kwargs)
+        with MONGO_OPERATION_SECONDS.labels(self.name, 'find_and_modify').time():
+            document = super(MongoCollection, self).find_and_modify(*args, **kwargs)
         if document:
             return self.obj_class(document)
-        return None
\ No newline at end of file
+        return None
+
+    def insert(self, *args, **kwargs):
+        with MONGO_OPERATION_SECONDS.labels(self.name, 'insert').time():
+            return super(MongoCollection, self).insert(*args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        with MONGO_OPERATION_SECONDS.labels(self.name, 'update').time():
+            return super(MongoCollection, self).update(*args, **kwargs)
+
+    def remove(self, *args, **kwargs):
+        with MONGO_OPERATION_SECONDS.labels(self.name, 'remove').time():
+            return super(MongoCollection, self).remove(*args, **kwargs)
\ No newline at end of file
@@ -29,6 +29,12 @@
 __author__ = 'jdroot'
 
 from pymongo.cursor import Cursor
+from pycloud.pycloud.utils import metrics
+
+# Time taken by operations on the DB, by collection. Reads are measured here, when the cursor fetches results; writes
+# are measured by MongoCollection. Saves are measured as the insert or update they turn into.
+MONGO_OPERATION_SECONDS = metrics.histogram('pycloud_mongo_operation_seconds', 'Time taken by a DB operation.',
+                                            ['collection', 'operation'])
 
 
 class MongoCursor(Cursor):
@@ -37,6 +43,11 @@ class MongoCursor(Cursor):
         self.obj_class = kwargs.pop('obj_class')
         super(MongoCursor, self).__init__(*args, **kwargs)
 
+    def _refresh(self):
+        # Called whenever more results are fetched from the DB.
+        with MONGO_OPERATION_SECONDS.labels(self.collection.name, 'find').time():
+            return super(MongoCursor, self)._refresh()
+
     def next(self):
         document = super(MongoCursor, self).next()
         return self.obj_class(document)
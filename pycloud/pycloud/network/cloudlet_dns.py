@@ -29,6 +29,7 @@
 import dynamic_dns
 import os
 from pycloud.pycloud.network.tsig import load_tsig_key
+from pycloud.pycloud.utils import metrics
 
 SVMS_ZONE_NAME = 'svm.cloudlet.local.'
 CLOUDLET_HOST_NAME = 'cloudlet'
@@ -36,6 +37,10 @@ CLOUDLET_HOST_NAME = 'cloudlet'
 # Internal file path, relative to data folder.
 KEY_FILE_PATH = 'dns/Ksvm.cloudlet.local.private'
 
+# Time taken by dynamic updates of SVM records.
+DNS_UPDATE_SECONDS = metrics.histogram('pycloud_dns_update_seconds', 'Time to update the DNS record of an SVM.',
+                                       ['operation'])
+
 #################################################################################################################
 # Object used to manage the cloudlet DNS server.
 #################################################################################################################
@@ -71,7 +76,8 @@ class CloudletDNS(object):
             print "Can't register SVM: TSIG key not loaded."
             return
 
-        dynamic_dns.add_dns_record(SVMS_ZONE_NAME, self.key, svm_fqdn, record_value, record_type=record_type)
+        with DNS_UPDATE_SECONDS.labels('register').time():
+            dynamic_dns.add_dns_record(SVMS_ZONE_NAME, self.key, svm_fqdn, record_value, record_type=record_type)
 
     #################################################################################################################
     # Unregisters an SVM.
@@ -81,4 +87,5 @@ class CloudletDNS(object):
             print "Can't unregister SVM: TSIG key not loaded."
             return
 
-        dynamic_dns.remove_dns_record(SVMS_ZONE_NAME, self.key, svm_fqdn)
+        with DNS_UPDATE_SECONDS.labels('unregister').time():
+            dynamic_dns.remove_dns_record(SVMS_ZONE_NAME, self.key, svm_fqdn)
@@ -0,0 +1,451 @@
+# KVM-based Discoverable Cloudlet (KD-Cloudlet) 
+# Copyright (c) 2015 Carnegie Mellon University.
+# All Rights Reserved.
+# 
+# THIS SOFTWARE IS PROVIDED "AS IS," WITH NO WARRANTIES WHATSOEVER. CARNEGIE MELLON UNIVERSITY EXPRESSLY DISCLAIMS TO THE FULLEST EXTENT PERMITTEDBY LAW ALL EXPRESS, IMPLIED, AND STATUTORY WARRANTIES, INCLUDING, WITHOUT LIMITATION, THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, AND NON-INFRINGEMENT OF PROPRIETARY RIGHTS.
+# 
+# Released under a modified BSD license, please see license.txt for full terms.
+# DM-0002138
+# 
+# KD-Cloudlet includes and/or makes use of the following Third-Party Software subject to their own licenses:
+# MiniMongo
+# Copyright (c) 2010-2014, Steve Lacy 
+# All rights reserved. Released under BSD license.
+# https://github.com/MiniMongo/minimongo/blob/master/LICENSE
+# 
+# Bootstrap
+# Copyright (c) 2011-2015 Twitter, Inc.
+# Released under the MIT License
+# https://github.com/twbs/bootstrap/blob/master/LICENSE
+# 
+# jQuery JavaScript Library v1.11.0
+# http://jquery.com/
+# Includes Sizzle.js
+# http://sizzlejs.com/
+# Copyright 2005, 2014 jQuery Foundation, Inc. and other contributors
+# Released under the MIT license
+# http://jquery.org/license
+
+
+import os
+import re
+import sys
+import threading
+import time
+from subprocess import Popen, PIPE
+from xml.etree import ElementTree
+
+import netifaces
+import netaddr
+
+# Singleton object to resolve MAC addresses into IP addresses.
+_g_singletonIpResolver = None
+_g_singletonLock = threading.Lock()
+
+# Default places where DHCP servers store their leases.
+DEFAULT_LEASE_FILES = ['/var/lib/misc/dnsmasq.leases',
+                       '/var/lib/dnsmasq/dnsmasq.leases',
+                       '/var/lib/dhcp/dhcpd.leases']
+
+
+#################################################################################################################
+# Creates the MacIpResolver singleton, or gets an instance of it if it had been already created.
+#################################################################################################################
+def get_ip_resolver():
+    global _g_singletonIpResolver
+    with _g_singletonLock:
+        if not _g_singletonIpResolver:
+            from pycloud.pycloud.cloudlet import get_cloudlet_instance
+            cloudlet = get_cloudlet_instance()
+            _g_singletonIpResolver = MacIpResolver([NeighborTableSource(),
+                                                    LeaseFileSource(cloudlet.dhcp_lease_files),
+                                                    NmapSource(scan_range=cloudlet.ip_scan_range)],
+                                                   cache_ttl=cloudlet.ip_cache_ttl)
+
+    return _g_singletonIpResolver
+
+
+#################################################################################################################
+# Normalizes a MAC address so that they can be compared.
+#################################################################################################################
+def normalize_mac(mac):
+    return mac.strip().lower()
+
+
+#################################################################################################################
+# A file whose parsed contents are cached until it changes on disk.
+#################################################################################################################
+class WatchedFile(object):
+
+    #################################################################################################################
+    # Constructor. parser receives the file contents and returns a dict of MAC to IP.
+    #################################################################################################################
+    def __init__(self, path, parser):
+        self.path = path
+        self.parser = parser
+        self.signature = None
+        self.entries = {}
+
+    #################################################################################################################
+    # Returns the MAC to IP entries in the file, parsing it again only if it has changed since the last time.
+    #################################################################################################################
+    def get_entries(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            self.signature = None
+            self.entries = {}
+            return self.entries
+
+        signature = (stat.st_mtime, stat.st_size, stat.st_ino)
+        if signature != self.signature:
+            try:
+                with open(self.path, 'r') as data_file:
+                    self.entries = self.parser(data_file.read())
+                self.signature = signature
+            except IOError, e:
+                print 'Error reading {}: {}'.format(self.path, str(e))
+                self.entries = {}
+
+        return self.entries
+
+
+#################################################################################################################
+# Base class for the places where we can look for the IP of a MAC.
+#################################################################################################################
+class MacIpSource(object):
+    # Name used when logging.
+    name = 'base'
+
+    # Sources which are expensive are only used after the cheap ones have been given some time.
+    is_expensive = False
+
+    #################################################################################################################
+    # Returns the IP for the given normalized MAC, or None if not found. Sources that can take long should not take
+    # more than timeout seconds, if given.
+    #################################################################################################################
+    def lookup(self, mac, adapter, timeout=None):
+        return None
+
+
+#################################################################################################################
+# Looks up the kernel's ARP table, and the neighbor table through "ip neigh" as a fallback.
+#################################################################################################################
+class NeighborTableSource(MacIpSource):
+    name = 'neighbor table'
+
+    #################################################################################################################
+    # Constructor. ip_neigh_command can be set to None to only use the ARP file.
+    #################################################################################################################
+    def __init__(self, arp_table_path='/proc/net/arp', ip_neigh_command=('ip', 'neigh', 'show')):
+        self.arp_table_path = arp_table_path
+        self.ip_neigh_command = ip_neigh_command
+
+    #################################################################################################################
+    # Returns the IP for the given MAC, or None if not found.
+    #################################################################################################################
+    def lookup(self, mac, adapter, timeout=None):
+        # /proc/net/arp changes constantly and has no useful mtime, so it is always read; it is small and in memory.
+        try:
+            with open(self.arp_table_path, 'r') as arp_file:
+                ip = parse_arp_table(arp_file.read()).get(mac)
+                if ip:
+                    return ip
+        except IOError:
+            pass
+
+        if self.ip_neigh_command:
+            try:
+                p = Popen(list(self.ip_neigh_command), stdout=PIPE, stderr=PIPE)
+                out, err = p.communicate()
+                if p.returncode == 0:
+                    return parse_ip_neigh(out).get(mac)
+            except OSError:
+                pass
+
+        return None
+
+
+#################################################################################################################
+# Looks up the lease files of dnsmasq or ISC DHCP servers, re-parsing them only when they change.
+#################################################################################################################
+class LeaseFileSource(MacIpSource):
+    name = 'DHCP leases'
+
+    #################################################################################################################
+    # Constructor.
+    #################################################################################################################
+    def __init__(self, lease_files=None):
+        if lease_files is None:
+            lease_files = DEFAULT_LEASE_FILES
+        self.watched_files = []
+        for path in lease_files:
+            parser = parse_isc_leases if path.endswith('dhcpd.leases') else parse_dnsmasq_leases
+            self.watched_files.append(WatchedFile(path, parser))
+
+    #################################################################################################################
+    # Returns the IP for the given MAC, or None if not found.
+    #################################################################################################################
+    def lookup(self, mac, adapter, timeout=None):
+        for watched_file in self.watched_files:
+            ip = watched_file.get_entries().get(mac)
+            if ip:
+                return ip
+        return None
+
+
+#################################################################################################################
+# Pings a narrow range of the adapter's network with ARP requests through nmap, and then checks the neighbor table
+# again. The range is the one given (such as the DHCP pool that hands out the IPs of the SVMs), or the adapter's
+# network if it is small, or else the part of it around the adapter's own address, so that a scan takes seconds even
+# on large networks.
+#################################################################################################################
+class NmapSource(MacIpSource):
+    name = 'nmap'
+    is_expensive = True
+
+    # Largest network scanned when no range is given, as a prefix length.
+    MAX_SCAN_PREFIX_LEN = 24
+
+    # Time given to a scan if no timeout is given.
+    DEFAULT_TIMEOUT_IN_S = 10
+
+    #################################################################################################################
+    # Constructor. scan_range can be a CIDR network or a range such as "192.168.1.100-192.168.1.200".
+    #################################################################################################################
+    def __init__(self, nmap='nmap', neighbor_source=None, scan_range=None):
+        self.nmap = nmap
+        self.neighbor_source = neighbor_source if neighbor_source else NeighborTableSource()
+        self.scan_range = scan_range
+
+    #################################################################################################################
+    # Returns the list of networks to scan for the given adapter, in CIDR notation.
+    #################################################################################################################
+    def get_scan_targets(self, adapter):
+        if self.scan_range:
+            if '-' in self.scan_range:
+                first_ip, last_ip = self.scan_range.split('-')
+                return [str(network) for network in netaddr.IPRange(first_ip.strip(), last_ip.strip()).cidrs()]
+            return [self.scan_range]
+
+        addr_info = netifaces.ifaddresses(adapter)[netifaces.AF_INET][0]
+        network = netaddr.IPNetwork('%s/%s' % (addr_info['addr'], addr_info['netmask']))
+        if network.prefixlen < self.MAX_SCAN_PREFIX_LEN:
+            network = netaddr.IPNetwork('%s/%d' % (addr_info['addr'], self.MAX_SCAN_PREFIX_LEN))
+        return [str(network.cidr)]
+
+    #################################################################################################################
+    # Returns the IP for the given MAC, or None if not found. The scan is stopped after timeout seconds.
+    #################################################################################################################
+    def lookup(self, mac, adapter, timeout=None):
+        if timeout is None:
+            timeout = self.DEFAULT_TIMEOUT_IN_S
+        if timeout <= 0:
+            return None
+        targets = self.get_scan_targets(adapter)
+
+        # Only use ARP pings and skip DNS resolution, which is what made generic ping scans slow. Replies will also
+        # populate the kernel's neighbor table. nmap is killed if it has not finished by the timeout.
+        print 'ARP scanning range %s for MAC address %s' % (' '.join(targets), mac)
+        p = Popen(['sudo', self.nmap, '-sn', '-PR', '-n', '-e', adapter, '--host-timeout', '%dms' % (timeout * 1000)] +
+                  targets + ['-oX', '-'],
+                  stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        def stop_scan():
+            try:
+                # sudo passes SIGTERM on to nmap.
+                p.terminate()
+            except OSError:
+                pass
+        killer = threading.Timer(timeout, stop_scan)
+        killer.start()
+        try:
+            out, err = p.communicate()
+        finally:
+            killer.cancel()
+        if p.returncode != 0:
+            print "Error executing nmap (or it timed out):\n%s" % err
+            return self.neighbor_source.lookup(mac, adapter)
+
+        ip = parse_nmap_xml(out).get(mac)
+        if not ip:
+            ip = self.neighbor_source.lookup(mac, adapter)
+        return ip
+
+
+#################################################################################################################
+# Resolves MAC addresses into IPs by asking a list of sources in order, caching the results.
+#################################################################################################################
+class MacIpResolver(object):
+    # How often cheap sources are polled while waiting for a MAC to show up.
+    POLL_INTERVAL_IN_S = 0.1
+
+    # How long to wait for cheap sources before trying expensive ones, and then between tries of expensive ones; the
+    # wait between tries doubles each time.
+    CHEAP_SOURCES_WAIT_IN_S = 2
+
+    #################################################################################################################
+    # Constructor.
+    #################################################################################################################
+    def __init__(self, sources, cache_ttl=300):
+        self.sources = list(sources)
+        self.cache_ttl = cache_ttl
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    #################################################################################################################
+    # Adds a new source to look for IPs in, after the existing ones.
+    #################################################################################################################
+    def add_source(self, source):
+        self.sources.append(source)
+
+    #################################################################################################################
+    # Returns a cached IP for the MAC, or None if there is none or it has expired.
+    #################################################################################################################
+    def get_cached(self, mac):
+        mac = normalize_mac(mac)
+        with self.lock:
+            entry = self.cache.get(mac)
+            if entry and entry[1] > time.time():
+                return entry[0]
+            self.cache.pop(mac, None)
+            return None
+
+    #################################################################################################################
+    # Removes a MAC from the cache.
+    #################################################################################################################
+    def forget(self, mac):
+        with self.lock:
+            self.cache.pop(normalize_mac(mac), None)
+
+    #################################################################################################################
+    # Asks the given sources for the MAC's IP, caching it if found. Sources are given timeout seconds, if set.
+    #################################################################################################################
+    def _lookup_in_sources(self, mac, adapter, sources, timeout=None):
+        for source in sources:
+            try:
+                ip = source.lookup(mac, adapter, timeout)
+            except Exception, e:
+                print 'Error looking up MAC {} in {}: {}'.format(mac, source.name, str(e))
+                continue
+
+            if ip:
+                print 'Found IP {} for MAC {} in {}'.format(ip, mac, source.name)
+                with self.lock:
+                    self.cache[mac] = (ip, time.time() + self.cache_ttl)
+                return ip
+        return None
+
+    #################################################################################################################
+    # Returns the IP of the given MAC, waiting up to timeout seconds for it to show up. Cheap sources are polled
+    # frequently; expensive ones are only tried after a while, with a growing wait between tries, and only for the
+    # time left. Returns None if not found.
+    #################################################################################################################
+    def resolve(self, mac, adapter, timeout=10):
+        mac = normalize_mac(mac)
+        ip = self.get_cached(mac)
+        if ip:
+            return ip
+
+        cheap_sources = [source for source in self.sources if not source.is_expensive]
+        expensive_sources = [source for source in self.sources if source.is_expensive]
+
+        start_time = time.time()
+        deadline = start_time + timeout
+        expensive_wait = self.CHEAP_SOURCES_WAIT_IN_S
+        next_expensive_time = start_time + min(expensive_wait, timeout)
+        while True:
+            ip = self._lookup_in_sources(mac, adapter, cheap_sources)
+            if ip:
+                return ip
+
+            now = time.time()
+            if expensive_sources and now >= next_expensive_time and now < deadline:
+                ip = self._lookup_in_sources(mac, adapter, expensive_sources, timeout=deadline - now)
+                if ip:
+                    return ip
+                expensive_wait *= 2
+                next_expensive_time = time.time() + expensive_wait
+
+            if time.time() >= deadline:
+                print 'IP for MAC {} not found after {} seconds.'.format(mac, timeout)
+                return None
+            time.sleep(self.POLL_INTERVAL_IN_S)
+
+
+#################################################################################################################
+# Parses the contents of /proc/net/arp into a dict of MAC to IP, skipping incomplete entries.
+#################################################################################################################
+def parse_arp_table(data):
+    entries = {}
+    for line in data.splitlines()[1:]:
+        parts = line.split()
+        if len(parts) >= 4 and parts[2] != '0x0':
+            entries[normalize_mac(parts[3])] = parts[0]
+    return entries
+
+
+#################################################################################################################
+# Parses the output of "ip neigh show" into a dict of MAC to IP, skipping failed entries and IPv6 addresses.
+#################################################################################################################
+def parse_ip_neigh(data):
+    entries = {}
+    for line in data.splitlines():
+        parts = line.split()
+        if 'lladdr' not in parts or ':' in parts[0] or parts[-1] in ['FAILED', 'INCOMPLETE']:
+            continue
+        mac_index = parts.index('lladdr') + 1
+        if mac_index < len(parts):
+            entries[normalize_mac(parts[mac_index])] = parts[0]
+    return entries
+
+
+#################################################################################################################
+# Parses a dnsmasq lease file ("expiry mac ip hostname client-id" per line) into a dict of MAC to IP.
+#################################################################################################################
+def parse_dnsmasq_leases(data):
+    entries = {}
+    for line in data.splitlines():
+        parts = line.split()
+        if len(parts) >= 3 and ':' not in parts[2]:
+            entries[normalize_mac(parts[1])] = parts[2]
+    return entries
+
+
+#################################################################################################################
+# Parses an ISC dhcpd lease file into a dict of MAC to IP. Later leases override earlier ones, as in the server.
+#################################################################################################################
+def parse_isc_leases(data):
+    entries = {}
+    for ip, body in re.findall(r'lease\s+([0-9.]+)\s*\{(.*?)\}', data, re.DOTALL):
+        if re.search(r'binding\s+state\s+(free|abandoned|backup)\s*;', body):
+            continue
+        mac_match = re.search(r'hardware\s+ethernet\s+([0-9a-fA-F:]+)\s*;', body)
+        if mac_match:
+            entries[normalize_mac(mac_match.group(1))] = ip
+    return entries
+
+
+#################################################################################################################
+# Parses the XML output of an nmap host discovery into a dict of MAC to IP.
+#################################################################################################################
+def parse_nmap_xml(data):
+    entries = {}
+    for host in ElementTree.fromstring(data).findall('./host'):
+        mac_address = host.find('./address[@addrtype="mac"]')
+        ip_address = host.find('./address[@addrtype="ipv4"]')
+        if mac_address is not None and ip_address is not None:
+            entries[normalize_mac(mac_address.get('addr'))] = ip_address.get('addr')
+    return entries
+
+
+#################################################################################################################
+# Command line test: resolves a MAC using only the given ARP table and lease files, without nmap.
+# Usage: ipresolver.py <mac> <arp_table_file> [lease_file ...]
+#################################################################################################################
+if __name__ == '__main__':
+    resolver = MacIpResolver([NeighborTableSource(sys.argv[2], ip_neigh_command=None), LeaseFileSource(sys.argv[3:])])
+    start = time.time()
+    print resolver.resolve(sys.argv[1], None, timeout=0)
+    start_cached = time.time()
+    print resolver.resolve(sys.argv[1], None, timeout=0)
+    print 'First lookup: {:.6f} s, cached lookup: {:.6f} s'.format(start_cached - start, time.time() - start_cached)
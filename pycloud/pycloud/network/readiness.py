@@ -0,0 +1,274 @@
+# KVM-based Discoverable Cloudlet (KD-Cloudlet) 
+# Copyright (c) 2015 Carnegie Mellon University.
+# All Rights Reserved.
+# 
+# THIS SOFTWARE IS PROVIDED "AS IS," WITH NO WARRANTIES WHATSOEVER. CARNEGIE MELLON UNIVERSITY EXPRESSLY DISCLAIMS TO THE FULLEST EXTENT PERMITTEDBY LAW ALL EXPRESS, IMPLIED, AND STATUTORY WARRANTIES, INCLUDING, WITHOUT LIMITATION, THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, AND NON-INFRINGEMENT OF PROPRIETARY RIGHTS.
+# 
+# Released under a modified BSD license, please see license.txt for full terms.
+# DM-0002138
+# 
+# KD-Cloudlet includes and/or makes use of the following Third-Party Software subject to their own licenses:
+# MiniMongo
+# Copyright (c) 2010-2014, Steve Lacy 
+# All rights reserved. Released under BSD license.
+# https://github.com/MiniMongo/minimongo/blob/master/LICENSE
+# 
+# Bootstrap
+# Copyright (c) 2011-2015 Twitter, Inc.
+# Released under the MIT License
+# https://github.com/twbs/bootstrap/blob/master/LICENSE
+# 
+# jQuery JavaScript Library v1.11.0
+# http://jquery.com/
+# Includes Sizzle.js
+# http://sizzlejs.com/
+# Copyright 2005, 2014 jQuery Foundation, Inc. and other contributors
+# Released under the MIT license
+# http://jquery.org/license
+
+
+import errno
+import os
+import random
+import select
+import socket
+import threading
+import time
+
+from pycloud.pycloud.utils.threadpool import Future
+
+# Singleton object that probes the services of all starting SVMs.
+_g_singletonReadinessMonitor = None
+_g_singletonLock = threading.Lock()
+
+
+#################################################################################################################
+# Creates the ReadinessMonitor singleton, or gets an instance of it if it had been already created.
+#################################################################################################################
+def get_readiness_monitor():
+    global _g_singletonReadinessMonitor
+    with _g_singletonLock:
+        if not _g_singletonReadinessMonitor:
+            _g_singletonReadinessMonitor = ReadinessMonitor()
+
+    return _g_singletonReadinessMonitor
+
+
+#################################################################################################################
+# State of the checks for a single service.
+#################################################################################################################
+class ReadinessProbe(object):
+
+    #################################################################################################################
+    # Constructor.
+    #################################################################################################################
+    def __init__(self, ip_address, port, timeout, http_path=None):
+        self.address = (ip_address, port)
+        self.http_path = http_path
+        self.deadline = time.time() + timeout
+        self.future = Future()
+        self.attempts = 0
+        self.delay = ReadinessMonitor.INITIAL_RETRY_DELAY_IN_S
+        self.next_attempt_time = time.time()
+        self.attempt_deadline = None
+        self.sock = None
+        self.request_sent = False
+
+
+#################################################################################################################
+# Checks if the services of starting SVMs are available, using non-blocking connections from a single thread for
+# all of them. Failed checks are retried with exponential backoff and jitter, until a per-probe timeout. If an HTTP
+# path is given, the service is only considered ready once it replies to a GET on that path with a 2xx or 3xx
+# status, which is also useful in non-bridged mode, where qemu accepts connections to forwarded ports even if the
+# service is not running yet.
+#################################################################################################################
+class ReadinessMonitor(object):
+
+    # Backoff limits between connection attempts.
+    INITIAL_RETRY_DELAY_IN_S = 0.1
+    MAX_RETRY_DELAY_IN_S = 2.0
+
+    # Max time for a single connection attempt, including the HTTP reply if needed.
+    ATTEMPT_TIMEOUT_IN_S = 2.0
+
+    #################################################################################################################
+    # Constructor.
+    #################################################################################################################
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.new_probes = []
+        self.thread = None
+
+        # Pipe used to wake up the monitor thread when new probes are added.
+        self.wakeup_read, self.wakeup_write = os.pipe()
+
+    #################################################################################################################
+    # Starts checking if the service at the given address is ready. Returns a Future that will be set to True as
+    # soon as the service is available, or False if the timeout runs out first.
+    #################################################################################################################
+    def watch(self, ip_address, port, timeout, http_path=None):
+        probe = ReadinessProbe(ip_address, int(port), timeout, http_path)
+        with self.lock:
+            self.new_probes.append(probe)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='readiness-monitor')
+                self.thread.daemon = True
+                self.thread.start()
+
+        os.write(self.wakeup_write, 'x')
+        return probe.future
+
+    #################################################################################################################
+    # Main loop of the monitor thread.
+    #################################################################################################################
+    def _run(self):
+        probes = []
+        while True:
+            try:
+                self._check_probes(probes)
+            except Exception as e:
+                print 'Error checking service readiness: ' + str(e)
+                time.sleep(self.INITIAL_RETRY_DELAY_IN_S)
+
+    #################################################################################################################
+    # Starts pending connection attempts, and waits for any socket to be ready or any attempt to time out.
+    #################################################################################################################
+    def _check_probes(self, probes):
+        with self.lock:
+            probes.extend(self.new_probes)
+            del self.new_probes[:]
+
+        # Start new attempts, and handle timeouts.
+        now = time.time()
+        for probe in list(probes):
+            if now >= probe.deadline:
+                print 'Service at {}:{} not available after {} attempts.'.format(probe.address[0], probe.address[1],
+                                                                                 probe.attempts)
+                self._finish(probe, False)
+            elif probe.sock is None and now >= probe.next_attempt_time:
+                self._start_attempt(probe, now)
+            elif probe.sock is not None and now >= probe.attempt_deadline:
+                self._fail_attempt(probe, now)
+
+            if probe.future.done():
+                probes.remove(probe)
+
+        # Wait for connections to be established or replies to arrive, or until the next attempt has to be started.
+        readers = [self.wakeup_read] + [probe.sock for probe in probes if probe.sock and probe.request_sent]
+        writers = [probe.sock for probe in probes if probe.sock and not probe.request_sent]
+        try:
+            readable, writable, _ = select.select(readers, writers, [], self._get_wait_time(probes, now))
+        except select.error as e:
+            if e[0] == errno.EINTR:
+                return
+            raise
+
+        if self.wakeup_read in readable:
+            os.read(self.wakeup_read, 4096)
+
+        now = time.time()
+        for probe in list(probes):
+            if probe.sock is not None and probe.sock in writable:
+                self._on_connected(probe, now)
+            elif probe.sock is not None and probe.sock in readable:
+                self._on_reply(probe, now)
+
+            if probe.future.done():
+                probes.remove(probe)
+
+    #################################################################################################################
+    # Returns how long the monitor can wait before it has to start or time out an attempt.
+    #################################################################################################################
+    def _get_wait_time(self, probes, now):
+        if not probes:
+            return None
+
+        next_event_time = min(min(probe.deadline,
+                                  probe.next_attempt_time if probe.sock is None else probe.attempt_deadline)
+                              for probe in probes)
+        return max(0, next_event_time - now)
+
+    #################################################################################################################
+    # Starts a non-blocking connection to the service.
+    #################################################################################################################
+    def _start_attempt(self, probe, now):
+        probe.attempts += 1
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(0)
+        result = sock.connect_ex(probe.address)
+        if result not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            sock.close()
+            self._schedule_retry(probe, now)
+            return
+
+        probe.sock = sock
+        probe.request_sent = False
+        probe.attempt_deadline = now + self.ATTEMPT_TIMEOUT_IN_S
+
+    #################################################################################################################
+    # Called when the connection finished, successfully or not. Sends the HTTP request if needed.
+    #################################################################################################################
+    def _on_connected(self, probe, now):
+        error = probe.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if error != 0:
+            self._fail_attempt(probe, now)
+            return
+
+        if not probe.http_path:
+            print 'Successful connection, service at {}:{} is available.'.format(probe.address[0], probe.address[1])
+            self._finish(probe, True)
+            return
+
+        try:
+            probe.sock.send('GET {} HTTP/1.0\r\nHost: {}\r\n\r\n'.format(probe.http_path, probe.address[0]))
+            probe.request_sent = True
+        except socket.error:
+            self._fail_attempt(probe, now)
+
+    #################################################################################################################
+    # Called when an HTTP reply arrives, or the connection was closed.
+    #################################################################################################################
+    def _on_reply(self, probe, now):
+        try:
+            reply = probe.sock.recv(64)
+        except socket.error:
+            self._fail_attempt(probe, now)
+            return
+
+        status_line = reply.split('\r\n')[0].split()
+        if len(status_line) > 1 and status_line[0].startswith('HTTP/') and status_line[1][:1] in ['2', '3']:
+            print 'Service at {}:{} replied to {}, it is available.'.format(probe.address[0], probe.address[1],
+                                                                          probe.http_path)
+            self._finish(probe, True)
+        else:
+            self._fail_attempt(probe, now)
+
+    #################################################################################################################
+    # Closes the current attempt and schedules the next one.
+    #################################################################################################################
+    def _fail_attempt(self, probe, now):
+        self._close(probe)
+        self._schedule_retry(probe, now)
+
+    #################################################################################################################
+    # Schedules the next attempt, doubling the delay each time, with random jitter so probes don't synchronize.
+    #################################################################################################################
+    def _schedule_retry(self, probe, now):
+        probe.next_attempt_time = now + random.uniform(probe.delay / 2, probe.delay)
+        probe.delay = min(probe.delay * 2, self.MAX_RETRY_DELAY_IN_S)
+
+    #################################################################################################################
+    # Sets the final result of a probe.
+    #################################################################################################################
+    def _finish(self, probe, is_ready):
+        self._close(probe)
+        probe.future.set_result(is_ready)
+
+    #################################################################################################################
+    # Closes the socket of the current attempt, if any.
+    #################################################################################################################
+    def _close(self, probe):
+        if probe.sock is not None:
+            probe.sock.close()
+            probe.sock = None
+            probe.request_sent = False
@@ -60,6 +60,7 @@ def load_environment(make_map_function, root_path, global_conf={}, app_conf={}):
 
     # Clean up the system. This must be called after the object is already created
     config['pylons.app_globals'].cloudlet.cleanup_system()
+    config['pylons.app_globals'].cloudlet.start_background_services()
 
     # Set up environment for all mako templates.
     config["pylons.app_globals"].mako_lookup = TemplateLookup(
@@ -33,6 +33,7 @@ from pylons import app_globals, request, session
 from pylons import config
 
 from pycloud.manager.lib import auth
+from pycloud.pycloud.utils.tracing import get_tracer
 
 # Creating this just to have it for the future
 class BaseController(WSGIController):
@@ -50,7 +51,11 @@ class BaseController(WSGIController):
             request.environ['pylons.routes_dict']['action'] = handler_name
 
         self.environ = environ
-        ret = WSGIController.__call__(self, environ, start_response)
+
+        # Trace the request, naming it after the controller and action so that similar requests are grouped together.
+        trace_name = type(self).__name__ + '.' + request.environ['pylons.routes_dict'].get('action', '')
+        with get_tracer().trace(trace_name, remote_address=environ.get('REMOTE_ADDR')):
+            ret = WSGIController.__call__(self, environ, start_response)
         return ret
 
     def __before__(self):
@@ -32,42 +32,50 @@ from Crypto import Random
 import hashlib
 import base64
 
+from pycloud.pycloud.utils import metrics
+
 BLOCK_SIZE = 16
 pad = lambda s: s + (BLOCK_SIZE - len(s) % BLOCK_SIZE) * chr(BLOCK_SIZE - len(s) % BLOCK_SIZE)
 unpad = lambda s: s[:-ord(s[len(s)-1:])]
 
+# Time taken to encrypt and decrypt API commands and replies.
+ENCRYPTION_SECONDS = metrics.histogram('pycloud_encryption_seconds', 'Time to encrypt or decrypt a message.',
+                                       ['operation'])
+
 #################################################################################################################
 # Encrypts a message in an AES encrypted base64 string.
 #################################################################################################################
 def encrypt_message(message, password):
-    #print 'Using password: ' + password
-    key = hashlib.sha256(password).digest()
-    iv = Random.new().read(AES.block_size)
-    encryption_suite = AES.new(key, AES.MODE_CBC, IV=iv)
-    #print 'IV: ' + binascii.hexlify(bytearray(iv))
+    with ENCRYPTION_SECONDS.labels('encrypt').time():
+        #print 'Using password: ' + password
+        key = hashlib.sha256(password).digest()
+        iv = Random.new().read(AES.block_size)
+        encryption_suite = AES.new(key, AES.MODE_CBC, IV=iv)
+        #print 'IV: ' + binascii.hexlify(bytearray(iv))
 
-    padded = pad(message)
-    cipher_text = encryption_suite.encrypt(padded)
-    #print 'Cipher Text: ' + binascii.hexlify(bytearray(cipher_text))
-    return base64.b64encode(iv + cipher_text)
+        padded = pad(message)
+        cipher_text = encryption_suite.encrypt(padded)
+        #print 'Cipher Text: ' + binascii.hexlify(bytearray(cipher_text))
+        return base64.b64encode(iv + cipher_text)
 
 #################################################################################################################
 # Decrypts an AES encrypted base64 string into plain text.
 #################################################################################################################
 def decrypt_message(message, password):
-    #print 'Using password: ' + password
-    decoded_message = base64.b64decode(message)
+    with ENCRYPTION_SECONDS.labels('decrypt').time():
+        #print 'Using password: ' + password
+        decoded_message = base64.b64decode(message)
 
-    key = hashlib.sha256(password).digest()
-    iv = decoded_message[:16]
-    cipher_text = decoded_message[16:]
-    #print 'IV: ' + binascii.hexlify(bytearray(iv))
-    #print 'Cipher Text: ' + binascii.hexlify(bytearray(cipher_text))
-    decryption_suite = AES.new(key, AES.MODE_CBC, IV=iv)
+        key = hashlib.sha256(password).digest()
+        iv = decoded_message[:16]
+        cipher_text = decoded_message[16:]
+        #print 'IV: ' + binascii.hexlify(bytearray(iv))
+        #print 'Cipher Text: ' + binascii.hexlify(bytearray(cipher_text))
+        decryption_suite = AES.new(key, AES.MODE_CBC, IV=iv)
 
-    plain_text = decryption_suite.decrypt(cipher_text)
-    unpadded = unpad(plain_text)
-    return unpadded
+        plain_text = decryption_suite.decrypt(cipher_text)
+        unpadded = unpad(plain_text)
+        return unpadded
 
 #################################################################################################################
 # Test.
@@ -0,0 +1,363 @@
+# KVM-based Discoverable Cloudlet (KD-Cloudlet) 
+# Copyright (c) 2015 Carnegie Mellon University.
+# All Rights Reserved.
+# 
+# THIS SOFTWARE IS PROVIDED "AS IS," WITH NO WARRANTIES WHATSOEVER. CARNEGIE MELLON UNIVERSITY EXPRESSLY DISCLAIMS TO THE FULLEST EXTENT PERMITTEDBY LAW ALL EXPRESS, IMPLIED, AND STATUTORY WARRANTIES, INCLUDING, WITHOUT LIMITATION, THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, AND NON-INFRINGEMENT OF PROPRIETARY RIGHTS.
+# 
+# Released under a modified BSD license, please see license.txt for full terms.
+# DM-0002138
+# 
+# KD-Cloudlet includes and/or makes use of the following Third-Party Software subject to their own licenses:
+# MiniMongo
+# Copyright (c) 2010-2014, Steve Lacy 
+# All rights reserved. Released under BSD license.
+# https://github.com/MiniMongo/minimongo/blob/master/LICENSE
+# 
+# Bootstrap
+# Copyright (c) 2011-2015 Twitter, Inc.
+# Released under the MIT License
+# https://github.com/twbs/bootstrap/blob/master/LICENSE
+# 
+# jQuery JavaScript Library v1.11.0
+# http://jquery.com/
+# Includes Sizzle.js
+# http://sizzlejs.com/
+# Copyright 2005, 2014 jQuery Foundation, Inc. and other contributors
+# Released under the MIT license
+# http://jquery.org/license
+
+#!/usr/bin/env python
+#
+
+import atexit
+import collections
+import logging
+import logging.handlers
+import os
+import sys
+import threading
+import time
+
+# Format of each line written to the log file and the console.
+LOG_FORMAT = '%(asctime)s %(levelname)-5.5s [%(threadName)s] [%(name)s] %(message)s'
+
+# Name of the logger all pycloud modules log through (module loggers are its children), and of the one that gets
+# everything still written with print.
+ROOT_LOGGER = 'pycloud'
+STDOUT_LOGGER = 'pycloud.stdout'
+
+# Default max amount of characters of a logged message; longer ones (such as whole request payloads) are truncated.
+DEFAULT_MAX_PAYLOAD = 1024
+
+# Max amount of records waiting to be written; more are dropped instead of blocking requests.
+MAX_PENDING_RECORDS = 10000
+
+# Seconds the writer thread waits for new records when there are none pending.
+WRITE_INTERVAL = 0.05
+
+# Singleton writer used by the app.
+_g_singletonLogWriter = None
+
+
+################################################################################################################
+# Starts writing all pycloud logs and printed output to the given file (and the console) from a background thread.
+# Should be called only once, when the app starts.
+################################################################################################################
+def start_logging(file_path, level=logging.INFO, max_size=10 * 1024 * 1024, backup_count=3,
+                  max_payload=DEFAULT_MAX_PAYLOAD, console=True):
+    global _g_singletonLogWriter
+    if _g_singletonLogWriter:
+        return _g_singletonLogWriter
+
+    _g_singletonLogWriter = AsyncLogWriter(file_path, max_size, backup_count, sys.stdout if console else None)
+    _g_singletonLogWriter.start()
+    atexit.register(_g_singletonLogWriter.stop)
+
+    root_logger = logging.getLogger(ROOT_LOGGER)
+    root_logger.setLevel(level)
+    root_logger.propagate = False
+    root_logger.addHandler(QueueHandler(_g_singletonLogWriter, max_payload))
+
+    # Prints from code not yet using a logger go through the queue too, instead of being written synchronously.
+    sys.stdout = StdoutLogger(logging.getLogger(STDOUT_LOGGER), sys.stdout)
+
+    return _g_singletonLogWriter
+
+
+################################################################################################################
+# Returns the log writer, or None if logging was not started.
+################################################################################################################
+def get_log_writer():
+    return _g_singletonLogWriter
+
+
+################################################################################################################
+# Converts a level name from the config (such as "debug") into a logging level.
+################################################################################################################
+def parse_level(level_name):
+    level = logging.getLevelName(level_name.upper())
+    if not isinstance(level, int):
+        raise ValueError('Unknown logging level: {}'.format(level_name))
+    return level
+
+
+################################################################################################################
+# Truncates a message to the given amount of characters, indicating how much was left out.
+################################################################################################################
+def truncate(message, max_length):
+    if max_length <= 0 or len(message) <= max_length:
+        return message
+    return '{}... ({} more characters)'.format(message[:max_length], len(message) - max_length)
+
+
+################################################################################################################
+# Handler that only queues records to be written by the writer thread, so the logging thread never waits for disk.
+################################################################################################################
+class QueueHandler(logging.Handler):
+
+    ################################################################################################################
+    # Constructor.
+    ################################################################################################################
+    def __init__(self, writer, max_payload=DEFAULT_MAX_PAYLOAD):
+        super(QueueHandler, self).__init__()
+        self.writer = writer
+        self.max_payload = max_payload
+
+    ################################################################################################################
+    # Queues the record. The message is built here, since its arguments may change after this call returns.
+    ################################################################################################################
+    def emit(self, record):
+        try:
+            record.msg = truncate(record.getMessage(), self.max_payload)
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+                record.exc_info = None
+            self.writer.add(record)
+        except Exception:
+            self.handleError(record)
+
+
+################################################################################################################
+# Replacement for sys.stdout that sends each printed line to a logger.
+################################################################################################################
+class StdoutLogger(object):
+
+    ################################################################################################################
+    # Constructor.
+    ################################################################################################################
+    def __init__(self, logger, original_stdout):
+        self.logger = logger
+        self.original_stdout = original_stdout
+        self.buffers = threading.local()
+
+    ################################################################################################################
+    # Logs every complete line; a print sends its text and its newline in separate writes, so partial lines are kept
+    # for each thread until completed.
+    ################################################################################################################
+    def write(self, data):
+        buffered = getattr(self.buffers, 'line', '') + data
+        lines = buffered.split('\n')
+        self.buffers.line = lines.pop()
+        for line in lines:
+            self.logger.info(line)
+
+    ################################################################################################################
+    # Records are flushed by the writer thread; nothing to do here.
+    ################################################################################################################
+    def flush(self):
+        pass
+
+    ################################################################################################################
+    # Some libraries need a real file descriptor for stdout.
+    ################################################################################################################
+    def fileno(self):
+        return self.original_stdout.fileno()
+
+    def isatty(self):
+        return False
+
+
+################################################################################################################
+# Thread that writes queued records to the log file, and optionally to the console, rotating the file by size.
+################################################################################################################
+class AsyncLogWriter(threading.Thread):
+
+    ################################################################################################################
+    # Constructor.
+    ################################################################################################################
+    def __init__(self, file_path, max_size, backup_count, console=None):
+        super(AsyncLogWriter, self).__init__(name='AsyncLogWriter')
+        self.daemon = True
+        self.file_path = file_path
+        self.max_size = max_size
+        self.backup_count = backup_count
+        self.console = console
+        self.formatter = logging.Formatter(LOG_FORMAT)
+
+        # Appending to and popping from a deque are thread safe and do not need a lock, unlike a Queue.
+        self.pending = collections.deque()
+        self.running = False
+        self.written = 0
+        self.dropped = 0
+        self.file = open(self.file_path, 'a')
+
+    ################################################################################################################
+    # Adds a record to be written, or drops it if too many are pending.
+    ################################################################################################################
+    def add(self, record):
+        if len(self.pending) >= MAX_PENDING_RECORDS:
+            self.dropped += 1
+            return
+        self.pending.append(record)
+
+    ################################################################################################################
+    # Starts the thread.
+    ################################################################################################################
+    def start(self):
+        self.running = True
+        super(AsyncLogWriter, self).start()
+
+    ################################################################################################################
+    # Writes pending records in batches, with a single write and flush per batch, until stopped.
+    ################################################################################################################
+    def run(self):
+        while self.running or self.pending:
+            lines = []
+            while self.pending:
+                lines.append(self._format(self.pending.popleft()))
+
+            if not lines:
+                time.sleep(WRITE_INTERVAL)
+                continue
+
+            text = ''.join(lines)
+            try:
+                self._write(text)
+                if self.console:
+                    self.console.write(text)
+                    self.console.flush()
+                self.written += len(lines)
+            except Exception as e:
+                sys.stderr.write('Error writing to log: {}\n'.format(e))
+
+        self.file.close()
+
+    ################################################################################################################
+    # Writes all records still pending, and stops the thread.
+    ################################################################################################################
+    def stop(self):
+        if self.is_alive():
+            self.running = False
+            self.join()
+
+    ################################################################################################################
+    # Returns the amount of records written, waiting to be written, and dropped.
+    ################################################################################################################
+    def get_stats(self):
+        return {'written': self.written, 'pending': len(self.pending), 'dropped': self.dropped}
+
+    ################################################################################################################
+    # Formats a record as a line of the log.
+    ################################################################################################################
+    def _format(self, record):
+        line = self.formatter.format(record) + '\n'
+        if isinstance(line, unicode):
+            line = line.encode('utf-8')
+        return line
+
+    ################################################################################################################
+    # Writes to the log file, rotating it first if it would grow over its max size.
+    ################################################################################################################
+    def _write(self, text):
+        if 0 < self.max_size < self.file.tell() + len(text):
+            self._rotate()
+        self.file.write(text)
+        self.file.flush()
+
+    ################################################################################################################
+    # Renames the log file to log.1 (and each older file to the next number) and starts a new one.
+    ################################################################################################################
+    def _rotate(self):
+        self.file.close()
+        if self.backup_count > 0:
+            for number in range(self.backup_count - 1, 0, -1):
+                older_file = '{}.{}'.format(self.file_path, number)
+                if os.path.exists(older_file):
+                    os.rename(older_file, '{}.{}'.format(self.file_path, number + 1))
+            os.rename(self.file_path, self.file_path + '.1')
+        self.file = open(self.file_path, 'w')
+
+
+################################################################################################################
+# Functions to test the class.
+################################################################################################################
+def get_args():
+    import argparse
+    parser = argparse.ArgumentParser(description='Compares request throughput with logging off, synchronous and '
+                                                 'asynchronous.')
+    parser.add_argument('-f', '--file', default='benchmark.log', help='log file to write to')
+    parser.add_argument('-n', '--requests', type=int, default=20000, help='amount of requests to simulate')
+    parser.add_argument('-s', '--size', type=int, default=4096, help='size of the request payload, in bytes')
+    return parser.parse_args()
+
+
+################################################################################################################
+# Simulates the logging of an encrypted request, logging its payloads just like the encrypted API does.
+################################################################################################################
+def simulate_request(logger, payload):
+    logger.info('Received encrypted request from device %s', 'benchmark-device')
+    logger.debug('Encrypted request: %s', payload)
+    logger.debug('Decrypted request: %s', payload)
+    logger.info('Received command: %s', 'servicevm/start')
+    logger.info('Sending encrypted reply, length: %d', len(payload))
+
+
+################################################################################################################
+# Measures requests per second for each logging mode.
+################################################################################################################
+def benchmark_logging():
+    import base64
+    import os
+    args = get_args()
+    payload = base64.b64encode(os.urandom(args.size * 3 // 4))
+    logger = logging.getLogger('benchmark')
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+
+    for mode in ['off', 'sync', 'async']:
+        writer = None
+        if mode == 'off':
+            handler = logging.NullHandler()
+        elif mode == 'sync':
+            handler = logging.handlers.RotatingFileHandler(args.file, maxBytes=10 * 1024 * 1024, backupCount=1)
+            handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        else:
+            writer = AsyncLogWriter(args.file, 10 * 1024 * 1024, 1)
+            writer.start()
+            handler = QueueHandler(writer)
+        logger.addHandler(handler)
+
+        start_time = time.time()
+        for _ in range(args.requests):
+            simulate_request(logger, payload)
+        elapsed_time = time.time() - start_time
+
+        # The writer thread may still be writing after the requests finished; that does not delay requests.
+        logger.removeHandler(handler)
+        handler.close()
+        result = '{:>6}: {:8.0f} requests/s'.format(mode, args.requests / elapsed_time)
+        if writer:
+            drain_start_time = time.time()
+            writer.stop()
+            result += ' (writer finished {:.2f}s later, {} records dropped)'.format(time.time() - drain_start_time,
+                                                                                   writer.dropped)
+        print result
+
+    for suffix in ['', '.1']:
+        if os.path.exists(args.file + suffix):
+            os.remove(args.file + suffix)
+
+
+if __name__ == '__main__':
+    benchmark_logging()
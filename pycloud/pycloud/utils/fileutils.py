@@ -36,6 +36,9 @@ import stat
 import fileinput
 import sys
 import re
+import fcntl
+import ctypes
+import ctypes.util
 
 from subprocess import Popen, PIPE
 
@@ -43,6 +46,32 @@ from subprocess import Popen, PIPE
 # Various file-related utility functions.
 ################################################################################################################
 
+# ioctl request to create a copy-on-write clone of a whole file (from linux/fs.h).
+FICLONE = 0x40049409
+
+# Block size used when looking for holes while copying files.
+SPARSE_COPY_BLOCK_SIZE = 64 * 1024
+
+# Advice values for posix_fadvise (from linux/fadvise.h).
+POSIX_FADV_WILLNEED = 3
+POSIX_FADV_DONTNEED = 4
+
+# C library, used for calls not available in python's os module.
+_libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+_libc.posix_fadvise.argtypes = [ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong, ctypes.c_int]
+_libc.mmap.restype = ctypes.c_void_p
+_libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_long]
+_libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+_libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_char_p]
+
+# Values used to map files to query their residency (from sys/mman.h).
+PROT_READ = 1
+MAP_SHARED = 1
+MAP_FAILED = ctypes.c_void_p(-1).value
+
+# Size of the pages in the page cache.
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
 ################################################################################################################
 # Removes all contents of a folder. Exceptions can be added as a list (full path).
 ################################################################################################################
@@ -88,6 +117,78 @@ def make_read_write_all(file_path):
         os.chmod(file_path,
                  stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH | stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
 
+################################################################################################################
+# Copies a file without duplicating its data when possible. On filesystems that support reflinks (btrfs, xfs, etc)
+# the new file will share all data blocks with the original one until they are modified. Otherwise, the file is
+# copied skipping blocks of zeros, so that the copy will be sparse. Returns True if a reflink was created.
+################################################################################################################
+def copy_file_cow(source_path, destination_path):
+    with open(source_path, 'rb') as source_file:
+        with open(destination_path, 'wb') as destination_file:
+            try:
+                fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+                return True
+            except (IOError, OSError):
+                # Reflinks not supported by the filesystem, or files on different filesystems.
+                pass
+
+            # Fall back to a sparse copy.
+            zero_block = '\0' * SPARSE_COPY_BLOCK_SIZE
+            while True:
+                data = source_file.read(SPARSE_COPY_BLOCK_SIZE)
+                if not data:
+                    break
+
+                if data == zero_block:
+                    destination_file.seek(len(data), os.SEEK_CUR)
+                else:
+                    destination_file.write(data)
+
+            # Ensure the file has the right size if it ended in a hole.
+            destination_file.truncate()
+            return False
+
+################################################################################################################
+# Gives the kernel advice about how a range of a file will be accessed (i.e., to load it into or drop it from the
+# page cache). A length of 0 means until the end of the file.
+################################################################################################################
+def fadvise(file_path, advice, offset=0, length=0):
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        result = _libc.posix_fadvise(fd, offset, length, advice)
+        if result != 0:
+            raise OSError(result, os.strerror(result), file_path)
+    finally:
+        os.close(fd)
+
+################################################################################################################
+# Returns a bytearray with one entry per page of the file, which is 1 if that page is currently in the page cache.
+################################################################################################################
+def get_resident_pages(file_path):
+    size = os.path.getsize(file_path)
+    num_pages = (size + PAGE_SIZE - 1) // PAGE_SIZE
+    if num_pages == 0:
+        return bytearray()
+
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        address = _libc.mmap(None, size, PROT_READ, MAP_SHARED, fd, 0)
+        if address == MAP_FAILED:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), file_path)
+        try:
+            pages = ctypes.create_string_buffer(num_pages)
+            if _libc.mincore(address, size, pages) != 0:
+                error = ctypes.get_errno()
+                raise OSError(error, os.strerror(error), file_path)
+        finally:
+            _libc.munmap(address, size)
+    finally:
+        os.close(fd)
+
+    # Only the lowest bit of each entry is defined.
+    return bytearray(ord(page) & 1 for page in pages.raw)
+
 ################################################################################################################
 # Changes ownership of the given file to the user running the script.
 # NOTE: needs sudo permissions.
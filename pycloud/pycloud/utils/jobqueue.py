@@ -0,0 +1,116 @@
+# KVM-based Discoverable Cloudlet (KD-Cloudlet) 
+# Copyright (c) 2015 Carnegie Mellon University.
+# All Rights Reserved.
+# 
+# THIS SOFTWARE IS PROVIDED "AS IS," WITH NO WARRANTIES WHATSOEVER. CARNEGIE MELLON UNIVERSITY EXPRESSLY DISCLAIMS TO THE FULLEST EXTENT PERMITTEDBY LAW ALL EXPRESS, IMPLIED, AND STATUTORY WARRANTIES, INCLUDING, WITHOUT LIMITATION, THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, AND NON-INFRINGEMENT OF PROPRIETARY RIGHTS.
+# 
+# Released under a modified BSD license, please see license.txt for full terms.
+# DM-0002138
+# 
+# KD-Cloudlet includes and/or makes use of the following Third-Party Software subject to their own licenses:
+# MiniMongo
+# Copyright (c) 2010-2014, Steve Lacy 
+# All rights reserved. Released under BSD license.
+# https://github.com/MiniMongo/minimongo/blob/master/LICENSE
+# 
+# Bootstrap
+# Copyright (c) 2011-2015 Twitter, Inc.
+# Released under the MIT License
+# https://github.com/twbs/bootstrap/blob/master/LICENSE
+# 
+# jQuery JavaScript Library v1.11.0
+# http://jquery.com/
+# Includes Sizzle.js
+# http://sizzlejs.com/
+# Copyright 2005, 2014 jQuery Foundation, Inc. and other contributors
+# Released under the MIT license
+# http://jquery.org/license
+
+
+
+import threading
+import time
+
+# Used to generate unique IDs for the jobs.
+from uuid import uuid4
+
+from pycloud.pycloud.utils.threadpool import ThreadPool
+
+
+################################################################################################################
+# Base class of jobs executed in the background by a JobQueue, whose status can be queried while they run and for a
+# while after they finish. Subclasses define run(), which must set end_time when it is done, successfully or not.
+################################################################################################################
+class Job(object):
+
+    # Phase of jobs that have not started yet.
+    PHASE_QUEUED = 'queued'
+
+    ################################################################################################################
+    # Constructor.
+    ################################################################################################################
+    def __init__(self):
+        self.job_id = str(uuid4())
+        self.phase = self.PHASE_QUEUED
+        self.error = None
+        self.start_time = time.time()
+        self.end_time = None
+
+    ################################################################################################################
+    # Indicates whether the job has finished, successfully or not.
+    ################################################################################################################
+    def is_finished(self):
+        return self.end_time is not None
+
+
+################################################################################################################
+# Queue of jobs, executed by a fixed amount of workers. Finished jobs are kept for a while so that their status can
+# be queried.
+################################################################################################################
+class JobQueue(object):
+
+    # Time finished jobs are kept so that their status can be queried.
+    FINISHED_JOB_TTL_IN_S = 600
+
+    ################################################################################################################
+    # Constructor. A max queue size of 0 means the queue is not bounded.
+    ################################################################################################################
+    def __init__(self, num_workers, max_queue_size=0, name='jobs'):
+        self.pool = ThreadPool(num_workers, max_queue_size, name=name)
+        self.jobs = {}
+        self.jobs_lock = threading.Lock()
+
+    ################################################################################################################
+    # Returns the job with the given id, or None if it does not exist.
+    ################################################################################################################
+    def get_job(self, job_id):
+        with self.jobs_lock:
+            return self.jobs.get(job_id)
+
+    ################################################################################################################
+    # Queues the given job, whose run() will be called with the given arguments. Raises ThreadPoolFullException if
+    # the queue is full.
+    ################################################################################################################
+    def _submit_job(self, job, *args):
+        self._remove_old_jobs()
+
+        with self.jobs_lock:
+            self.jobs[job.job_id] = job
+        try:
+            self.pool.submit(job.run, *args)
+        except Exception:
+            with self.jobs_lock:
+                del self.jobs[job.job_id]
+            raise
+        return job
+
+    ################################################################################################################
+    # Removes finished jobs that have not been queried in a while.
+    ################################################################################################################
+    def _remove_old_jobs(self):
+        now = time.time()
+        with self.jobs_lock:
+            for job_id in self.jobs.keys():
+                job = self.jobs[job_id]
+                if job.is_finished() and now - job.end_time > self.FINISHED_JOB_TTL_IN_S:
+                    del self.jobs[job_id]
@@ -0,0 +1,309 @@
+# KVM-based Discoverable Cloudlet (KD-Cloudlet) 
+# Copyright (c) 2015 Carnegie Mellon University.
+# All Rights Reserved.
+# 
+# THIS SOFTWARE IS PROVIDED "AS IS," WITH NO WARRANTIES WHATSOEVER. CARNEGIE MELLON UNIVERSITY EXPRESSLY DISCLAIMS TO THE FULLEST EXTENT PERMITTEDBY LAW ALL EXPRESS, IMPLIED, AND STATUTORY WARRANTIES, INCLUDING, WITHOUT LIMITATION, THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, AND NON-INFRINGEMENT OF PROPRIETARY RIGHTS.
+# 
+# Released under a modified BSD license, please see license.txt for full terms.
+# DM-0002138
+# 
+# KD-Cloudlet includes and/or makes use of the following Third-Party Software subject to their own licenses:
+# MiniMongo
+# Copyright (c) 2010-2014, Steve Lacy 
+# All rights reserved. Released under BSD license.
+# https://github.com/MiniMongo/minimongo/blob/master/LICENSE
+# 
+# Bootstrap
+# Copyright (c) 2011-2015 Twitter, Inc.
+# Released under the MIT License
+# https://github.com/twbs/bootstrap/blob/master/LICENSE
+# 
+# jQuery JavaScript Library v1.11.0
+# http://jquery.com/
+# Includes Sizzle.js
+# http://sizzlejs.com/
+# Copyright 2005, 2014 jQuery Foundation, Inc. and other contributors
+# Released under the MIT license
+# http://jquery.org/license
+
+#!/usr/bin/env python
+#
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Default histogram buckets, in seconds, covering from fast DB calls to slow VM starts.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Content type of the Prometheus text format.
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+################################################################################################################
+# Escapes a label value for the Prometheus text format.
+################################################################################################################
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+################################################################################################################
+# Formats a set of labels for the Prometheus text format.
+################################################################################################################
+def _format_labels(label_names, label_values, extra_labels=()):
+    pairs = zip(label_names, label_values) + list(extra_labels)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in pairs) + '}'
+
+
+################################################################################################################
+# Formats a number for the Prometheus text format.
+################################################################################################################
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+################################################################################################################
+# Base class of metrics. Each metric has a child per combination of label values; children are created once, and
+# updating a child only takes its own lock, so requests updating different children never wait for each other.
+# This class is abstract: subclasses set TYPE and define _create_child(), which returns a new child, and
+# _render_child(label_values, child), which returns the lines for that child.
+################################################################################################################
+class Metric(object):
+
+    # Type of the metric, in the Prometheus text format.
+    TYPE = None
+
+    ################################################################################################################
+    # Constructor.
+    ################################################################################################################
+    def __init__(self, name, description, label_names=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.children = {}
+        self.children_lock = threading.Lock()
+
+    ################################################################################################################
+    # Returns the child for the given label values, given in the same order as the label names.
+    ################################################################################################################
+    def labels(self, *label_values):
+        label_values = tuple(str(value) for value in label_values)
+        child = self.children.get(label_values)
+        if child is None:
+            with self.children_lock:
+                child = self.children.get(label_values)
+                if child is None:
+                    child = self._create_child()
+                    self.children[label_values] = child
+        return child
+
+    ################################################################################################################
+    # Returns the lines describing the metric, in the Prometheus text format.
+    ################################################################################################################
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description), '# TYPE {} {}'.format(self.name, self.TYPE)]
+        with self.children_lock:
+            children = self.children.items()
+        for label_values, child in sorted(children):
+            lines.extend(self._render_child(label_values, child))
+        return lines
+
+
+################################################################################################################
+# Value holder with its own lock, used as the child of counters and gauges.
+################################################################################################################
+class _Value(object):
+
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        with self.lock:
+            self.value = value
+
+    def get(self):
+        return self.value
+
+
+################################################################################################################
+# A value that only goes up, such as an amount of bytes transferred.
+################################################################################################################
+class Counter(Metric):
+
+    TYPE = 'counter'
+
+    def _create_child(self):
+        return _Value()
+
+    def _render_child(self, label_values, child):
+        return ['{}{} {}'.format(self.name, _format_labels(self.label_names, label_values), _format_value(child.get()))]
+
+
+################################################################################################################
+# A value that can go up and down. Instead of being updated, its values can be obtained when the metrics are
+# collected, from a function that returns a dict of label values (as a tuple) to value.
+################################################################################################################
+class Gauge(Metric):
+
+    TYPE = 'gauge'
+
+    def __init__(self, name, description, label_names=(), function=None):
+        super(Gauge, self).__init__(name, description, label_names)
+        self.function = function
+
+    def _create_child(self):
+        return _Value()
+
+    def _render_child(self, label_values, child):
+        return ['{}{} {}'.format(self.name, _format_labels(self.label_names, label_values), _format_value(child.get()))]
+
+    def render(self):
+        if self.function:
+            values = self.function()
+            with self.children_lock:
+                self.children = {}
+            for label_values, value in values.iteritems():
+                self.labels(*label_values).set(value)
+        return super(Gauge, self).render()
+
+
+################################################################################################################
+# Counts of observed values, such as latencies, in buckets.
+################################################################################################################
+class _HistogramValues(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    ################################################################################################################
+    # Measures the time the with block takes.
+    ################################################################################################################
+    @contextmanager
+    def time(self):
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start_time)
+
+    def get(self):
+        with self.lock:
+            return list(self.counts), self.sum
+
+
+################################################################################################################
+# Distribution of values, such as latencies, in cumulative buckets.
+################################################################################################################
+class Histogram(Metric):
+
+    TYPE = 'histogram'
+
+    def __init__(self, name, description, label_names=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, description, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def _create_child(self):
+        return _HistogramValues(self.buckets)
+
+    def _render_child(self, label_values, child):
+        counts, total = child.get()
+        lines = []
+        cumulative_count = 0
+        for upper_bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative_count += count
+            labels = _format_labels(self.label_names, label_values, [('le', _format_value(upper_bound))])
+            lines.append('{}_bucket{} {}'.format(self.name, labels, cumulative_count))
+        labels = _format_labels(self.label_names, label_values)
+        lines.append('{}_sum{} {}'.format(self.name, labels, _format_value(total)))
+        lines.append('{}_count{} {}'.format(self.name, labels, cumulative_count))
+        return lines
+
+
+################################################################################################################
+# Set of metrics of the process, to be exposed together.
+################################################################################################################
+class MetricsRegistry(object):
+
+    ################################################################################################################
+    # Constructor.
+    ################################################################################################################
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    ################################################################################################################
+    # Adds a metric, or returns the one already registered with the same name.
+    ################################################################################################################
+    def register(self, metric):
+        with self.lock:
+            if metric.name not in self.metrics:
+                self.metrics[metric.name] = metric
+            return self.metrics[metric.name]
+
+    ################################################################################################################
+    # Returns all metrics in the Prometheus text format.
+    ################################################################################################################
+    def render(self):
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                print 'Error collecting metric {}: {}'.format(metric.name, str(e))
+        return '\n'.join(lines) + '\n'
+
+
+# Registry used by the app.
+REGISTRY = MetricsRegistry()
+
+
+################################################################################################################
+# Helpers to create and register metrics in the app's registry.
+################################################################################################################
+def counter(name, description, label_names=()):
+    return REGISTRY.register(Counter(name, description, label_names))
+
+def gauge(name, description, label_names=(), function=None):
+    return REGISTRY.register(Gauge(name, description, label_names, function))
+
+def histogram(name, description, label_names=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, description, label_names, buckets))
+
+
+################################################################################################################
+# Command line test: prints a few metrics.
+################################################################################################################
+if __name__ == '__main__':
+    test_counter = counter('test_bytes_total', 'Bytes.', ['phase'])
+    test_counter.labels('disk').inc(1024)
+    gauge('test_active', 'Active things.', ['kind'], function=lambda: {('a',): 2, ('b"c',): 3})
+    test_histogram = histogram('test_seconds', 'Latency.', ['path'], buckets=(0.01, 0.1))
+    with test_histogram.labels('cold').time():
+        time.sleep(0.02)
+    test_histogram.labels('cold').observe(0.005)
+    print REGISTRY.render()
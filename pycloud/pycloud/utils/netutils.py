@@ -31,13 +31,8 @@
 
 import random
 import socket
-import time
 
 import netifaces
-import netaddr
-
-from subprocess import Popen, PIPE
-from xml.etree import ElementTree
 
 ################################################################################################################
 # Various net-related utility functions.
@@ -67,36 +62,6 @@ def get_adapter_ip_address(adapter_name, ip_position=0):
 
     return addr_info['addr']
 
-################################################################################################################
-# Will locate the IP address for a given mac address
-################################################################################################################
-def find_ip_for_mac(mac, adapter, nmap='nmap', retry=5):
-    if retry == 0:
-        print 'No more retries, IP not found.'
-        return None
-
-    # Get the ip range of the given adapter.
-    addr_info = netifaces.ifaddresses(adapter)[netifaces.AF_INET][0]
-    ip_range = str(netaddr.IPNetwork('%s/%s' % (addr_info['addr'], addr_info['netmask'])))
-
-    print 'Scanning range %s for MAC address %s' % (ip_range, mac)
-    p = Popen(['sudo', nmap, '-sP', ip_range, '-oX', '-'], stdin=PIPE, stdout=PIPE, stderr=PIPE)
-    out, err = p.communicate()
-    rc = p.returncode
-    if rc != 0:
-        print "Error executing nmap:\n%s" % err
-        raise Exception("Error executing nmap:\n%s" % err)
-    xml = ElementTree.fromstring(out)
-    try:
-        ip = xml.find('./host/address[@addr="%s"]/../address[@addrtype="ipv4"]' % mac.upper()).get('addr')
-        print 'Found IP: ', ip
-    except:
-        print 'Failed to find IP, retrying...'
-        time.sleep(1)
-        ip = find_ip_for_mac(mac, adapter, nmap, retry=(retry - 1))
-
-    return ip
-
 ################################################################################################################
 # Checks if a given port is open on a given IP address.
 ################################################################################################################
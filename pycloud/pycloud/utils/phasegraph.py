@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+#
+
+import Queue
+import sys
+import time
+
+from pycloud.pycloud.utils import tracing
+
+
+################################################################################################################
+# Exception raised when the phases of a graph can't be executed due to their dependencies.
+################################################################################################################
+class PhaseGraphException(Exception):
+    def __init__(self, message):
+        super(PhaseGraphException, self).__init__(message)
+        self.message = message
+
+
+################################################################################################################
+# Set of phases of a process, with dependencies between them. Phases are executed in a thread pool as soon as all
+# the phases they depend on finish, so independent phases run concurrently. The time each phase took is recorded.
+################################################################################################################
+class PhaseGraph(object):
+
+    ################################################################################################################
+    # Constructor.
+    # - progress: optional function that will be called with the name of each phase when it starts.
+    ################################################################################################################
+    def __init__(self, name, progress=None):
+        self.name = name
+        self.progress = progress
+        self.phases = []
+        self.dependencies = {}
+        self.functions = {}
+        self.timings = {}
+        self.total_time = 0
+
+    ################################################################################################################
+    # Adds a phase, which will be executed after all the phases it depends on have finished.
+    ################################################################################################################
+    def add(self, phase_name, function, depends_on=None):
+        self.phases.append(phase_name)
+        self.functions[phase_name] = function
+        self.dependencies[phase_name] = list(depends_on) if depends_on else []
+
+    ################################################################################################################
+    # Executes all phases using the given thread pool, and waits for them to finish. If a phase fails, no new phases
+    # are started, and its exception is raised once the phases that were already running finish.
+    ################################################################################################################
+    def run(self, pool):
+        for phase_name in self.phases:
+            for dependency in self.dependencies[phase_name]:
+                if dependency not in self.functions:
+                    raise PhaseGraphException('Phase {} depends on unknown phase {}.'.format(phase_name, dependency))
+
+        start_time = time.time()
+        parent_span = tracing.current_span()
+        completed = Queue.Queue()
+        pending = list(self.phases)
+        running = set()
+        finished = set()
+        error = None
+        while pending or running:
+            # Start all phases that have their dependencies ready, unless something already failed.
+            if not error:
+                for phase_name in list(pending):
+                    if all(dependency in finished for dependency in self.dependencies[phase_name]):
+                        pending.remove(phase_name)
+                        running.add(phase_name)
+                        pool.submit(self._run_phase, phase_name, completed, start_time, parent_span)
+
+            if not running:
+                if error:
+                    break
+                raise PhaseGraphException('Phases {} of {} have circular dependencies.'.format(pending, self.name))
+
+            # Wait for any of the running phases to finish.
+            phase_name, exc_info = completed.get()
+            running.remove(phase_name)
+            if exc_info:
+                if not error:
+                    error = exc_info
+            else:
+                finished.add(phase_name)
+
+        self.total_time = time.time() - start_time
+        self._print_timings()
+        if error:
+            raise error[0], error[1], error[2]
+
+    ################################################################################################################
+    # Executes a phase, recording its start offset and duration, and notifies when it finishes. The phase is traced as
+    # a child of the span that was active when the graph was run, since it runs in another thread.
+    ################################################################################################################
+    def _run_phase(self, phase_name, completed, graph_start_time, parent_span):
+        phase_start_time = time.time()
+        exc_info = None
+        try:
+            if self.progress:
+                self.progress(phase_name)
+            with tracing.activate(parent_span), tracing.span(phase_name):
+                self.functions[phase_name]()
+        except:
+            exc_info = sys.exc_info()
+        finally:
+            phase_end_time = time.time()
+            self.timings[phase_name] = {'start': phase_start_time - graph_start_time,
+                                        'duration': phase_end_time - phase_start_time}
+            completed.put((phase_name, exc_info))
+
+    ################################################################################################################
+    # Prints the time each of the executed phases took.
+    ################################################################################################################
+    def _print_timings(self):
+        print 'Phase timings for {} (total {:.3f} s):'.format(self.name, self.total_time)
+        for phase_name in self.phases:
+            if phase_name in self.timings:
+                timing = self.timings[phase_name]
+                print '\t{}: started at +{:.3f} s, took {:.3f} s'.format(phase_name, timing['start'], timing['duration'])
@@ -29,40 +29,216 @@
 #!/usr/bin/env python
 #       
 
-import random
+import collections
 import socket
+import threading
 
+from pymongo.errors import DuplicateKeyError
 
+from pycloud.pycloud.utils import metrics
+
+# Default range of host ports reserved for SVM port forwarding. It ends below Linux's default ephemeral port range
+# (32768-60999), so that outgoing connections of the host do not take ports we hand out.
+DEFAULT_RANGE_START = 10000
+DEFAULT_RANGE_END = 32767
+
+# Name of the collection where allocations are persisted, so that they are shared between apps and survive restarts.
+ALLOCATIONS_COLLECTION = 'allocated_ports'
+
+# Singleton object to allocate ports.
+_g_singletonPortManager = None
+
+# Amount of ports allocated to SVMs, obtained when metrics are collected.
+ALLOCATED_PORTS = metrics.gauge('pycloud_allocated_ports', 'Host ports allocated to SVMs.',
+                                function=lambda: {(): get_port_manager().get_stats()['allocated']})
+
+
+################################################################################################################
+# Creates the port manager singleton, or gets an instance of it if it had been already created.
+################################################################################################################
+def get_port_manager():
+    global _g_singletonPortManager
+    if not _g_singletonPortManager:
+        from pycloud.pycloud.cloudlet import get_cloudlet_instance
+        cloudlet = get_cloudlet_instance()
+        _g_singletonPortManager = PortManager(cloudlet.db[ALLOCATIONS_COLLECTION],
+                                              cloudlet.port_range_start, cloudlet.port_range_end)
+
+    return _g_singletonPortManager
+
+
+################################################################################################################
+# Exception type used by the port manager.
 ################################################################################################################
-# Handles TCP ports.
+class PortManagerException(Exception):
+    def __init__(self, message):
+        super(PortManagerException, self).__init__(message)
+        self.message = message
+
+
+################################################################################################################
+# Returns True if a TCP port can be bound on all interfaces, as QEMU does when forwarding it.
+################################################################################################################
+def is_port_bindable(port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(('', port))
+        return True
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+
+################################################################################################################
+# Handles TCP ports. Ports are taken from a reserved range, tracked in an in-memory bitmap with a queue of free
+# ports, so allocating and freeing are O(1). Every allocation is also stored in Mongo using the port as the document
+# id, which makes it atomic across all processes using the same database. Since other programs may be using a port
+# of the range, a port is only handed out if it can be bound when it leaves the free queue.
 ################################################################################################################
 class PortManager(object):
 
     ################################################################################################################
-    # Generate a random port number which is available.
-    ################################################################################################################ 
-    @staticmethod  
-    def generate_random_available_port():
-        # The range of ports were we will take a port from.
-        range_start = 10000
-        range_end = 60000
-        
-        # In practice, this loop will almost always run once, since we will not be handling that many
-        # running instances to generate collisions.
-        max_attempts = 5000
-        num_attempts = 0
-        while True:
-            # Get a new random port.
-            num_attempts += 1
-            port = random.randint(range_start, range_end)
-
-            # Check if the port is in use.
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            result = sock.connect_ex(('127.0.0.1', port))
-            port_is_in_use = result == 0
-            if not port_is_in_use:
-                # If the port is available, stop looking for more ports.
-                return port
-
-            if num_attempts >= max_attempts:
-                raise Exception("Too many ports tried, no ports available found.")
+    # Constructor.
+    ################################################################################################################
+    def __init__(self, collection, range_start=DEFAULT_RANGE_START, range_end=DEFAULT_RANGE_END):
+        if range_end < range_start:
+            raise PortManagerException('Invalid port range {}-{}'.format(range_start, range_end))
+
+        self.collection = collection
+        self.range_start = range_start
+        self.range_end = range_end
+        self.lock = threading.Lock()
+
+        # One byte per port in the range; 1 means allocated.
+        self.bitmap = None
+
+        # Ports known to be free. Freed ports go to the back, so they are not immediately reused.
+        self.free_ports = None
+
+        self._load()
+
+    ################################################################################################################
+    # Rebuilds the bitmap and free queue from the allocations stored in the DB.
+    ################################################################################################################
+    def _load(self):
+        self.bitmap = bytearray(self.range_end - self.range_start + 1)
+        for allocation in self.collection.find({'_id': {'$gte': self.range_start, '$lte': self.range_end}}):
+            self.bitmap[allocation['_id'] - self.range_start] = 1
+
+        self.free_ports = collections.deque(port for port in xrange(self.range_start, self.range_end + 1)
+                                            if not self.bitmap[port - self.range_start])
+
+    ################################################################################################################
+    # Returns True if the port is inside the range we handle.
+    ################################################################################################################
+    def _in_range(self, port):
+        return self.range_start <= port <= self.range_end
+
+    ################################################################################################################
+    # Gets a free port and marks it as allocated to the given SVM.
+    ################################################################################################################
+    def allocate(self, svm_id):
+        with self.lock:
+            for reloaded in [False, True]:
+                if reloaded:
+                    # Other processes may have freed ports since we last looked at the DB.
+                    self._load()
+
+                # Ports used by other programs are put back at the end of the queue once we are done, to check again
+                # later.
+                busy_ports = []
+                try:
+                    while self.free_ports:
+                        port = self.free_ports.popleft()
+                        if self.bitmap[port - self.range_start]:
+                            # Stale entry, it was reserved explicitly after being queued.
+                            continue
+
+                        if not is_port_bindable(port):
+                            busy_ports.append(port)
+                            continue
+
+                        self.bitmap[port - self.range_start] = 1
+                        if self._store(port, svm_id):
+                            return port
+                finally:
+                    self.free_ports.extend(busy_ports)
+
+            raise PortManagerException('No ports available in range {}-{}'.format(self.range_start, self.range_end))
+
+    ################################################################################################################
+    # Marks a specific port as allocated to the given SVM, if possible. Returns True if it could be reserved.
+    ################################################################################################################
+    def reserve(self, port, svm_id):
+        with self.lock:
+            if self._in_range(port):
+                if self.bitmap[port - self.range_start]:
+                    return False
+                self.bitmap[port - self.range_start] = 1
+            return self._store(port, svm_id)
+
+    ################################################################################################################
+    # Stores an allocation in the DB. Returns False if another process has already allocated that port.
+    ################################################################################################################
+    def _store(self, port, svm_id):
+        try:
+            self.collection.insert({'_id': port, 'svm_id': svm_id}, w=1)
+            return True
+        except DuplicateKeyError:
+            return False
+
+    ################################################################################################################
+    # Frees a port so it can be allocated again.
+    ################################################################################################################
+    def free(self, port):
+        with self.lock:
+            self.collection.remove({'_id': port}, w=1)
+            self._release(port)
+
+    ################################################################################################################
+    # Frees all ports allocated to the given SVM.
+    ################################################################################################################
+    def free_all(self, svm_id):
+        with self.lock:
+            ports = [allocation['_id'] for allocation in self.collection.find({'svm_id': svm_id})]
+            if ports:
+                self.collection.remove({'_id': {'$in': ports}}, w=1)
+                for port in ports:
+                    self._release(port)
+
+    ################################################################################################################
+    # Marks a port as free in memory.
+    ################################################################################################################
+    def _release(self, port):
+        if self._in_range(port) and self.bitmap[port - self.range_start]:
+            self.bitmap[port - self.range_start] = 0
+            self.free_ports.append(port)
+
+    ################################################################################################################
+    # Frees, in bulk, all allocations belonging to SVMs that are no longer alive. Returns the amount of ports freed.
+    ################################################################################################################
+    def reconcile(self, live_svm_ids):
+        with self.lock:
+            result = self.collection.remove({'svm_id': {'$nin': list(live_svm_ids)}}, w=1)
+            self._load()
+
+        num_freed = result['n'] if result and 'n' in result else 0
+        print 'Port allocations reconciled, {} stale ports freed.'.format(num_freed)
+        return num_freed
+
+    ################################################################################################################
+    # Returns information about how full the port range is.
+    ################################################################################################################
+    def get_stats(self):
+        with self.lock:
+            total = len(self.bitmap)
+            allocated = self.bitmap.count(b'\x01')
+
+        return {'range_start': self.range_start,
+                'range_end': self.range_end,
+                'total': total,
+                'allocated': allocated,
+                'free': total - allocated,
+                'usage_percent': round(100.0 * allocated / total, 2)}
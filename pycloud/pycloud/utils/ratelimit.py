@@ -0,0 +1,114 @@
+# KVM-based Discoverable Cloudlet (KD-Cloudlet) 
+# Copyright (c) 2015 Carnegie Mellon University.
+# All Rights Reserved.
+# 
+# THIS SOFTWARE IS PROVIDED "AS IS," WITH NO WARRANTIES WHATSOEVER. CARNEGIE MELLON UNIVERSITY EXPRESSLY DISCLAIMS TO THE FULLEST EXTENT PERMITTEDBY LAW ALL EXPRESS, IMPLIED, AND STATUTORY WARRANTIES, INCLUDING, WITHOUT LIMITATION, THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, AND NON-INFRINGEMENT OF PROPRIETARY RIGHTS.
+# 
+# Released under a modified BSD license, please see license.txt for full terms.
+# DM-0002138
+# 
+# KD-Cloudlet includes and/or makes use of the following Third-Party Software subject to their own licenses:
+# MiniMongo
+# Copyright (c) 2010-2014, Steve Lacy 
+# All rights reserved. Released under BSD license.
+# https://github.com/MiniMongo/minimongo/blob/master/LICENSE
+# 
+# Bootstrap
+# Copyright (c) 2011-2015 Twitter, Inc.
+# Released under the MIT License
+# https://github.com/twbs/bootstrap/blob/master/LICENSE
+# 
+# jQuery JavaScript Library v1.11.0
+# http://jquery.com/
+# Includes Sizzle.js
+# http://sizzlejs.com/
+# Copyright 2005, 2014 jQuery Foundation, Inc. and other contributors
+# Released under the MIT license
+# http://jquery.org/license
+
+
+import threading
+import time
+
+# Size of the blocks in which throttled data is handed out.
+DEFAULT_BLOCK_SIZE = 64 * 1024
+
+
+################################################################################################################
+# Limits the rate at which data is sent by several threads together. Each block of data reserves the time it takes
+# to send it at the max rate, after the blocks reserved before it, so time left idle is not saved up for bursts. The
+# max rate can be changed at any time, and applies from the next block.
+################################################################################################################
+class RateLimiter(object):
+
+    ################################################################################################################
+    # Constructor. A max rate (in bytes per second) of None or 0 means no limit.
+    ################################################################################################################
+    def __init__(self, max_rate=None):
+        self.max_rate = max_rate or None
+        self.next_free_time = 0.0
+        self.lock = threading.Lock()
+
+    ################################################################################################################
+    # Changes the max rate, in bytes per second; None or 0 removes the limit.
+    ################################################################################################################
+    def set_max_rate(self, max_rate):
+        with self.lock:
+            self.max_rate = max_rate or None
+
+            # Time reserved with the old rate is not waited for.
+            self.next_free_time = min(self.next_free_time, time.time())
+
+    ################################################################################################################
+    # Returns the max rate, in bytes per second, or None if there is no limit.
+    ################################################################################################################
+    def get_max_rate(self):
+        return self.max_rate
+
+    ################################################################################################################
+    # Waits until amount bytes can be sent without going over the max rate.
+    ################################################################################################################
+    def consume(self, amount):
+        with self.lock:
+            if not self.max_rate:
+                return
+            now = time.time()
+            start_time = max(now, self.next_free_time)
+            self.next_free_time = start_time + float(amount) / self.max_rate
+
+        if start_time > now:
+            time.sleep(start_time - now)
+
+
+################################################################################################################
+# File-like object that returns a string in blocks, each one once the rate limiter allows it, so that a request body
+# built from it is sent at the max rate. Its length is known, so it is sent with a Content-Length header.
+################################################################################################################
+class ThrottledStream(object):
+
+    ################################################################################################################
+    # Constructor.
+    ################################################################################################################
+    def __init__(self, data, rate_limiter, block_size=DEFAULT_BLOCK_SIZE):
+        self.data = data
+        self.rate_limiter = rate_limiter
+        self.block_size = block_size
+        self.position = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    ################################################################################################################
+    # Returns the next size bytes of data (all that is left if size is not given), waiting for the rate limiter for
+    # each block of it.
+    ################################################################################################################
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self.data) - self.position
+        end = min(self.position + size, len(self.data))
+        start = self.position
+        while self.position < end:
+            block_size = min(self.block_size, end - self.position)
+            self.rate_limiter.consume(block_size)
+            self.position += block_size
+        return self.data[start:end]
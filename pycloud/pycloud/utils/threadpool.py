@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+#
+
+import Queue
+import sys
+import threading
+
+
+################################################################################################################
+# Exception raised when a task can't be queued since the queue of the pool is full.
+################################################################################################################
+class ThreadPoolFullException(Exception):
+    def __init__(self, message):
+        super(ThreadPoolFullException, self).__init__(message)
+        self.message = message
+
+
+################################################################################################################
+# Result of an operation that may not have finished yet. Threads can wait on it until a result or an exception
+# is set.
+################################################################################################################
+class Future(object):
+
+    ################################################################################################################
+    # Constructor.
+    ################################################################################################################
+    def __init__(self):
+        self._done_event = threading.Event()
+        self._result = None
+        self._exc_info = None
+
+    ################################################################################################################
+    # Sets the result, waking up any waiting threads.
+    ################################################################################################################
+    def set_result(self, result):
+        self._result = result
+        self._done_event.set()
+
+    ################################################################################################################
+    # Sets an exception as the result, waking up any waiting threads. Should be called from inside an except block.
+    ################################################################################################################
+    def set_exception(self, exc_info=None):
+        self._exc_info = exc_info or sys.exc_info()
+        self._done_event.set()
+
+    ################################################################################################################
+    # Returns True if a result or exception has been set.
+    ################################################################################################################
+    def done(self):
+        return self._done_event.is_set()
+
+    ################################################################################################################
+    # Waits for the result and returns it, or raises the exception that was set. Returns None if timeout runs out.
+    ################################################################################################################
+    def result(self, timeout=None):
+        if not self._done_event.wait(timeout):
+            return None
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+
+################################################################################################################
+# Simple pool of worker threads that execute functions from a bounded queue.
+################################################################################################################
+class ThreadPool(object):
+
+    ################################################################################################################
+    # Constructor. A max_queue_size of 0 means the queue is not bounded.
+    ################################################################################################################
+    def __init__(self, num_workers, max_queue_size=0, name='pool'):
+        self.name = name
+        self.queue = Queue.Queue(max_queue_size)
+        self.workers = []
+        for i in range(num_workers):
+            worker = threading.Thread(target=self._work, name='{}-{}'.format(name, i))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    ################################################################################################################
+    # Queues a function to be executed by a worker, and returns a Future with its result. Raises an exception if
+    # the queue is full.
+    ################################################################################################################
+    def submit(self, function, *args, **kwargs):
+        future = Future()
+        try:
+            self.queue.put_nowait((future, function, args, kwargs))
+        except Queue.Full:
+            raise ThreadPoolFullException('Queue of pool {} is full.'.format(self.name))
+        return future
+
+    ################################################################################################################
+    # Returns the amount of tasks waiting for a free worker.
+    ################################################################################################################
+    def pending(self):
+        return self.queue.qsize()
+
+    ################################################################################################################
+    # Main loop of the worker threads.
+    ################################################################################################################
+    def _work(self):
+        while True:
+            future, function, args, kwargs = self.queue.get()
+            try:
+                future.set_result(function(*args, **kwargs))
+            except:
+                future.set_exception()
+            finally:
+                self.queue.task_done()
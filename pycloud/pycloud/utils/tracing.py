@@ -0,0 +1,357 @@
+# KVM-based Discoverable Cloudlet (KD-Cloudlet) 
+# Copyright (c) 2015 Carnegie Mellon University.
+# All Rights Reserved.
+# 
+# THIS SOFTWARE IS PROVIDED "AS IS," WITH NO WARRANTIES WHATSOEVER. CARNEGIE MELLON UNIVERSITY EXPRESSLY DISCLAIMS TO THE FULLEST EXTENT PERMITTEDBY LAW ALL EXPRESS, IMPLIED, AND STATUTORY WARRANTIES, INCLUDING, WITHOUT LIMITATION, THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, AND NON-INFRINGEMENT OF PROPRIETARY RIGHTS.
+# 
+# Released under a modified BSD license, please see license.txt for full terms.
+# DM-0002138
+# 
+# KD-Cloudlet includes and/or makes use of the following Third-Party Software subject to their own licenses:
+# MiniMongo
+# Copyright (c) 2010-2014, Steve Lacy 
+# All rights reserved. Released under BSD license.
+# https://github.com/MiniMongo/minimongo/blob/master/LICENSE
+# 
+# Bootstrap
+# Copyright (c) 2011-2015 Twitter, Inc.
+# Released under the MIT License
+# https://github.com/twbs/bootstrap/blob/master/LICENSE
+# 
+# jQuery JavaScript Library v1.11.0
+# http://jquery.com/
+# Includes Sizzle.js
+# http://sizzlejs.com/
+# Copyright 2005, 2014 jQuery Foundation, Inc. and other contributors
+# Released under the MIT license
+# http://jquery.org/license
+
+#!/usr/bin/env python
+#
+
+import collections
+import json
+import logging
+import logging.handlers
+import Queue
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from uuid import uuid4
+
+# Where sampled traces can be written to.
+DESTINATION_FILE = 'file'
+DESTINATION_MONGO = 'mongo'
+
+# Name of the capped collection traces are written to when stored in Mongo.
+TRACES_COLLECTION = 'traces'
+
+# Amount of recent durations kept per span to calculate percentiles.
+MAX_SAMPLES_PER_SPAN = 1000
+
+# Max amount of finished traces waiting to be written; more are dropped instead of blocking requests.
+MAX_PENDING_TRACES = 1000
+
+# Percentiles returned for each span.
+PERCENTILES = [50, 90, 99]
+
+# Span currently active in each thread.
+_context = threading.local()
+
+# Singleton tracer used by the app.
+_g_singletonTracer = None
+_g_singletonLock = threading.Lock()
+
+
+################################################################################################################
+# Creates the Tracer singleton, or gets an instance of it if it had been already created.
+################################################################################################################
+def get_tracer():
+    global _g_singletonTracer
+    with _g_singletonLock:
+        if not _g_singletonTracer:
+            from pycloud.pycloud.cloudlet import get_cloudlet_instance
+            cloudlet = get_cloudlet_instance()
+            _g_singletonTracer = Tracer(cloudlet.tracing_sample_rate, cloudlet.tracing_destination,
+                                        cloudlet.tracing_max_size * 1024 * 1024, file_path=cloudlet.tracing_file,
+                                        db=cloudlet.db)
+
+    return _g_singletonTracer
+
+
+################################################################################################################
+# Returns the span active in the current thread, or None if there is none.
+################################################################################################################
+def current_span():
+    return getattr(_context, 'span', None)
+
+
+################################################################################################################
+# Makes the given span the active one in the current thread while in the with block. Used to continue a trace in
+# another thread.
+################################################################################################################
+@contextmanager
+def activate(span):
+    previous_span = current_span()
+    _context.span = span
+    try:
+        yield span
+    finally:
+        _context.span = previous_span
+
+
+################################################################################################################
+# Measures the with block as a child of the active span, if it belongs to a sampled trace. Otherwise it does nothing,
+# so it can be used anywhere, even outside of requests.
+################################################################################################################
+@contextmanager
+def span(name, **tags):
+    parent = current_span()
+    if parent is None or not parent.trace.sampled:
+        yield None
+        return
+
+    child = parent.trace.new_span(name, parent, tags)
+    with activate(child):
+        try:
+            yield child
+        except:
+            child.finish(error=str(sys.exc_info()[1]))
+            raise
+        child.finish()
+
+
+################################################################################################################
+# A timed operation inside a trace.
+################################################################################################################
+class Span(object):
+
+    ################################################################################################################
+    # Constructor.
+    ################################################################################################################
+    def __init__(self, trace, span_id, name, parent_id, tags):
+        self.trace = trace
+        self.span_id = span_id
+        self.name = name
+        self.parent_id = parent_id
+        self.tags = tags
+        self.start_time = time.time()
+        self.end_time = None
+        self.error = None
+
+    ################################################################################################################
+    # Marks the span as finished.
+    ################################################################################################################
+    def finish(self, error=None):
+        self.end_time = time.time()
+        self.error = error
+
+    ################################################################################################################
+    # Returns the time the span took, or has taken so far.
+    ################################################################################################################
+    def get_duration(self):
+        return (self.end_time or time.time()) - self.start_time
+
+    ################################################################################################################
+    # Returns a dict to be stored, with times relative to the start of the trace.
+    ################################################################################################################
+    def to_dict(self):
+        span_dict = {'id': self.span_id, 'name': self.name, 'parent': self.parent_id,
+                     'start': self.start_time - self.trace.root.start_time, 'duration': self.get_duration()}
+        if self.tags:
+            span_dict['tags'] = self.tags
+        if self.error:
+            span_dict['error'] = self.error
+        return span_dict
+
+
+################################################################################################################
+# The spans of one request or background job. Spans can be added from several threads.
+################################################################################################################
+class Trace(object):
+
+    ################################################################################################################
+    # Constructor. Creates the root span.
+    ################################################################################################################
+    def __init__(self, name, sampled, tags):
+        self.trace_id = uuid4().hex
+        self.sampled = sampled
+        self.lock = threading.Lock()
+        self.spans = []
+        self.root = None
+        self.root = self.new_span(name, None, tags)
+
+    ################################################################################################################
+    # Creates a new span under the given parent.
+    ################################################################################################################
+    def new_span(self, name, parent, tags):
+        with self.lock:
+            new_span = Span(self, len(self.spans), name, parent.span_id if parent else None, tags)
+            self.spans.append(new_span)
+        return new_span
+
+    ################################################################################################################
+    # Returns a dict to be stored.
+    ################################################################################################################
+    def to_dict(self):
+        with self.lock:
+            spans = list(self.spans)
+        return {'trace_id': self.trace_id, 'name': self.root.name, 'timestamp': self.root.start_time,
+                'duration': self.root.get_duration(), 'spans': [trace_span.to_dict() for trace_span in spans]}
+
+
+################################################################################################################
+# Creates sampled traces and writes them in a background thread, to a rotating file or a capped Mongo collection.
+# Also keeps the recent durations of each span, by trace name, to calculate latency percentiles.
+################################################################################################################
+class Tracer(object):
+
+    ################################################################################################################
+    # Constructor.
+    # - sample_rate: fraction of traces that are recorded, from 0 to 1.
+    # - max_size: max bytes used by stored traces: size of each file before rotating it, or of the capped collection.
+    ################################################################################################################
+    def __init__(self, sample_rate, destination, max_size, file_path=None, db=None):
+        self.sample_rate = sample_rate
+        self.destination = destination
+        self.max_size = max_size
+        self.file_path = file_path
+        self.db = db
+        self.pending = Queue.Queue(MAX_PENDING_TRACES)
+        self.writer_thread = None
+        self.writer_lock = threading.Lock()
+        self.samples_lock = threading.Lock()
+        self.samples = {}
+        self.dropped = 0
+
+    ################################################################################################################
+    # Starts a new trace with its root span active in this thread while in the with block. Whether it is recorded is
+    # decided here, depending on the sample rate.
+    ################################################################################################################
+    @contextmanager
+    def trace(self, name, **tags):
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        new_trace = Trace(name, sampled, tags)
+        with activate(new_trace.root):
+            try:
+                yield new_trace
+            except:
+                new_trace.root.finish(error=str(sys.exc_info()[1]))
+                self._submit(new_trace)
+                raise
+            new_trace.root.finish()
+            self._submit(new_trace)
+
+    ################################################################################################################
+    # Returns latency percentiles, in seconds, of each span by trace name. Only traces with the given name are
+    # included if one is given.
+    ################################################################################################################
+    def get_percentiles(self, trace_name=None):
+        with self.samples_lock:
+            samples = dict((key, list(durations)) for key, durations in self.samples.iteritems()
+                           if trace_name is None or key[0] == trace_name)
+
+        percentiles = {}
+        for (current_trace_name, span_name), durations in samples.iteritems():
+            durations.sort()
+            span_percentiles = {'count': len(durations), 'max': durations[-1]}
+            for percentile in PERCENTILES:
+                span_percentiles['p' + str(percentile)] = durations[int(round((len(durations) - 1) * percentile / 100.0))]
+            percentiles.setdefault(current_trace_name, {})[span_name] = span_percentiles
+        return {'sample_rate': self.sample_rate, 'dropped': self.dropped, 'traces': percentiles}
+
+    ################################################################################################################
+    # Queues a finished trace to be written, if it was sampled.
+    ################################################################################################################
+    def _submit(self, finished_trace):
+        if not finished_trace.sampled:
+            return
+
+        self._start_writer()
+        try:
+            self.pending.put_nowait(finished_trace)
+        except Queue.Full:
+            self.dropped += 1
+
+    ################################################################################################################
+    # Starts the writer thread, if it was not started already.
+    ################################################################################################################
+    def _start_writer(self):
+        with self.writer_lock:
+            if self.writer_thread is not None:
+                return
+            self.writer_thread = threading.Thread(target=self._write_loop, name='trace-writer')
+            self.writer_thread.daemon = True
+            self.writer_thread.start()
+
+    ################################################################################################################
+    # Main loop of the writer thread.
+    ################################################################################################################
+    def _write_loop(self):
+        write = self._get_writer()
+        while True:
+            finished_trace = self.pending.get()
+            try:
+                trace_dict = finished_trace.to_dict()
+                self._add_samples(trace_dict)
+                write(trace_dict)
+            except Exception as e:
+                print 'Error writing trace: ' + str(e)
+
+    ################################################################################################################
+    # Returns a function that stores a trace dict in the configured destination.
+    ################################################################################################################
+    def _get_writer(self):
+        if self.destination == DESTINATION_MONGO:
+            from pymongo.errors import CollectionInvalid
+            try:
+                self.db.create_collection(TRACES_COLLECTION, capped=True, size=self.max_size)
+            except CollectionInvalid:
+                # Already created by another app or a previous run.
+                pass
+            collection = self.db[TRACES_COLLECTION]
+            return lambda trace_dict: collection.insert(trace_dict)
+
+        trace_logger = logging.getLogger('pycloud.traces')
+        trace_logger.propagate = False
+        trace_logger.setLevel(logging.INFO)
+        handler = logging.handlers.RotatingFileHandler(self.file_path, maxBytes=self.max_size, backupCount=1)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        trace_logger.addHandler(handler)
+        return lambda trace_dict: trace_logger.info(json.dumps(trace_dict))
+
+    ################################################################################################################
+    # Adds the durations of the spans of a trace to the samples used for percentiles.
+    ################################################################################################################
+    def _add_samples(self, trace_dict):
+        with self.samples_lock:
+            for trace_span in trace_dict['spans']:
+                key = (trace_dict['name'], trace_span['name'])
+                if key not in self.samples:
+                    self.samples[key] = collections.deque(maxlen=MAX_SAMPLES_PER_SPAN)
+                self.samples[key].append(trace_span['duration'])
+
+
+################################################################################################################
+# Command line test: a few traces with nested spans, some of them in other threads.
+################################################################################################################
+if __name__ == '__main__':
+    test_tracer = Tracer(1.0, DESTINATION_FILE, 1024 * 1024, file_path='testtraces.log')
+    for i in range(5):
+        with test_tracer.trace('test'):
+            with span('first'):
+                time.sleep(0.01 * i)
+            parent_span = current_span()
+
+            def run_in_thread():
+                with activate(parent_span):
+                    with span('second'):
+                        time.sleep(0.02)
+            thread = threading.Thread(target=run_in_thread)
+            thread.start()
+            thread.join()
+
+    time.sleep(0.5)
+    print json.dumps(test_tracer.get_percentiles(), indent=2)
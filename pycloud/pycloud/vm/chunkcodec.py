@@ -0,0 +1,423 @@
+# KVM-based Discoverable Cloudlet (KD-Cloudlet) 
+# Copyright (c) 2015 Carnegie Mellon University.
+# All Rights Reserved.
+# 
+# THIS SOFTWARE IS PROVIDED "AS IS," WITH NO WARRANTIES WHATSOEVER. CARNEGIE MELLON UNIVERSITY EXPRESSLY DISCLAIMS TO THE FULLEST EXTENT PERMITTEDBY LAW ALL EXPRESS, IMPLIED, AND STATUTORY WARRANTIES, INCLUDING, WITHOUT LIMITATION, THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, AND NON-INFRINGEMENT OF PROPRIETARY RIGHTS.
+# 
+# Released under a modified BSD license, please see license.txt for full terms.
+# DM-0002138
+# 
+# KD-Cloudlet includes and/or makes use of the following Third-Party Software subject to their own licenses:
+# MiniMongo
+# Copyright (c) 2010-2014, Steve Lacy 
+# All rights reserved. Released under BSD license.
+# https://github.com/MiniMongo/minimongo/blob/master/LICENSE
+# 
+# Bootstrap
+# Copyright (c) 2011-2015 Twitter, Inc.
+# Released under the MIT License
+# https://github.com/twbs/bootstrap/blob/master/LICENSE
+# 
+# jQuery JavaScript Library v1.11.0
+# http://jquery.com/
+# Includes Sizzle.js
+# http://sizzlejs.com/
+# Copyright 2005, 2014 jQuery Foundation, Inc. and other contributors
+# Released under the MIT license
+# http://jquery.org/license
+
+
+import collections
+import struct
+import threading
+import time
+import zlib
+
+# LZMA is only available in Python 2 through an optional backport; without it, only zlib levels are used.
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+# Encodings of the data of a chunk on the wire. Chunks with only zeros, such as unused qcow2 clusters, are sent as a
+# marker with no data, and uncompressed chunks with some zero pages as runs of zero and data pages (see encode_pages).
+ENCODING_RAW = 'raw'
+ENCODING_ZERO = 'zero'
+ENCODING_PAGES = 'pages'
+
+# Size of the pages checked for zeros in uncompressed chunks.
+PAGE_SIZE = 4096
+
+# Header of each run of an uncompressed chunk: amount of zero pages, and amount of data pages whose data follows it.
+RUN_HEADER = struct.Struct('!II')
+
+# Compression levels, as the functions that compress and decompress with each one, from the cheapest to the one that
+# compresses most.
+_COMPRESSORS = collections.OrderedDict()
+_COMPRESSORS['zlib-1'] = (lambda data: zlib.compress(data, 1), zlib.decompress)
+_COMPRESSORS['zlib-6'] = (lambda data: zlib.compress(data, 6), zlib.decompress)
+if lzma is not None:
+    _COMPRESSORS['lzma-1'] = (lambda data: lzma.compress(data, preset=1), lzma.decompress)
+    _COMPRESSORS['lzma-6'] = (lambda data: lzma.compress(data, preset=6), lzma.decompress)
+
+# Non-zero chunks encoded with every level when a transfer starts, to measure their cost, and how often a chunk is
+# measured again after that, since the data and the load of the CPU change as the transfer runs.
+PROBE_CHUNKS = 8
+PROBE_INTERVAL = 64
+
+# Weight of new measurements in the moving averages of the cost of each level and of the link throughput.
+SMOOTHING = 0.3
+
+# Transfers smaller than this are not used to measure the link, as their time is mostly the latency of the request.
+MIN_MEASURED_BYTES = 64 * 1024
+
+# Strings of zeros, by length, to compare data with.
+_zero_strings = {}
+
+
+################################################################################################################
+# Exception type used in this module.
+################################################################################################################
+class ChunkCodecException(Exception):
+    def __init__(self, message):
+        super(ChunkCodecException, self).__init__(message)
+        self.message = message
+
+
+################################################################################################################
+# Returns the encodings that can be decoded here, to be told to senders.
+################################################################################################################
+def get_supported_encodings():
+    return [ENCODING_RAW, ENCODING_ZERO, ENCODING_PAGES] + _COMPRESSORS.keys()
+
+
+################################################################################################################
+# Returns True if the data only has zeros.
+################################################################################################################
+def is_zero(data):
+    zeros = _zero_strings.get(len(data))
+    if zeros is None:
+        zeros = '\0' * len(data)
+        _zero_strings[len(data)] = zeros
+    return data == zeros
+
+
+################################################################################################################
+# Encodes data as runs of zero pages, sent only as their amount, and data pages, sent as they are.
+################################################################################################################
+def encode_pages(data):
+    pages = [data[start:start + PAGE_SIZE] for start in range(0, len(data), PAGE_SIZE)]
+    zero_flags = [is_zero(page) for page in pages]
+
+    parts = []
+    index = 0
+    while index < len(pages):
+        zero_start = index
+        while index < len(pages) and zero_flags[index]:
+            index += 1
+        data_start = index
+        while index < len(pages) and not zero_flags[index]:
+            index += 1
+        parts.append(RUN_HEADER.pack(data_start - zero_start, index - data_start))
+        parts.extend(pages[data_start:index])
+    return ''.join(parts)
+
+
+################################################################################################################
+# Decodes data encoded with encode_pages, given its original length.
+################################################################################################################
+def decode_pages(payload, length):
+    parts = []
+    position = 0
+    decoded_length = 0
+    while decoded_length < length:
+        if position + RUN_HEADER.size > len(payload):
+            raise ChunkCodecException('Runs of pages end before the data is complete')
+        zero_pages, data_pages = RUN_HEADER.unpack_from(payload, position)
+        position += RUN_HEADER.size
+        if zero_pages == 0 and data_pages == 0:
+            raise ChunkCodecException('Empty run of pages')
+
+        zero_length = min(zero_pages * PAGE_SIZE, length - decoded_length)
+        parts.append('\0' * zero_length)
+        decoded_length += zero_length
+
+        data_length = min(data_pages * PAGE_SIZE, length - decoded_length)
+        parts.append(payload[position:position + data_length])
+        position += data_length
+        decoded_length += data_length
+    return ''.join(parts)
+
+
+################################################################################################################
+# Encodes data with the given encoding.
+################################################################################################################
+def encode(encoding, data):
+    if encoding == ENCODING_RAW:
+        return data
+    elif encoding == ENCODING_ZERO:
+        return ''
+    elif encoding == ENCODING_PAGES:
+        return encode_pages(data)
+    elif encoding in _COMPRESSORS:
+        return _COMPRESSORS[encoding][0](data)
+    raise ChunkCodecException('Unknown encoding {}'.format(encoding))
+
+
+################################################################################################################
+# Decodes data sent with the given encoding, checking that it has the original length.
+################################################################################################################
+def decode(encoding, payload, length):
+    if encoding == ENCODING_RAW:
+        data = payload
+    elif encoding == ENCODING_ZERO:
+        data = '\0' * length
+    elif encoding == ENCODING_PAGES:
+        data = decode_pages(payload, length)
+    elif encoding in _COMPRESSORS:
+        try:
+            data = _COMPRESSORS[encoding][1](payload)
+        except Exception as e:
+            raise ChunkCodecException('Data could not be decompressed with {}: {}'.format(encoding, str(e)))
+    else:
+        raise ChunkCodecException('Unknown encoding {}'.format(encoding))
+
+    if len(data) != length:
+        raise ChunkCodecException('Decoded data has {} bytes instead of {}'.format(len(data), length))
+    return data
+
+
+################################################################################################################
+# Encodes the chunks of a transfer, choosing the compression level that sends them fastest. Each level is measured on
+# the first chunks, and again every now and then: how much it compresses them and how much CPU time that takes. With
+# the throughput of the link, measured from the transfers reported with record_transfer, the level that takes the
+# least time per byte, compressing plus sending, is used. Zero chunks and zero pages are always sent as markers. Chunks
+# can be encoded by several threads at once, each one sending its own stream.
+################################################################################################################
+class AdaptiveEncoder(object):
+
+    ################################################################################################################
+    # Constructor.
+    ################################################################################################################
+    def __init__(self, encodings=None):
+        self.ratios = {}
+        self.cpu_costs = {}
+        self.link_throughput = None
+        self.data_chunks = 0
+
+        self.chunk_counts = collections.Counter()
+        self.bytes_original = 0
+        self.bytes_sent = 0
+        self.busy_seconds = 0.0
+        self.busy_until = 0.0
+        self.lock = threading.Lock()
+
+        self.encodings = set()
+        self.levels = []
+        self.current_level = ENCODING_RAW
+        self._set_encodings(encodings if encodings is not None else get_supported_encodings())
+
+    ################################################################################################################
+    # Limits the encodings used to the ones the receiver can decode. Raw data is always allowed.
+    ################################################################################################################
+    def set_encodings(self, encodings):
+        with self.lock:
+            self._set_encodings(encodings)
+
+    ################################################################################################################
+    # Encodes the data of a chunk. Returns the encoding used and the encoded data.
+    ################################################################################################################
+    def encode(self, data):
+        if ENCODING_ZERO in self.encodings and is_zero(data):
+            encoding, payload = ENCODING_ZERO, ''
+        else:
+            with self.lock:
+                probe = len(self.levels) > 1 and (self.data_chunks < PROBE_CHUNKS or
+                                                  self.data_chunks % PROBE_INTERVAL == 0)
+                level = self.current_level
+                self.data_chunks += 1
+            if probe:
+                encoding, payload = self._probe(data)
+            else:
+                encoding, payload = self._encode(level, data)
+
+        with self.lock:
+            self.chunk_counts[encoding] += 1
+        return encoding, payload
+
+    ################################################################################################################
+    # Records that original_bytes of chunk data were sent as wire_bytes in the given time, to measure the link.
+    # start_time is when encoding the chunks started; the time spent encoding and sending, counted once when streams
+    # overlap, gives the effective bandwidth.
+    ################################################################################################################
+    def record_transfer(self, original_bytes, wire_bytes, seconds, start_time=None):
+        end_time = time.time()
+        if start_time is None:
+            start_time = end_time - seconds
+
+        with self.lock:
+            self.bytes_original += original_bytes
+            self.bytes_sent += wire_bytes
+            self.busy_seconds += max(0.0, end_time - max(start_time, self.busy_until))
+            self.busy_until = max(self.busy_until, end_time)
+            if wire_bytes < MIN_MEASURED_BYTES or seconds <= 0:
+                return
+
+            throughput = wire_bytes / seconds
+            if self.link_throughput is None:
+                self.link_throughput = throughput
+            else:
+                self.link_throughput = SMOOTHING * throughput + (1 - SMOOTHING) * self.link_throughput
+            self._choose_level()
+
+    ################################################################################################################
+    # Returns what was achieved so far: the compression ratio (original bytes per byte sent) and the effective bandwidth
+    # (original bytes per second, including the time spent compressing).
+    ################################################################################################################
+    def get_stats(self):
+        with self.lock:
+            return {'bytes_original': self.bytes_original,
+                    'bytes_sent': self.bytes_sent,
+                    'compression_ratio': float(self.bytes_original) / self.bytes_sent if self.bytes_sent else 1.0,
+                    'effective_bandwidth': self.bytes_original / self.busy_seconds if self.busy_seconds else 0.0,
+                    'link_throughput': self.link_throughput,
+                    'compression_level': self.current_level,
+                    'chunks': dict(self.chunk_counts)}
+
+    ################################################################################################################
+    # Limits the encodings used; see set_encodings.
+    ################################################################################################################
+    def _set_encodings(self, encodings):
+        self.encodings = set(encodings) | set([ENCODING_RAW])
+        self.levels = [ENCODING_RAW] + [level for level in _COMPRESSORS if level in self.encodings]
+        if self.current_level not in self.levels or self.link_throughput is None:
+            # Until the link is measured, use the cheapest compression level, which does not slow down fast links much.
+            self.current_level = self.levels[min(1, len(self.levels) - 1)]
+
+    ################################################################################################################
+    # Encodes data with every level, to measure them, and returns the result of the best one.
+    ################################################################################################################
+    def _probe(self, data):
+        results = dict((level, self._encode(level, data)) for level in self.levels)
+        with self.lock:
+            self._choose_level()
+            return results[self.current_level]
+
+    ################################################################################################################
+    # Encodes data with a level, measuring it. Uncompressed data is sent as runs of pages if it has zero pages, and
+    # data that does not get smaller when compressed is sent uncompressed.
+    ################################################################################################################
+    def _encode(self, level, data):
+        start_time = time.time()
+        if level == ENCODING_RAW:
+            encoding = ENCODING_PAGES if ENCODING_PAGES in self.encodings else ENCODING_RAW
+            payload = encode(encoding, data)
+            if len(payload) >= len(data):
+                encoding, payload = ENCODING_RAW, data
+        else:
+            encoding, payload = level, encode(level, data)
+        with self.lock:
+            self._measure(level, float(len(payload)) / len(data), (time.time() - start_time) / len(data))
+
+        if len(payload) >= len(data):
+            return ENCODING_RAW, data
+        return encoding, payload
+
+    ################################################################################################################
+    # Adds a measurement of the size of the encoded data relative to the original, and of the CPU time per byte, of a
+    # level.
+    ################################################################################################################
+    def _measure(self, level, ratio, cpu_cost):
+        if level not in self.ratios:
+            self.ratios[level] = ratio
+            self.cpu_costs[level] = cpu_cost
+        else:
+            self.ratios[level] = SMOOTHING * ratio + (1 - SMOOTHING) * self.ratios[level]
+            self.cpu_costs[level] = SMOOTHING * cpu_cost + (1 - SMOOTHING) * self.cpu_costs[level]
+
+    ################################################################################################################
+    # Uses the level that takes the least time per original byte, once the link has been measured.
+    ################################################################################################################
+    def _choose_level(self):
+        measured_levels = [level for level in self.levels if level in self.ratios]
+        if self.link_throughput is None or not measured_levels:
+            return
+        self.current_level = min(measured_levels, key=lambda level: self.cpu_costs[level] +
+                                 self.ratios[level] / self.link_throughput)
+
+
+################################################################################################################
+# Functions to test the class.
+################################################################################################################
+def get_args():
+    import argparse
+    parser = argparse.ArgumentParser(description='Sends a simulated disk image through a simulated link with the '
+                                                 'adaptive encoder, and shows the levels chosen.')
+    parser.add_argument('-s', '--size', type=int, default=64, help='size of the image, in MB')
+    parser.add_argument('-b', '--bandwidth', type=float, default=2, help='simulated network bandwidth, in MB/s')
+    parser.add_argument('-z', '--zeros', type=float, default=0.3, help='fraction of clusters that are all zeros')
+    parser.add_argument('-r', '--random', type=float, default=0.3,
+                        help='fraction of clusters with random (incompressible) data')
+    return parser.parse_args()
+
+
+################################################################################################################
+# Encodes a simulated image made of zero, random and text-like clusters, some of them with zero pages, and checks that
+# every chunk is decoded back.
+################################################################################################################
+def test_adaptive_encoder():
+    import os
+    import random
+
+    args = get_args()
+    cluster_size = 64 * 1024
+    batch_size = 128
+    words = ['cloudlet', 'service', 'migration', 'qemu', 'kernel', 'buffer', 'page', 'disk', '\n', ' ', '0x1f']
+
+    def make_cluster():
+        kind = random.random()
+        if kind < args.zeros:
+            return '\0' * cluster_size
+        if kind < args.zeros + args.random:
+            data = os.urandom(cluster_size)
+        else:
+            data = ''.join(random.choice(words) for _ in range(cluster_size / 4))[:cluster_size]
+        # Half of the clusters with data have some zero pages.
+        if random.random() < 0.5:
+            page = random.randrange(cluster_size / PAGE_SIZE) * PAGE_SIZE
+            data = data[:page] + '\0' * PAGE_SIZE * 2 + data[page + PAGE_SIZE * 2:]
+        return data[:cluster_size]
+
+    encoder = AdaptiveEncoder()
+    levels_used = []
+    clusters_left = args.size * 1024 * 1024 / cluster_size
+    while clusters_left > 0:
+        batch = [make_cluster() for _ in range(min(batch_size, clusters_left))]
+        clusters_left -= len(batch)
+
+        start_time = time.time()
+        encoded_chunks = [encoder.encode(data) for data in batch]
+        wire_bytes = sum(len(payload) for encoding, payload in encoded_chunks)
+        transfer_time = wire_bytes / (args.bandwidth * 1024 * 1024)
+        time.sleep(transfer_time)
+        for data, (encoding, payload) in zip(batch, encoded_chunks):
+            if decode(encoding, payload, len(data)) != data:
+                raise ChunkCodecException('Chunk encoded with {} was not decoded back'.format(encoding))
+        encoder.record_transfer(sum(len(data) for data in batch), wire_bytes, transfer_time, start_time)
+        levels_used.append(encoder.current_level)
+
+    stats = encoder.get_stats()
+    print 'Levels available: {}'.format(', '.join(encoder.levels))
+    print 'Level after each batch: {}'.format(', '.join(levels_used))
+    print 'Chunks per encoding: {}'.format(stats['chunks'])
+    print 'Bytes sent: {} of {}, compression ratio {:.2f}'.format(stats['bytes_sent'], stats['bytes_original'],
+                                                                  stats['compression_ratio'])
+    print 'Effective bandwidth: {:.2f} MB/s, link: {:.2f} MB/s'.format(stats['effective_bandwidth'] / 1024 / 1024,
+                                                                       args.bandwidth)
+
+
+if __name__ == '__main__':
+    test_adaptive_encoder()
@@ -0,0 +1,270 @@
+# KVM-based Discoverable Cloudlet (KD-Cloudlet) 
+# Copyright (c) 2015 Carnegie Mellon University.
+# All Rights Reserved.
+# 
+# THIS SOFTWARE IS PROVIDED "AS IS," WITH NO WARRANTIES WHATSOEVER. CARNEGIE MELLON UNIVERSITY EXPRESSLY DISCLAIMS TO THE FULLEST EXTENT PERMITTEDBY LAW ALL EXPRESS, IMPLIED, AND STATUTORY WARRANTIES, INCLUDING, WITHOUT LIMITATION, THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, AND NON-INFRINGEMENT OF PROPRIETARY RIGHTS.
+# 
+# Released under a modified BSD license, please see license.txt for full terms.
+# DM-0002138
+# 
+# KD-Cloudlet includes and/or makes use of the following Third-Party Software subject to their own licenses:
+# MiniMongo
+# Copyright (c) 2010-2014, Steve Lacy 
+# All rights reserved. Released under BSD license.
+# https://github.com/MiniMongo/minimongo/blob/master/LICENSE
+# 
+# Bootstrap
+# Copyright (c) 2011-2015 Twitter, Inc.
+# Released under the MIT License
+# https://github.com/twbs/bootstrap/blob/master/LICENSE
+# 
+# jQuery JavaScript Library v1.11.0
+# http://jquery.com/
+# Includes Sizzle.js
+# http://sizzlejs.com/
+# Copyright 2005, 2014 jQuery Foundation, Inc. and other contributors
+# Released under the MIT license
+# http://jquery.org/license
+
+
+import collections
+import hashlib
+import os
+import threading
+
+from diskprecopy import DEFAULT_CHUNK_SIZE, Chunk, DiskPreCopyException, BatchStreams, MAX_BATCH_SIZE, \
+    read_chunk_data
+
+# Manifests already calculated, by file path, size, modification time and chunk size.
+_manifest_cache = {}
+_manifest_cache_lock = threading.Lock()
+
+
+################################################################################################################
+# Returns the manifest of a file: the checksum (MD5 hex digest) of each of its chunks, in order. Manifests are cached
+# until the file changes, since base images are read completely to calculate them.
+################################################################################################################
+def get_manifest(file_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    file_stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), file_stat.st_size, file_stat.st_mtime, chunk_size)
+    with _manifest_cache_lock:
+        if key in _manifest_cache:
+            return _manifest_cache[key]
+
+    manifest = []
+    with open(file_path, 'rb') as image_file:
+        while True:
+            data = image_file.read(chunk_size)
+            if not data:
+                break
+            manifest.append(hashlib.md5(data).hexdigest())
+
+    with _manifest_cache_lock:
+        _manifest_cache[key] = manifest
+    return manifest
+
+
+################################################################################################################
+# Returns an identity for the contents of a file, cheap to compare between cloudlets once its manifest is known.
+################################################################################################################
+def get_fingerprint(manifest):
+    return hashlib.md5(''.join(manifest)).hexdigest()
+
+
+################################################################################################################
+# Returns the description of each chunk sent along with their data: checksum and length, plus the encoding and length
+# of the data sent if the chunks were encoded (see chunkcodec).
+################################################################################################################
+def describe_missing_chunks(chunks, encoded_chunks=None):
+    descriptions = [[chunk.checksum, len(chunk.data)] for chunk in chunks]
+    if encoded_chunks is not None:
+        for description, (encoding, payload) in zip(descriptions, encoded_chunks):
+            description.extend([encoding, len(payload)])
+    return descriptions
+
+
+################################################################################################################
+# Sends the chunks of a file whose checksums are in missing_checksums, each one only once even if it appears in several
+# places, in batches sent with BatchStreams over up to max_streams workers of the given pool. Returns the amount of
+# bytes sent.
+################################################################################################################
+def send_missing_chunks(file_path, manifest, missing_checksums, send_chunks, get_pending_chunks,
+                        chunk_size=DEFAULT_CHUNK_SIZE, max_batch_size=MAX_BATCH_SIZE, pool=None, max_streams=1):
+    streams = BatchStreams(send_chunks, get_pending_chunks, pool, max_streams)
+    pending_checksums = set(missing_checksums)
+    batch = []
+    batch_size = 0
+    bytes_sent = 0
+    with open(file_path, 'rb') as image_file:
+        for number, checksum in enumerate(manifest):
+            if checksum not in pending_checksums:
+                continue
+            pending_checksums.remove(checksum)
+
+            offset = number * chunk_size
+            image_file.seek(offset)
+            data = image_file.read(chunk_size)
+            batch.append(Chunk(number, offset, data, checksum))
+            batch_size += len(data)
+            if batch_size >= max_batch_size:
+                streams.send(batch)
+                bytes_sent += batch_size
+                batch = []
+                batch_size = 0
+
+    if batch:
+        streams.send(batch)
+        bytes_sent += batch_size
+    streams.wait()
+    return bytes_sent
+
+
+################################################################################################################
+# Rebuilds a copy of a file from its manifest, taking every chunk that can be found in local files from them, so that
+# only the rest has to be received. Chunks are content-addressed: received data is identified by its checksum, and is
+# written everywhere the manifest has that checksum. The file is created with its final size, so batches can be
+# received at the same time, each one writing in place through its own file object.
+################################################################################################################
+class ManifestReceiver(object):
+
+    ################################################################################################################
+    # Constructor. Creates the file and fills it with the chunks found in local_files.
+    ################################################################################################################
+    def __init__(self, file_path, manifest, file_size, local_files, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self.chunks_received = 0
+        self.bytes_received = 0
+        self.bytes_reused = 0
+        self.lock = threading.Lock()
+
+        self.offsets = collections.defaultdict(list)
+        for number, checksum in enumerate(manifest):
+            self.offsets[checksum].append(number * chunk_size)
+
+        with open(self.file_path, 'wb') as image_file:
+            image_file.truncate(file_size)
+            self.missing = set(self.offsets.keys()) - self._copy_local_chunks(image_file, local_files)
+
+    ################################################################################################################
+    # Writes received chunks (described as by describe_missing_chunks, in the order their data is in data_file) into
+    # the file, verifying their checksums. Chunks no longer missing are skipped.
+    ################################################################################################################
+    def receive(self, chunk_list, data_file):
+        with open(self.file_path, 'r+b') as image_file:
+            for description in chunk_list:
+                checksum, length = description[:2]
+                data = read_chunk_data(data_file, checksum, length, *description[2:],
+                                       decode_data=checksum in self.missing)
+                if data is None:
+                    continue
+                if hashlib.md5(data).hexdigest() != checksum:
+                    raise DiskPreCopyException('Data received does not match checksum {}'.format(checksum))
+
+                self._write_everywhere(image_file, checksum, data)
+                with self.lock:
+                    if checksum in self.missing:
+                        self.missing.remove(checksum)
+                        self.chunks_received += 1
+                        self.bytes_received += length
+
+    ################################################################################################################
+    # Returns the progress of the transfer, including the checksums still missing.
+    ################################################################################################################
+    def get_status(self):
+        with self.lock:
+            return {'missing_chunks': list(self.missing),
+                    'chunks_received': self.chunks_received,
+                    'bytes_received': self.bytes_received,
+                    'bytes_reused': self.bytes_reused}
+
+    ################################################################################################################
+    # Copies all needed chunks that are in the local files. Returns the checksums found.
+    ################################################################################################################
+    def _copy_local_chunks(self, image_file, local_files):
+        found = set()
+        for local_file_path in local_files:
+            local_manifest = get_manifest(local_file_path, self.chunk_size)
+            needed = [(number, checksum) for number, checksum in enumerate(local_manifest)
+                      if checksum in self.offsets and checksum not in found]
+            if not needed:
+                continue
+
+            with open(local_file_path, 'rb') as local_file:
+                for number, checksum in needed:
+                    if checksum in found:
+                        continue
+                    local_file.seek(number * self.chunk_size)
+                    data = local_file.read(self.chunk_size)
+                    if hashlib.md5(data).hexdigest() != checksum:
+                        # The local file changed after its manifest was calculated.
+                        continue
+                    self._write_everywhere(image_file, checksum, data)
+                    found.add(checksum)
+                    self.bytes_reused += len(data) * len(self.offsets[checksum])
+        return found
+
+    ################################################################################################################
+    # Writes the data of a chunk at every offset where the manifest has its checksum.
+    ################################################################################################################
+    def _write_everywhere(self, image_file, checksum, data):
+        for offset in self.offsets[checksum]:
+            image_file.seek(offset)
+            image_file.write(data)
+
+
+################################################################################################################
+# Functions to test the class.
+################################################################################################################
+def get_args():
+    import argparse
+    parser = argparse.ArgumentParser(description='Sends a base image to a receiver that has a similar one, and shows '
+                                                 'how much data had to be sent.')
+    parser.add_argument('-d', '--dir', default='.', help='folder where the test files are created')
+    parser.add_argument('-s', '--size', type=int, default=64, help='size of the base image, in MB')
+    parser.add_argument('-c', '--changed', type=float, default=0.1, help='fraction of blocks that differ')
+    return parser.parse_args()
+
+
+################################################################################################################
+# Rebuilds a base image on a simulated receiver which has a version of it with some blocks changed.
+################################################################################################################
+def test_manifest_transfer():
+    import StringIO
+    import random
+
+    args = get_args()
+    sender_path = os.path.join(args.dir, 'chunkstore_sender.img')
+    local_path = os.path.join(args.dir, 'chunkstore_local.img')
+    receiver_path = os.path.join(args.dir, 'chunkstore_receiver.img')
+    with open(sender_path, 'wb') as sender_file, open(local_path, 'wb') as local_file:
+        for _ in range(args.size * 1024 * 1024 / DEFAULT_CHUNK_SIZE):
+            data = os.urandom(DEFAULT_CHUNK_SIZE)
+            sender_file.write(data)
+            local_file.write(os.urandom(DEFAULT_CHUNK_SIZE) if random.random() < args.changed else data)
+
+    manifest = get_manifest(sender_path)
+    receiver = ManifestReceiver(receiver_path, manifest, os.path.getsize(sender_path), [local_path])
+    missing = receiver.get_status()['missing_chunks']
+
+    def send_chunks(chunks, file_size):
+        data = ''.join(chunk.data for chunk in chunks)
+        receiver.receive(describe_missing_chunks(chunks), StringIO.StringIO(data))
+
+    def get_pending_chunks(chunks):
+        still_missing = set(receiver.get_status()['missing_chunks'])
+        return [chunk for chunk in chunks if chunk.checksum in still_missing]
+
+    bytes_sent = send_missing_chunks(sender_path, manifest, missing, send_chunks, get_pending_chunks)
+    identical = get_fingerprint(get_manifest(receiver_path)) == get_fingerprint(manifest)
+    status = receiver.get_status()
+    for path in [sender_path, local_path, receiver_path]:
+        os.remove(path)
+
+    print 'Image size: {} bytes'.format(args.size * 1024 * 1024)
+    print 'Bytes sent: {}, bytes reused from local image: {}'.format(bytes_sent, status['bytes_reused'])
+    print 'Copy is identical: {}'.format(identical)
+
+
+if __name__ == '__main__':
+    test_manifest_transfer()
@@ -0,0 +1,233 @@
+# KVM-based Discoverable Cloudlet (KD-Cloudlet) 
+# Copyright (c) 2015 Carnegie Mellon University.
+# All Rights Reserved.
+# 
+# THIS SOFTWARE IS PROVIDED "AS IS," WITH NO WARRANTIES WHATSOEVER. CARNEGIE MELLON UNIVERSITY EXPRESSLY DISCLAIMS TO THE FULLEST EXTENT PERMITTEDBY LAW ALL EXPRESS, IMPLIED, AND STATUTORY WARRANTIES, INCLUDING, WITHOUT LIMITATION, THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, AND NON-INFRINGEMENT OF PROPRIETARY RIGHTS.
+# 
+# Released under a modified BSD license, please see license.txt for full terms.
+# DM-0002138
+# 
+# KD-Cloudlet includes and/or makes use of the following Third-Party Software subject to their own licenses:
+# MiniMongo
+# Copyright (c) 2010-2014, Steve Lacy 
+# All rights reserved. Released under BSD license.
+# https://github.com/MiniMongo/minimongo/blob/master/LICENSE
+# 
+# Bootstrap
+# Copyright (c) 2011-2015 Twitter, Inc.
+# Released under the MIT License
+# https://github.com/twbs/bootstrap/blob/master/LICENSE
+# 
+# jQuery JavaScript Library v1.11.0
+# http://jquery.com/
+# Includes Sizzle.js
+# http://sizzlejs.com/
+# Copyright 2005, 2014 jQuery Foundation, Inc. and other contributors
+# Released under the MIT license
+# http://jquery.org/license
+
+
+import collections
+import hashlib
+import os
+import re
+import sys
+import threading
+import time
+from xml.etree.ElementTree import Element
+from xml.sax.saxutils import escape
+
+from virtualmachinedescriptor import VirtualMachineDescriptor
+
+# Max amount of compiled templates kept in memory.
+MAX_CACHED_TEMPLATES = 32
+
+# Marker put in the per-instance values of a template. The disk image one is an absolute path, since
+# VirtualMachineDescriptor.setDiskImage converts paths to absolute ones.
+SLOT_MARKER = '__pycloud_slot_{}__'
+SLOT_REGEX = re.compile(r'/?__pycloud_slot_(\w+?)__')
+
+# Singleton cache used by the app.
+_g_singletonDescriptorTemplateCache = None
+_g_singletonLock = threading.Lock()
+
+
+################################################################################################################
+# Creates the DescriptorTemplateCache singleton, or gets an instance of it if it had been already created.
+################################################################################################################
+def get_descriptor_template_cache():
+    global _g_singletonDescriptorTemplateCache
+    with _g_singletonLock:
+        if not _g_singletonDescriptorTemplateCache:
+            _g_singletonDescriptorTemplateCache = DescriptorTemplateCache()
+
+    return _g_singletonDescriptorTemplateCache
+
+
+################################################################################################################
+# The XML descriptor of a saved state with all transformations that are the same for every instance of a service
+# already applied and serialized, and markers in place of the values that change for each instance (uuid, name,
+# disk image, MAC address and port redirections). Getting an instance descriptor only joins strings.
+################################################################################################################
+class DescriptorTemplate(object):
+
+    ################################################################################################################
+    # Constructor. Applies the same changes ServiceVM makes to the descriptor when starting an instance.
+    ################################################################################################################
+    def __init__(self, saved_xml_descriptor, os_type, network_mode, adapter):
+        xml_descriptor = VirtualMachineDescriptor(saved_xml_descriptor)
+        xml_descriptor.setUuid(SLOT_MARKER.format('uuid'))
+        xml_descriptor.setName(SLOT_MARKER.format('name'))
+        xml_descriptor.setDiskImage('/' + SLOT_MARKER.format('disk_image'), 'qcow2')
+        xml_descriptor.enableLocalVNC()
+
+        if os_type != "lin":
+            xml_descriptor.setRealtekNetworkDriver()
+
+        if network_mode == "bridged":
+            xml_descriptor.enableBridgedMode(adapter)
+            xml_descriptor.setMACAddress(SLOT_MARKER.format('mac_address'))
+        else:
+            # Remove any previous redirections, and add a single argument to find out how the arguments will
+            # be serialized, which is replaced by the actual redirections.
+            xml_descriptor.enableNonBridgedMode(adapter)
+            xml_descriptor.setPortRedirection({})
+            qemu_element = xml_descriptor.xmlRoot.find(VirtualMachineDescriptor.qemuCmdLineNodeName)
+            qemu_element.append(Element(VirtualMachineDescriptor.qemuArgNodeName,
+                                        {'value': SLOT_MARKER.format('port_arg')}))
+
+        xml_descriptor.removeSecLabel()
+        xml_string = xml_descriptor.getAsString()
+
+        # Turn the whole qemu argument element into the port mappings slot, storing it to be used for each argument.
+        self.port_arg_xml = None
+        port_arg_match = re.search(r'<[^<>]*' + SLOT_MARKER.format('port_arg') + r'[^<>]*>', xml_string)
+        if port_arg_match:
+            self.port_arg_xml = port_arg_match.group(0)
+            xml_string = xml_string.replace(self.port_arg_xml, SLOT_MARKER.format('port_mappings'))
+
+        # Split the XML into literal parts (even positions) and slot names (odd positions).
+        self.parts = SLOT_REGEX.split(xml_string)
+
+    ################################################################################################################
+    # Returns the XML descriptor for an instance.
+    ################################################################################################################
+    def render(self, uuid, name, disk_image, mac_address=None, port_mappings=None):
+        values = {'uuid': escape(uuid),
+                  'name': escape(name),
+                  'disk_image': escape(os.path.abspath(disk_image), {'"': '&quot;'}),
+                  'mac_address': escape(mac_address or '', {'"': '&quot;'}),
+                  'port_mappings': self._render_port_mappings(port_mappings or {})}
+
+        parts = list(self.parts)
+        for i in range(1, len(parts), 2):
+            parts[i] = values[parts[i]]
+        return ''.join(parts)
+
+    ################################################################################################################
+    # Returns the qemu arguments to redirect the given host ports to the given guest ports.
+    ################################################################################################################
+    def _render_port_mappings(self, port_mappings):
+        arguments = []
+        for host_port, guest_port in port_mappings.iteritems():
+            arguments.append(self.port_arg_xml.replace(SLOT_MARKER.format('port_arg'), '-redir'))
+            arguments.append(self.port_arg_xml.replace(SLOT_MARKER.format('port_arg'),
+                                                       'tcp:%d::%d' % (int(host_port), int(guest_port))))
+        return ''.join(arguments)
+
+
+################################################################################################################
+# Keeps compiled descriptor templates, by service and by the contents of the descriptor stored in the saved state.
+# Since the key includes a digest of the stored descriptor, a state image with a new descriptor never gets an old
+# template; invalidate() is used to drop templates of a service whose state image changed, to free them earlier.
+################################################################################################################
+class DescriptorTemplateCache(object):
+
+    ################################################################################################################
+    # Constructor.
+    ################################################################################################################
+    def __init__(self, max_templates=MAX_CACHED_TEMPLATES):
+        self.max_templates = max_templates
+        self.templates = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    ################################################################################################################
+    # Returns the template for the given stored descriptor and instance settings, compiling it if needed.
+    ################################################################################################################
+    def get(self, service_id, saved_xml_descriptor, os_type, network_mode, adapter):
+        key = (service_id, hashlib.sha1(saved_xml_descriptor).hexdigest(), os_type, network_mode, adapter)
+        with self.lock:
+            template = self.templates.pop(key, None)
+            if template is not None:
+                self.hits += 1
+                self.templates[key] = template
+                return template
+            self.misses += 1
+
+        template = DescriptorTemplate(saved_xml_descriptor, os_type, network_mode, adapter)
+        with self.lock:
+            self.templates[key] = template
+            while len(self.templates) > self.max_templates:
+                self.templates.popitem(last=False)
+        return template
+
+    ################################################################################################################
+    # Removes all templates of the given service.
+    ################################################################################################################
+    def invalidate(self, service_id):
+        with self.lock:
+            for key in self.templates.keys():
+                if key[0] == service_id:
+                    del self.templates[key]
+
+    ################################################################################################################
+    # Returns hit and miss counts.
+    ################################################################################################################
+    def get_stats(self):
+        with self.lock:
+            return {'templates': len(self.templates), 'hits': self.hits, 'misses': self.misses}
+
+
+################################################################################################################
+# Builds an instance descriptor by parsing and modifying the stored one, as done before templates were cached.
+################################################################################################################
+def build_descriptor_directly(saved_xml_descriptor, uuid, name, disk_image, port_mappings):
+    xml_descriptor = VirtualMachineDescriptor(saved_xml_descriptor)
+    xml_descriptor.setUuid(uuid)
+    xml_descriptor.setName(name)
+    xml_descriptor.setDiskImage(disk_image, 'qcow2')
+    xml_descriptor.enableLocalVNC()
+    xml_descriptor.enableNonBridgedMode('eth0')
+    xml_descriptor.setPortRedirection(port_mappings)
+    xml_descriptor.removeSecLabel()
+    return xml_descriptor.getAsString()
+
+
+################################################################################################################
+# Command line micro-benchmark: descriptors generated per second by parsing each time and with a template.
+# Usage: descriptortemplate.py descriptor.xml
+################################################################################################################
+if __name__ == '__main__':
+    with open(sys.argv[1], 'r') as xml_file:
+        test_xml = xml_file.read()
+    test_mappings = {10022: 22, 10080: 8080}
+    iterations = 2000
+
+    start_time = time.time()
+    for i in range(iterations):
+        build_descriptor_directly(test_xml, 'a9d1f8a2-0000-4000-8000-%012d' % i, 'svm-%d' % i, '/tmp/disk.qcow2',
+                                  test_mappings)
+    direct_rate = iterations / (time.time() - start_time)
+
+    test_cache = DescriptorTemplateCache()
+    start_time = time.time()
+    for i in range(iterations):
+        test_cache.get('service', test_xml, 'lin', 'nat', 'eth0').render('a9d1f8a2-0000-4000-8000-%012d' % i,
+                                                                           'svm-%d' % i, '/tmp/disk.qcow2',
+                                                                           port_mappings=test_mappings)
+    template_rate = iterations / (time.time() - start_time)
+
+    print 'Parsing each time: {:.0f} descriptors/s'.format(direct_rate)
+    print 'Cached template:   {:.0f} descriptors/s ({:.1f}x)'.format(template_rate, template_rate / direct_rate)
@@ -0,0 +1,615 @@
+# KVM-based Discoverable Cloudlet (KD-Cloudlet) 
+# Copyright (c) 2015 Carnegie Mellon University.
+# All Rights Reserved.
+# 
+# THIS SOFTWARE IS PROVIDED "AS IS," WITH NO WARRANTIES WHATSOEVER. CARNEGIE MELLON UNIVERSITY EXPRESSLY DISCLAIMS TO THE FULLEST EXTENT PERMITTEDBY LAW ALL EXPRESS, IMPLIED, AND STATUTORY WARRANTIES, INCLUDING, WITHOUT LIMITATION, THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, AND NON-INFRINGEMENT OF PROPRIETARY RIGHTS.
+# 
+# Released under a modified BSD license, please see license.txt for full terms.
+# DM-0002138
+# 
+# KD-Cloudlet includes and/or makes use of the following Third-Party Software subject to their own licenses:
+# MiniMongo
+# Copyright (c) 2010-2014, Steve Lacy 
+# All rights reserved. Released under BSD license.
+# https://github.com/MiniMongo/minimongo/blob/master/LICENSE
+# 
+# Bootstrap
+# Copyright (c) 2011-2015 Twitter, Inc.
+# Released under the MIT License
+# https://github.com/twbs/bootstrap/blob/master/LICENSE
+# 
+# jQuery JavaScript Library v1.11.0
+# http://jquery.com/
+# Includes Sizzle.js
+# http://sizzlejs.com/
+# Copyright 2005, 2014 jQuery Foundation, Inc. and other contributors
+# Released under the MIT license
+# http://jquery.org/license
+
+
+import collections
+import hashlib
+import logging
+import os
+import sys
+import threading
+import time
+
+from chunkcodec import ChunkCodecException, ENCODING_RAW, decode
+
+log = logging.getLogger(__name__)
+
+# Size of the blocks of the disk image file that are compared and sent; the default cluster size of qcow2 images.
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# Max amount of bytes sent in a single request. Smaller batches lose less progress when a request fails.
+MAX_BATCH_SIZE = 8 * 1024 * 1024
+
+# Times a batch is sent before giving up, and seconds waited before the first retry (doubled for each retry after it).
+MAX_SEND_ATTEMPTS = 5
+RETRY_DELAY = 1
+
+# A block of the disk image file. Chunks are numbered in the order they are read, across all rounds, so the receiver
+# can tell which ones it already has when a batch is sent again; the checksum is the MD5 hex digest of the data.
+Chunk = collections.namedtuple('Chunk', ['number', 'offset', 'data', 'checksum'])
+
+
+################################################################################################################
+# Exception type used in this module.
+################################################################################################################
+class DiskPreCopyException(Exception):
+    def __init__(self, message):
+        super(DiskPreCopyException, self).__init__(message)
+        self.message = message
+
+
+################################################################################################################
+# Returns the description of each chunk sent along with their data: number, offset, length and checksum, plus the
+# encoding and length of the data sent if the chunks were encoded (see chunkcodec).
+################################################################################################################
+def describe_chunks(chunks, encoded_chunks=None):
+    descriptions = [[chunk.number, chunk.offset, len(chunk.data), chunk.checksum] for chunk in chunks]
+    if encoded_chunks is not None:
+        for description, (encoding, payload) in zip(descriptions, encoded_chunks):
+            description.extend([encoding, len(payload)])
+    return descriptions
+
+
+################################################################################################################
+# Reads the data of a chunk sent with the given encoding from a stream. The data is only decoded if decode_data is
+# True, since chunks already received are skipped.
+################################################################################################################
+def read_chunk_data(data_file, name, length, encoding=ENCODING_RAW, encoded_length=None, decode_data=True):
+    if encoded_length is None:
+        encoded_length = length
+    payload = data_file.read(encoded_length)
+    if len(payload) != encoded_length:
+        raise DiskPreCopyException('Chunk {} is incomplete: expected {} bytes, got {}'.format(
+            name, encoded_length, len(payload)))
+    if not decode_data:
+        return None
+
+    try:
+        return decode(encoding, payload, length)
+    except ChunkCodecException as e:
+        raise DiskPreCopyException('Chunk {} could not be decoded: {}'.format(name, e.message))
+
+
+################################################################################################################
+# Sends a batch of chunks with send_chunks(chunks, file_size). If that fails, asks the receiver which of them it still
+# needs with get_pending_chunks(chunks), and sends only those, retrying a few times.
+################################################################################################################
+def send_with_resume(chunks, file_size, send_chunks, get_pending_chunks, max_attempts=MAX_SEND_ATTEMPTS,
+                     retry_delay=RETRY_DELAY):
+    pending_chunks = chunks
+    for attempt in range(1, max_attempts + 1):
+        try:
+            send_chunks(pending_chunks, file_size)
+            return
+        except Exception as e:
+            if attempt == max_attempts:
+                raise DiskPreCopyException('Could not send chunks after {} attempts: {}'.format(max_attempts, str(e)))
+            log.warning('Error sending chunks, will resume: {}'.format(str(e)))
+            time.sleep(retry_delay * 2 ** (attempt - 1))
+
+        try:
+            pending_chunks = get_pending_chunks(pending_chunks)
+        except Exception as e:
+            # Sending everything again is safe, since the receiver skips chunks it already wrote.
+            log.warning('Could not get transfer status, sending whole batch again: {}'.format(str(e)))
+
+
+################################################################################################################
+# Sends batches of chunks with send_with_resume over several streams at once: batches are sent by the workers of a
+# thread pool, with at most max_streams of them in flight, so that more chunks can be read while they are sent. Without
+# a pool, each batch is sent before send returns.
+################################################################################################################
+class BatchStreams(object):
+
+    ################################################################################################################
+    # Constructor.
+    ################################################################################################################
+    def __init__(self, send_chunks, get_pending_chunks, pool=None, max_streams=1):
+        self.send_chunks = send_chunks
+        self.get_pending_chunks = get_pending_chunks
+        self.pool = pool if max_streams > 1 else None
+        self.slots = threading.BoundedSemaphore(max(max_streams, 1))
+        self.futures = []
+
+    ################################################################################################################
+    # Sends a batch, waiting for a free stream if needed. If a batch sent before failed, waits for the ones still in
+    # flight and raises its error.
+    ################################################################################################################
+    def send(self, batch, file_size=None):
+        if self.pool is None:
+            send_with_resume(batch, file_size, self.send_chunks, self.get_pending_chunks)
+            return
+
+        self._check_sent_batches()
+        self.slots.acquire()
+        try:
+            self.futures.append(self.pool.submit(self._send_batch, batch, file_size))
+        except:
+            self.slots.release()
+            raise
+
+    ################################################################################################################
+    # Waits until all batches have been sent, and raises the error of the first one that failed, if any.
+    ################################################################################################################
+    def wait(self):
+        futures, self.futures = self.futures, []
+        error = None
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                error = error or sys.exc_info()
+        if error:
+            raise error[0], error[1], error[2]
+
+    ################################################################################################################
+    # Forgets the batches already sent, and fails early if one of them could not be sent.
+    ################################################################################################################
+    def _check_sent_batches(self):
+        for future in [future for future in self.futures if future.done()]:
+            try:
+                future.result()
+            except Exception:
+                self.wait()
+        self.futures = [future for future in self.futures if not future.done()]
+
+    ################################################################################################################
+    # Sends a batch from a worker of the pool, freeing its stream at the end.
+    ################################################################################################################
+    def _send_batch(self, batch, file_size):
+        try:
+            send_with_resume(batch, file_size, self.send_chunks, self.get_pending_chunks)
+        finally:
+            self.slots.release()
+
+
+################################################################################################################
+# Receives chunks of a disk image file and writes them directly at their offsets in it, verifying their checksums.
+# Batches may be received at the same time and in any order: each one extends the file to cover its chunks before
+# writing them in place through its own file object. Keeps track of the chunks written, as the number of the last one
+# below which all were written plus the ones written after it, so that chunks sent again after a failure are skipped.
+################################################################################################################
+class ChunkReceiver(object):
+
+    ################################################################################################################
+    # Constructor. Creates the file if it does not exist.
+    ################################################################################################################
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.last_chunk = -1
+        self.received_chunks = set()
+        self.chunks_received = 0
+        self.bytes_received = 0
+        self.file_size = None
+        self.finished = False
+        self.lock = threading.Lock()
+
+        if not os.path.exists(self.file_path):
+            open(self.file_path, 'wb').close()
+
+    ################################################################################################################
+    # Reads the data of the described chunks from data_file, a stream, and writes each one once it is decoded and
+    # verified. If file_size is given, the file is truncated or extended to it after that; it is only sent with the
+    # last batch of a round, once all others were received.
+    ################################################################################################################
+    def receive(self, chunk_list, data_file, file_size=None):
+        if chunk_list:
+            self._preallocate(max(description[1] + description[2] for description in chunk_list))
+
+        # Chunks written before a failure are recorded too, so that they are not sent again.
+        written = []
+        try:
+            with open(self.file_path, 'r+b') as disk_file:
+                for description in chunk_list:
+                    number, offset, length, checksum = description[:4]
+                    data = read_chunk_data(data_file, number, length, *description[4:],
+                                           decode_data=not self._was_received(number))
+                    if data is None:
+                        continue
+                    if hashlib.md5(data).hexdigest() != checksum:
+                        raise DiskPreCopyException('Checksum of chunk {} does not match'.format(number))
+
+                    disk_file.seek(offset)
+                    disk_file.write(data)
+                    written.append((number, length))
+        finally:
+            with self.lock:
+                for number, length in written:
+                    self._mark_received(number, length)
+
+        with self.lock:
+            if file_size is not None:
+                with open(self.file_path, 'r+b') as disk_file:
+                    disk_file.truncate(file_size)
+                self.file_size = file_size
+
+    ################################################################################################################
+    # Returns the progress of the transfer.
+    ################################################################################################################
+    def get_status(self):
+        with self.lock:
+            return {'last_chunk': self.last_chunk,
+                    'received_chunks': sorted(self.received_chunks),
+                    'chunks_received': self.chunks_received,
+                    'bytes_received': self.bytes_received,
+                    'file_size': self.file_size,
+                    'finished': self.finished}
+
+    ################################################################################################################
+    # Extends the file to the given size if it is smaller, so that the chunks of a batch are written in place.
+    ################################################################################################################
+    def _preallocate(self, size):
+        with self.lock:
+            if os.path.getsize(self.file_path) < size:
+                with open(self.file_path, 'r+b') as disk_file:
+                    disk_file.truncate(size)
+
+    ################################################################################################################
+    # Returns True if the given chunk was already written.
+    ################################################################################################################
+    def _was_received(self, number):
+        with self.lock:
+            return number <= self.last_chunk or number in self.received_chunks
+
+    ################################################################################################################
+    # Records that a chunk was written, moving the last chunk forward while the ones after it are there.
+    ################################################################################################################
+    def _mark_received(self, number, length):
+        if number <= self.last_chunk or number in self.received_chunks:
+            return
+        self.received_chunks.add(number)
+        while self.last_chunk + 1 in self.received_chunks:
+            self.last_chunk += 1
+            self.received_chunks.remove(self.last_chunk)
+        self.chunks_received += 1
+        self.bytes_received += length
+
+
+################################################################################################################
+# Copies a disk image file while the VM using it is still running, so that the VM only has to be paused while the
+# blocks changed after that are sent. Changed blocks are found by comparing a digest of each block of the file with the
+# one of the data last sent for it, which works for any image format. Batches of chunks are sent with BatchStreams,
+# over up to max_streams workers of the given pool, using the given send_chunks function, and get_receiver_status to
+# ask the receiver which chunks it wrote (see ChunkReceiver.get_status); the last batch of each round is sent once all
+# others were, with the current size of the file.
+################################################################################################################
+class DiskPreCopier(object):
+
+    ################################################################################################################
+    # Constructor.
+    ################################################################################################################
+    def __init__(self, file_path, send_chunks, get_receiver_status, chunk_size=DEFAULT_CHUNK_SIZE,
+                 max_batch_size=MAX_BATCH_SIZE, pool=None, max_streams=1):
+        self.file_path = file_path
+        self.send_chunks = send_chunks
+        self.get_receiver_status = get_receiver_status
+        self.chunk_size = chunk_size
+        self.max_batch_size = max_batch_size
+        self.pool = pool
+        self.max_streams = max_streams
+
+        self.next_chunk_number = 0
+        self.sent_checksums = {}
+        self.round_bytes = []
+
+    ################################################################################################################
+    # Sends all blocks that changed since they were last sent (all of them on the first round). Returns the amount of
+    # bytes sent.
+    ################################################################################################################
+    def copy_round(self):
+        streams = BatchStreams(self.send_chunks, self._get_pending_chunks, self.pool, self.max_streams)
+        batches = []
+        batch = []
+        batch_size = 0
+        offset = 0
+        with open(self.file_path, 'rb') as disk_file:
+            while True:
+                data = disk_file.read(self.chunk_size)
+                if not data:
+                    break
+
+                checksum = hashlib.md5(data).hexdigest()
+                if self.sent_checksums.get(offset) != checksum:
+                    batch.append(Chunk(self.next_chunk_number, offset, data, checksum))
+                    self.next_chunk_number += 1
+                    batch_size += len(data)
+                    if batch_size >= self.max_batch_size:
+                        streams.send(batch)
+                        batches.append(batch)
+                        batch = []
+                        batch_size = 0
+                offset += len(data)
+
+        # The last batch is always sent, even if it is empty, to set the size of the copy; the receiver must have all
+        # other batches by then.
+        streams.wait()
+        streams.send(batch, file_size=offset)
+        streams.wait()
+        batches.append(batch)
+
+        # What was sent for each block is only recorded once it has been sent.
+        bytes_sent = 0
+        for sent_batch in batches:
+            for chunk in sent_batch:
+                self.sent_checksums[chunk.offset] = chunk.checksum
+                bytes_sent += len(chunk.data)
+        for old_offset in [old_offset for old_offset in self.sent_checksums if old_offset >= offset]:
+            del self.sent_checksums[old_offset]
+
+        self.round_bytes.append(bytes_sent)
+        return bytes_sent
+
+    ################################################################################################################
+    # Does copy rounds until the amount of bytes sent in a round is at most min_delta, stops going down, or max_rounds
+    # is reached. What is left should be sent with a final copy_round once the VM is paused.
+    ################################################################################################################
+    def precopy(self, max_rounds, min_delta):
+        bytes_sent = self.copy_round()
+        while len(self.round_bytes) < max_rounds and bytes_sent > min_delta:
+            previous_bytes_sent = bytes_sent
+            bytes_sent = self.copy_round()
+            if bytes_sent >= previous_bytes_sent:
+                # The VM is changing the disk as fast as we can send it; more rounds would not help.
+                break
+
+    ################################################################################################################
+    # Returns the amount of bytes sent so far.
+    ################################################################################################################
+    def get_bytes_sent(self):
+        return sum(self.round_bytes)
+
+    ################################################################################################################
+    # Returns the chunks of a batch the receiver has not written yet.
+    ################################################################################################################
+    def _get_pending_chunks(self, chunks):
+        status = self.get_receiver_status()
+        received_chunks = set(status.get('received_chunks', []))
+        return [chunk for chunk in chunks if chunk.number > status['last_chunk'] and chunk.number not in received_chunks]
+
+
+################################################################################################################
+# Functions to test the class.
+################################################################################################################
+def get_args():
+    import argparse
+    parser = argparse.ArgumentParser(description='Migrates a disk image file being written to between two local '
+                                                 'files, comparing downtime with and without pre-copy (precopy test), '
+                                                 'or copies one to a local HTTP receiver over a slow link with '
+                                                 'different amounts of parallel streams (streams test).')
+    parser.add_argument('-t', '--test', choices=['precopy', 'streams'], default='precopy', help='test to run')
+    parser.add_argument('-d', '--dir', default='.', help='folder where the test files are created')
+    parser.add_argument('-s', '--size', type=int, default=256, help='size of the disk image, in MB')
+    parser.add_argument('-b', '--bandwidth', type=float, default=100.0, help='simulated network bandwidth, in MB/s')
+    parser.add_argument('-c', '--batch', type=int, default=MAX_BATCH_SIZE / 1024 / 1024, help='max batch size, in MB')
+    parser.add_argument('-n', '--streams', default='1,2,4,8', help='amounts of parallel streams compared (streams test)')
+    parser.add_argument('-l', '--latency', type=float, default=0.1,
+                        help='simulated round trip time of each request, in seconds (streams test)')
+    parser.add_argument('-p', '--stream-bandwidth', type=float, default=4.0,
+                        help='simulated max bandwidth of each connection, as limited by its TCP window, in MB/s '
+                             '(streams test)')
+    parser.add_argument('-w', '--writes', type=int, default=50,
+                        help='random 64 KB writes per second done to the image by the simulated VM')
+    parser.add_argument('-r', '--rounds', type=int, default=5, help='max pre-copy rounds')
+    parser.add_argument('-f', '--failures', type=float, default=0,
+                        help='probability of the simulated network cutting a batch short')
+    return parser.parse_args()
+
+
+################################################################################################################
+# Copies a file written by a simulated running VM to another local file through a simulated network, and verifies
+# that both are the same at the end.
+################################################################################################################
+def test_precopy():
+    import StringIO
+    import random
+
+    args = get_args()
+    source_path = os.path.join(args.dir, 'precopy_source.img')
+    destination_path = os.path.join(args.dir, 'precopy_destination.img')
+    block_size = 64 * 1024
+    with open(source_path, 'wb') as source_file:
+        for _ in range(args.size * 16):
+            source_file.write(os.urandom(block_size))
+
+    # The simulated VM writes random blocks until paused.
+    paused = threading.Event()
+
+    def run_vm():
+        with open(source_path, 'r+b') as image_file:
+            while not paused.is_set():
+                image_file.seek(random.randrange(args.size * 16) * block_size)
+                image_file.write(os.urandom(block_size))
+                image_file.flush()
+                time.sleep(1.0 / args.writes)
+
+    # The simulated destination cloudlet, behind a network with the given bandwidth that sometimes fails.
+    receiver = ChunkReceiver(destination_path)
+    failures = [0]
+
+    def send_chunks(chunks, file_size):
+        data = ''.join(chunk.data for chunk in chunks)
+        if random.random() < args.failures:
+            failures[0] += 1
+            data = data[:random.randrange(len(data) + 1)]
+        time.sleep(len(data) / (args.bandwidth * 1024 * 1024))
+        receiver.receive(describe_chunks(chunks), StringIO.StringIO(data), file_size)
+
+    vm_thread = threading.Thread(target=run_vm)
+    vm_thread.start()
+    try:
+        precopier = DiskPreCopier(source_path, send_chunks, receiver.get_status, max_batch_size=args.batch * 1024 * 1024)
+        precopy_start_time = time.time()
+        precopier.precopy(args.rounds, MAX_BATCH_SIZE * 2)
+        precopy_time = time.time() - precopy_start_time
+    finally:
+        paused.set()
+        vm_thread.join()
+
+    downtime_start_time = time.time()
+    precopier.copy_round()
+    downtime = time.time() - downtime_start_time
+
+    with open(source_path, 'rb') as source_file, open(destination_path, 'rb') as destination_file:
+        identical = hashlib.md5(source_file.read()).digest() == hashlib.md5(destination_file.read()).digest()
+    os.remove(source_path)
+    os.remove(destination_path)
+
+    print 'Bytes sent per round: {}'.format(', '.join(str(round_bytes) for round_bytes in precopier.round_bytes))
+    print 'Batches cut short and resumed: {}'.format(failures[0])
+    print 'Receiver status: {}'.format(receiver.get_status())
+    print 'Live pre-copy time: {:.2f}s'.format(precopy_time)
+    print 'Downtime with pre-copy: {:.2f}s'.format(downtime)
+    print 'Downtime when copying the whole image while paused: {:.2f}s'.format(args.size / args.bandwidth)
+    print 'Copy is identical: {}'.format(identical)
+
+
+################################################################################################################
+# Copies a file to a receiver behind a local HTTP server, which simulates a link with latency, limited total bandwidth
+# and limited bandwidth per connection, once for each amount of streams, and shows the throughput of each.
+################################################################################################################
+def test_streams():
+    import BaseHTTPServer
+    import SocketServer
+    import StringIO
+    import httplib
+    import json
+    import urllib
+    import urlparse
+    from pycloud.pycloud.utils.threadpool import ThreadPool
+
+    args = get_args()
+    source_path = os.path.join(args.dir, 'streams_source.img')
+    destination_path = os.path.join(args.dir, 'streams_destination.img')
+    with open(source_path, 'wb') as source_file:
+        for _ in range(args.size * 16):
+            source_file.write(os.urandom(64 * 1024))
+
+    # Time at which the link will be free, shared by all connections.
+    link = {'free_at': time.time()}
+    link_lock = threading.Lock()
+    receiver_holder = {}
+
+    class SimulatedLinkHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            url = urlparse.urlparse(self.path)
+            params = dict((key, values[0]) for key, values in urlparse.parse_qs(url.query).items())
+            body = self._read_throttled(int(self.headers['Content-Length']))
+            time.sleep(args.latency)
+
+            receiver = receiver_holder['receiver']
+            if url.path == '/chunks':
+                file_size = int(params['file_size']) if params.get('file_size') else None
+                receiver.receive(json.loads(params['chunks']), StringIO.StringIO(body), file_size)
+                reply = '{}'
+            else:
+                reply = json.dumps(receiver.get_status())
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(reply)))
+            self.end_headers()
+            self.wfile.write(reply)
+
+        def _read_throttled(self, length):
+            parts = []
+            stream_free_at = time.time()
+            while length > 0:
+                part = self.rfile.read(min(length, 64 * 1024))
+                length -= len(part)
+                parts.append(part)
+                with link_lock:
+                    link['free_at'] = max(time.time(), link['free_at']) + len(part) / (args.bandwidth * 1024 * 1024)
+                    link_free_at = link['free_at']
+                stream_free_at = max(time.time(), stream_free_at) + len(part) / (args.stream_bandwidth * 1024 * 1024)
+                time.sleep(max(0, max(link_free_at, stream_free_at) - time.time()))
+            return ''.join(parts)
+
+        def log_message(self, *log_args):
+            pass
+
+    class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+        daemon_threads = True
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SimulatedLinkHandler)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+
+    # Each worker of the pool keeps its own connection, as the migrator does with its sessions.
+    connections = threading.local()
+    open_connections = []
+
+    def post(path, params, body=''):
+        if not hasattr(connections, 'connection'):
+            connections.connection = httplib.HTTPConnection('127.0.0.1', server.server_address[1])
+            open_connections.append(connections.connection)
+        connections.connection.request('POST', path + '?' + urllib.urlencode(params), body)
+        response = connections.connection.getresponse()
+        return response.read()
+
+    def send_chunks(chunks, file_size):
+        params = {'chunks': json.dumps(describe_chunks(chunks)), 'file_size': file_size if file_size is not None else ''}
+        post('/chunks', params, ''.join(chunk.data for chunk in chunks))
+
+    def get_receiver_status():
+        return json.loads(post('/status', {}))
+
+    results = []
+    for streams in [int(streams) for streams in args.streams.split(',')]:
+        if os.path.exists(destination_path):
+            os.remove(destination_path)
+        receiver_holder['receiver'] = ChunkReceiver(destination_path)
+
+        pool = ThreadPool(streams, name='streams-{}'.format(streams))
+        precopier = DiskPreCopier(source_path, send_chunks, get_receiver_status,
+                                  max_batch_size=args.batch * 1024 * 1024, pool=pool, max_streams=streams)
+        start_time = time.time()
+        bytes_sent = precopier.copy_round()
+        elapsed_time = time.time() - start_time
+
+        with open(source_path, 'rb') as source_file, open(destination_path, 'rb') as destination_file:
+            identical = hashlib.md5(source_file.read()).digest() == hashlib.md5(destination_file.read()).digest()
+        results.append((streams, bytes_sent / elapsed_time / 1024 / 1024, identical))
+
+    for connection in open_connections:
+        connection.close()
+    server.shutdown()
+    os.remove(source_path)
+    os.remove(destination_path)
+
+    print 'Link: {} MB/s, {} MB/s per connection, {}s round trip'.format(args.bandwidth, args.stream_bandwidth,
+                                                                          args.latency)
+    for streams, throughput, identical in results:
+        print '{} streams: {:.2f} MB/s, copy is identical: {}'.format(streams, throughput, identical)
+
+
+if __name__ == '__main__':
+    if get_args().test == 'streams':
+        test_streams()
+    else:
+        test_precopy()
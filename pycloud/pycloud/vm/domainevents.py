@@ -0,0 +1,149 @@
+# KVM-based Discoverable Cloudlet (KD-Cloudlet) 
+# Copyright (c) 2015 Carnegie Mellon University.
+# All Rights Reserved.
+# 
+# THIS SOFTWARE IS PROVIDED "AS IS," WITH NO WARRANTIES WHATSOEVER. CARNEGIE MELLON UNIVERSITY EXPRESSLY DISCLAIMS TO THE FULLEST EXTENT PERMITTEDBY LAW ALL EXPRESS, IMPLIED, AND STATUTORY WARRANTIES, INCLUDING, WITHOUT LIMITATION, THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, AND NON-INFRINGEMENT OF PROPRIETARY RIGHTS.
+# 
+# Released under a modified BSD license, please see license.txt for full terms.
+# DM-0002138
+# 
+# KD-Cloudlet includes and/or makes use of the following Third-Party Software subject to their own licenses:
+# MiniMongo
+# Copyright (c) 2010-2014, Steve Lacy 
+# All rights reserved. Released under BSD license.
+# https://github.com/MiniMongo/minimongo/blob/master/LICENSE
+# 
+# Bootstrap
+# Copyright (c) 2011-2015 Twitter, Inc.
+# Released under the MIT License
+# https://github.com/twbs/bootstrap/blob/master/LICENSE
+# 
+# jQuery JavaScript Library v1.11.0
+# http://jquery.com/
+# Includes Sizzle.js
+# http://sizzlejs.com/
+# Copyright 2005, 2014 jQuery Foundation, Inc. and other contributors
+# Released under the MIT license
+# http://jquery.org/license
+
+
+import Queue
+import threading
+
+import libvirt
+
+from pycloud.pycloud.vm.hypervisorpool import start_event_loop
+
+# Simplified names of the lifecycle events we report.
+EVENT_STARTED = 'started'
+EVENT_SUSPENDED = 'suspended'
+EVENT_RESUMED = 'resumed'
+EVENT_STOPPED = 'stopped'
+EVENT_SAVED = 'saved'
+EVENT_MIGRATED = 'migrated'
+EVENT_CRASHED = 'crashed'
+EVENT_OTHER = 'other'
+
+
+################################################################################################################
+# Converts a libvirt lifecycle event and its detail into one of our simplified event names.
+################################################################################################################
+def get_event_name(event, detail):
+    if event == libvirt.VIR_DOMAIN_EVENT_STARTED:
+        return EVENT_STARTED
+    elif event == libvirt.VIR_DOMAIN_EVENT_SUSPENDED:
+        return EVENT_SUSPENDED
+    elif event == libvirt.VIR_DOMAIN_EVENT_RESUMED:
+        return EVENT_RESUMED
+    elif event == libvirt.VIR_DOMAIN_EVENT_STOPPED:
+        if detail == libvirt.VIR_DOMAIN_EVENT_STOPPED_SAVED:
+            return EVENT_SAVED
+        elif detail == libvirt.VIR_DOMAIN_EVENT_STOPPED_MIGRATED:
+            return EVENT_MIGRATED
+        elif detail == libvirt.VIR_DOMAIN_EVENT_STOPPED_CRASHED:
+            return EVENT_CRASHED
+        return EVENT_STOPPED
+    elif event == libvirt.VIR_DOMAIN_EVENT_CRASHED:
+        return EVENT_CRASHED
+    return EVENT_OTHER
+
+
+################################################################################################################
+# Listens for lifecycle events of all domains in a hypervisor, and passes them to a handler function as
+# handler(uuid, event_name). Handlers run in their own thread, so that they can block without stalling libvirt's
+# event loop. If the connection is closed, it is re-opened after a while.
+################################################################################################################
+class DomainEventListener(object):
+
+    # Seconds to wait before trying to reconnect.
+    RECONNECT_DELAY_IN_S = 5
+
+    ################################################################################################################
+    # Constructor.
+    ################################################################################################################
+    def __init__(self, uri, handler):
+        self.uri = uri
+        self.handler = handler
+        self.connection = None
+        self.events = Queue.Queue()
+        self.handler_thread = None
+
+    ################################################################################################################
+    # Connects and starts passing events to the handler.
+    ################################################################################################################
+    def start(self):
+        start_event_loop()
+
+        self.handler_thread = threading.Thread(target=self._handle_events, name='domain-events')
+        self.handler_thread.daemon = True
+        self.handler_thread.start()
+
+        self._connect()
+
+    ################################################################################################################
+    # Opens the connection and registers for events, scheduling a retry if it fails.
+    ################################################################################################################
+    def _connect(self):
+        try:
+            connection = libvirt.open(self.uri)
+            connection.registerCloseCallback(self._on_close, None)
+            connection.domainEventRegisterAny(None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE, self._on_lifecycle_event,
+                                              None)
+            self.connection = connection
+            print 'Listening for domain events from {}'.format(self.uri)
+        except libvirt.libvirtError, e:
+            print 'Could not register for domain events: {}'.format(str(e))
+            self._schedule_reconnect()
+
+    ################################################################################################################
+    # Tries to connect again after some time.
+    ################################################################################################################
+    def _schedule_reconnect(self):
+        timer = threading.Timer(self.RECONNECT_DELAY_IN_S, self._connect)
+        timer.daemon = True
+        timer.start()
+
+    ################################################################################################################
+    # Called by libvirt when our connection is closed, i.e., if libvirtd is restarted.
+    ################################################################################################################
+    def _on_close(self, connection, reason, opaque):
+        print 'Connection for domain events closed (reason {}), reconnecting.'.format(reason)
+        self.connection = None
+        self._schedule_reconnect()
+
+    ################################################################################################################
+    # Called by libvirt's event loop. Only queues the event.
+    ################################################################################################################
+    def _on_lifecycle_event(self, connection, domain, event, detail, opaque):
+        self.events.put((domain.UUIDString(), get_event_name(event, detail)))
+
+    ################################################################################################################
+    # Passes queued events to the handler.
+    ################################################################################################################
+    def _handle_events(self):
+        while True:
+            uuid, event_name = self.events.get()
+            try:
+                self.handler(uuid, event_name)
+            except Exception, e:
+                print 'Error handling event {} for domain {}: {}'.format(event_name, uuid, str(e))
@@ -0,0 +1,393 @@
+# KVM-based Discoverable Cloudlet (KD-Cloudlet) 
+# Copyright (c) 2015 Carnegie Mellon University.
+# All Rights Reserved.
+# 
+# THIS SOFTWARE IS PROVIDED "AS IS," WITH NO WARRANTIES WHATSOEVER. CARNEGIE MELLON UNIVERSITY EXPRESSLY DISCLAIMS TO THE FULLEST EXTENT PERMITTEDBY LAW ALL EXPRESS, IMPLIED, AND STATUTORY WARRANTIES, INCLUDING, WITHOUT LIMITATION, THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE, AND NON-INFRINGEMENT OF PROPRIETARY RIGHTS.
+# 
+# Released under a modified BSD license, please see license.txt for full terms.
+# DM-0002138
+# 
+# KD-Cloudlet includes and/or makes use of the following Third-Party Software subject to their own licenses:
+# MiniMongo
+# Copyright (c) 2010-2014, Steve Lacy 
+# All rights reserved. Released under BSD license.
+# https://github.com/MiniMongo/minimongo/blob/master/LICENSE
+# 
+# Bootstrap
+# Copyright (c) 2011-2015 Twitter, Inc.
+# Released under the MIT License
+# https://github.com/twbs/bootstrap/blob/master/LICENSE
+# 
+# jQuery JavaScript Library v1.11.0
+# http://jquery.com/
+# Includes Sizzle.js
+# http://sizzlejs.com/
+# Copyright 2005, 2014 jQuery Foundation, Inc. and other contributors
+# Released under the MIT license
+# http://jquery.org/license
+
+
+import Queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import libvirt
+
+from pycloud.pycloud.utils import metrics
+
+# Default URI of the local hypervisor.
+DEFAULT_URI = 'qemu:///system'
+
+# Error codes that indicate that the connection itself is no longer usable.
+CONNECTION_ERROR_CODES = [libvirt.VIR_ERR_SYSTEM_ERROR, libvirt.VIR_ERR_RPC, libvirt.VIR_ERR_NO_CONNECT,
+                          libvirt.VIR_ERR_INVALID_CONN]
+
+# Time taken by calls to the hypervisor through pooled connections, by libvirt function.
+LIBVIRT_CALL_SECONDS = metrics.histogram('pycloud_libvirt_call_seconds', 'Time taken by a call to the hypervisor.',
+                                         ['method'])
+
+# Singleton pool used by the app.
+_g_singletonHypervisorPool = None
+_g_singletonLock = threading.Lock()
+
+# Thread running libvirt's default event loop, needed for keepalive and domain events.
+_event_loop_thread = None
+_event_loop_lock = threading.Lock()
+
+
+################################################################################################################
+# Registers and starts running libvirt's default event loop, if not done already. It has to be registered before
+# opening the connections that will use it.
+################################################################################################################
+def start_event_loop():
+    global _event_loop_thread
+    with _event_loop_lock:
+        if _event_loop_thread:
+            return
+
+        libvirt.virEventRegisterDefaultImpl()
+        _event_loop_thread = threading.Thread(target=_run_event_loop, name='libvirt-events')
+        _event_loop_thread.daemon = True
+        _event_loop_thread.start()
+
+
+################################################################################################################
+# Runs libvirt's event loop forever.
+################################################################################################################
+def _run_event_loop():
+    while True:
+        try:
+            libvirt.virEventRunDefaultImpl()
+        except libvirt.libvirtError, e:
+            print 'Error in libvirt event loop: {}'.format(str(e))
+            time.sleep(1)
+
+
+################################################################################################################
+# Creates the pool singleton with the cloudlet's configuration, or gets it if it had been already created.
+################################################################################################################
+def get_hypervisor_pool():
+    global _g_singletonHypervisorPool
+    with _g_singletonLock:
+        if not _g_singletonHypervisorPool:
+            from pycloud.pycloud.cloudlet import get_cloudlet_instance
+            cloudlet = get_cloudlet_instance()
+            start_event_loop()
+            _g_singletonHypervisorPool = HypervisorConnectionPool(cloudlet.libvirt_uri,
+                                                                  size=cloudlet.libvirt_pool_size,
+                                                                  keepalive_interval=cloudlet.libvirt_keepalive_interval,
+                                                                  keepalive_count=cloudlet.libvirt_keepalive_count)
+
+    return _g_singletonHypervisorPool
+
+
+################################################################################################################
+# Exception type used by the pool.
+################################################################################################################
+class HypervisorPoolException(Exception):
+    def __init__(self, message):
+        super(HypervisorPoolException, self).__init__(message)
+        self.message = message
+
+
+################################################################################################################
+# A connection in the pool. Calls made on it, and on domains through call_domain, are forwarded to the libvirt
+# connection, timed, and retried once on a new connection if the current one turns out to be broken (i.e., libvirtd
+# was restarted). Domain objects are not handed out, since they would keep using this connection after it is returned
+# to the pool, or after it is replaced. libvirt connections are thread-safe, so the same one can be used by several
+# threads at once; the lock only protects replacing it and the stats.
+################################################################################################################
+class PooledConnection(object):
+
+    ################################################################################################################
+    # Constructor. The actual connection is only opened when first used.
+    ################################################################################################################
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self.connection = None
+        self.lock = threading.Lock()
+        self.num_calls = 0
+        self.num_errors = 0
+        self.num_reconnects = 0
+        self.total_call_time = 0.0
+        self.max_call_time = 0.0
+
+    ################################################################################################################
+    # Forwards any libvirt connection method through _call.
+    ################################################################################################################
+    def __getattr__(self, name):
+        attribute = getattr(self._get_connection(), name)
+        if not callable(attribute):
+            return attribute
+
+        def forwarded_call(*args, **kwargs):
+            return self._call(name, *args, **kwargs)
+        return forwarded_call
+
+    ################################################################################################################
+    # Returns the libvirt connection, opening it if needed or if it is no longer alive.
+    ################################################################################################################
+    def _get_connection(self):
+        with self.lock:
+            if self.connection is None or not self._is_alive(self.connection):
+                self._reconnect()
+            return self.connection
+
+    ################################################################################################################
+    # Checks, without a round trip to libvirtd, whether a connection is still usable.
+    ################################################################################################################
+    @staticmethod
+    def _is_alive(connection):
+        try:
+            return connection.isAlive() == 1
+        except libvirt.libvirtError:
+            return False
+
+    ################################################################################################################
+    # Opens a new connection, closing the old one. Must be called with the lock held.
+    ################################################################################################################
+    def _reconnect(self):
+        if self.connection is not None:
+            print 'Reconnecting to hypervisor at {} (connection {}).'.format(self.pool.uri, self.index)
+            self.num_reconnects += 1
+            self._close()
+
+        connection = libvirt.open(self.pool.uri)
+
+        # Keepalive only works if the event loop has been started; it is optional.
+        if self.pool.keepalive_interval > 0:
+            try:
+                connection.setKeepAlive(self.pool.keepalive_interval, self.pool.keepalive_count)
+            except libvirt.libvirtError:
+                pass
+
+        self.connection = connection
+
+    ################################################################################################################
+    # Closes the current connection, if any. Errors are ignored, since it is usually closed because it is broken. Must
+    # be called with the lock held.
+    ################################################################################################################
+    def _close(self):
+        connection = self.connection
+        self.connection = None
+        if connection is not None:
+            try:
+                connection.close()
+            except libvirt.libvirtError:
+                pass
+
+    ################################################################################################################
+    # Closes the given connection if it is still the current one, since another thread may have replaced it already.
+    ################################################################################################################
+    def _discard(self, connection):
+        with self.lock:
+            if self.connection is connection:
+                self._close()
+                self.num_reconnects += 1
+
+    ################################################################################################################
+    # Calls a method of the connection, recording its latency and retrying once if the connection was broken.
+    ################################################################################################################
+    def _call(self, name, *args, **kwargs):
+        return self._call_with_connection(name, lambda connection: getattr(connection, name)(*args, **kwargs))
+
+    ################################################################################################################
+    # Calls a method of the domain with the given UUID, looked up on this connection, in the same way as _call.
+    ################################################################################################################
+    def call_domain(self, uuid, name, *args, **kwargs):
+        return self._call_with_connection(name, lambda connection:
+                                          getattr(connection.lookupByUUIDString(uuid), name)(*args, **kwargs))
+
+    ################################################################################################################
+    # Calls function with the libvirt connection, recording its latency under the given name and retrying once on a
+    # new connection if the current one was broken.
+    ################################################################################################################
+    def _call_with_connection(self, name, function):
+        for attempt in range(2):
+            connection = self._get_connection()
+            start_time = time.time()
+            try:
+                result = function(connection)
+                self._record_call(name, start_time)
+                return result
+            except libvirt.libvirtError, e:
+                self._record_call(name, start_time, failed=True)
+                if attempt == 0 and self._is_connection_error(e, connection):
+                    self._discard(connection)
+                    print 'Hypervisor connection {} broken, retrying {}: {}'.format(self.index, name, str(e))
+                    continue
+                raise
+
+    ################################################################################################################
+    # Checks if a libvirt error was caused by a broken connection, rather than by the operation itself.
+    ################################################################################################################
+    def _is_connection_error(self, error, connection):
+        return error.get_error_code() in CONNECTION_ERROR_CODES or not self._is_alive(connection)
+
+    ################################################################################################################
+    # Updates latency metrics.
+    ################################################################################################################
+    def _record_call(self, name, start_time, failed=False):
+        call_time = time.time() - start_time
+        LIBVIRT_CALL_SECONDS.labels(name).observe(call_time)
+        with self.lock:
+            self.num_calls += 1
+            self.total_call_time += call_time
+            self.max_call_time = max(self.max_call_time, call_time)
+            if failed:
+                self.num_errors += 1
+
+    ################################################################################################################
+    # Returns the latency metrics of this connection.
+    ################################################################################################################
+    def get_stats(self):
+        return {'index': self.index,
+                'connected': self.connection is not None,
+                'calls': self.num_calls,
+                'errors': self.num_errors,
+                'reconnects': self.num_reconnects,
+                'avg_call_time': self.total_call_time / self.num_calls if self.num_calls > 0 else 0,
+                'max_call_time': self.max_call_time}
+
+
+################################################################################################################
+# Fixed-size pool of connections to a hypervisor, lent to one thread at a time, for short calls. Long calls (saves,
+# restores and migrations, which can take minutes) are made through a separate connection shared by all threads, so
+# that a few of them can't take all pooled connections and make every other call wait until it times out.
+################################################################################################################
+class HypervisorConnectionPool(object):
+
+    # Max seconds to wait for a connection to be available.
+    BORROW_TIMEOUT_IN_S = 60
+
+    ################################################################################################################
+    # Constructor.
+    ################################################################################################################
+    def __init__(self, uri=DEFAULT_URI, size=4, keepalive_interval=5, keepalive_count=5):
+        self.uri = uri
+        self.keepalive_interval = keepalive_interval
+        self.keepalive_count = keepalive_count
+        self.connections = [PooledConnection(self, index) for index in range(max(size, 1))]
+        self.shared_connection = PooledConnection(self, 'shared')
+        self.available = Queue.LifoQueue()
+        for connection in self.connections:
+            self.available.put(connection)
+
+    ################################################################################################################
+    # Lends a connection for the duration of a with block.
+    ################################################################################################################
+    @contextmanager
+    def borrow(self, timeout=BORROW_TIMEOUT_IN_S):
+        try:
+            connection = self.available.get(timeout=timeout)
+        except Queue.Empty:
+            raise HypervisorPoolException('No hypervisor connection available after {} seconds.'.format(timeout))
+
+        try:
+            yield connection
+        finally:
+            self.available.put(connection)
+
+    ################################################################################################################
+    # Lends the shared connection for long calls, for the duration of a with block. It never waits, since the
+    # connection is not lent exclusively.
+    ################################################################################################################
+    @contextmanager
+    def borrow_shared(self):
+        yield self.shared_connection
+
+    ################################################################################################################
+    # Returns metrics about the pool and each of its connections.
+    ################################################################################################################
+    def get_stats(self):
+        return {'uri': self.uri,
+                'size': len(self.connections),
+                'available': self.available.qsize(),
+                'connections': [connection.get_stats() for connection in self.connections],
+                'shared_connection': self.shared_connection.get_stats()}
+
+
+################################################################################################################
+# Returns a libvirt error like the ones raised when the connection to libvirtd is lost.
+################################################################################################################
+def _make_connection_error():
+    error = libvirt.libvirtError('Simulated broken connection')
+    error.err = (libvirt.VIR_ERR_RPC,) + (None,) * 8
+    return error
+
+
+################################################################################################################
+# Command line test: checks that the pool times out when all connections are borrowed, that long calls can still be
+# made through the shared connection meanwhile, that broken connections are replaced, and then uses a small pool from
+# several threads. Uses libvirt's test driver by default.
+# Usage: hypervisorpool.py [uri]
+################################################################################################################
+if __name__ == '__main__':
+    test_pool = HypervisorConnectionPool(sys.argv[1] if len(sys.argv) > 1 else 'test:///default', size=2)
+
+    # Exhaustion: with all connections borrowed, borrowing waits for the timeout and fails.
+    with test_pool.borrow() as first, test_pool.borrow() as second:
+        wait_start = time.time()
+        try:
+            with test_pool.borrow(timeout=0.5):
+                raise AssertionError('Borrowed a connection from an exhausted pool.')
+        except HypervisorPoolException:
+            pass
+        assert time.time() - wait_start >= 0.5, 'Borrowing did not wait for the timeout.'
+
+        # The shared connection is still available, and can be used by several threads at once.
+        with test_pool.borrow_shared() as shared, test_pool.borrow_shared() as shared_again:
+            assert shared is shared_again
+            shared.listAllDomains(0)
+    assert test_pool.available.qsize() == 2, 'Connections were not returned to the pool.'
+
+    # Reconnect: a call that fails because the connection broke is retried once, on a new connection.
+    failures = [_make_connection_error()]
+
+    def fail_once(connection):
+        if failures:
+            raise failures.pop()
+        return connection.listAllDomains(0)
+
+    with test_pool.borrow() as hypervisor:
+        hypervisor.listAllDomains(0)
+        broken_connection = hypervisor.connection
+        reconnects = hypervisor.num_reconnects
+        hypervisor._call_with_connection('listAllDomains', fail_once)
+        assert hypervisor.num_reconnects == reconnects + 1, 'Broken connection was not replaced.'
+        assert hypervisor.connection is not broken_connection, 'Broken connection is still used.'
+
+    def list_domains():
+        for i in range(50):
+            with test_pool.borrow() as hypervisor:
+                hypervisor.listAllDomains(0)
+
+    threads = [threading.Thread(target=list_domains) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print test_pool.get_stats()
@@ -76,6 +76,19 @@ class VirtualMachineDescriptor(object):
             name = matches.group(1)
         return name
 
+    ################################################################################################################
+    # Gets the VNC port from a raw xml descriptor string, without parsing it. Returns None if it was not found.
+    ################################################################################################################
+    @staticmethod
+    def get_raw_vnc_port(xml_string):
+        port = None
+        graphics_matches = re.search(r"<graphics\s[^>]*type=['\"]vnc['\"][^>]*>", xml_string)
+        if graphics_matches:
+            port_matches = re.search(r"\sport=['\"](-?\d+)['\"]", graphics_matches.group(0))
+            if port_matches:
+                port = port_matches.group(1)
+        return port
+
     ################################################################################################################
     # Updates the name and id of an xml by simply replacing the text, without parsing, to ensure the result will
     # have exactly the same length as before.
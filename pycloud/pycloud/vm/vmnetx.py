@@ -63,7 +63,10 @@ class LibvirtQemuMemoryHeader(object):
     XML_END_ALIGNMENT = 4 << 10   # QEMU_MONITOR_MIGRATE_TO_FILE_BS
 
     COMPRESS_RAW = 0
+    COMPRESS_GZIP = 1
+    COMPRESS_BZIP2 = 2
     COMPRESS_XZ = 3
+    COMPRESS_LZOP = 4
 
     # pylint is confused by "\0", #111799
     # pylint: disable=W1401
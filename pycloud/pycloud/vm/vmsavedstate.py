@@ -32,11 +32,24 @@
 # Used to handle paths more easily.
 import os.path
 
+# Used to convert between formats.
+import os
+import shutil
+import subprocess
+
 # Used to modify UUID of a saved VM.
 import vmnetx
 
 from vmutils import VirtualMachine
-        
+
+################################################################################################################
+# Exception type used when handling saved states.
+################################################################################################################
+class VMSavedStateException(Exception):
+    def __init__(self, message):
+        super(VMSavedStateException, self).__init__(message)
+        self.message = message
+
 ################################################################################################################
 # Represents a saved image of a VM state, including a memory image.
 ################################################################################################################
@@ -44,6 +57,15 @@ class VMSavedState(object):
     
     # Extension for memory files. Since now we are using Libvirt Qemu Save images, we will use the lqs extension.
     SAVED_VM_FILE_EXTENSION = '.lqs'    
+
+    # Formats the memory image can be stored in, with their code in the libvirt header and the program used to
+    # compress to them. libvirt will use the same program to decompress them when restoring.
+    FORMAT_RAW = 'raw'
+    FORMATS = {FORMAT_RAW: (vmnetx.LibvirtQemuMemoryHeader.COMPRESS_RAW, None),
+               'gzip': (vmnetx.LibvirtQemuMemoryHeader.COMPRESS_GZIP, 'gzip'),
+               'bzip2': (vmnetx.LibvirtQemuMemoryHeader.COMPRESS_BZIP2, 'bzip2'),
+               'xz': (vmnetx.LibvirtQemuMemoryHeader.COMPRESS_XZ, 'xz'),
+               'lzop': (vmnetx.LibvirtQemuMemoryHeader.COMPRESS_LZOP, 'lzop')}
     
     ################################################################################################################
     # Sets up internal values of the VM state image.
@@ -114,3 +136,143 @@ class VMSavedState(object):
             #print('\nNew:' + newXmlDescriptorString + '\n')
             hdr.xml = newXmlDescriptorString
             hdr.write(savedStateFileStream)
+
+    ################################################################################################################
+    # Returns the name of the format the memory image is stored in.
+    ################################################################################################################
+    def getFormat(self):
+        with open(self.savedStateFilename, 'r') as savedStateFileStream:
+            hdr = vmnetx.LibvirtQemuMemoryHeader(savedStateFileStream)
+        for formatName, (formatCode, program) in VMSavedState.FORMATS.iteritems():
+            if formatCode == hdr.compressed:
+                return formatName
+        raise VMSavedStateException('Unknown saved state format {}'.format(hdr.compressed))
+
+    ################################################################################################################
+    # Converts the memory image to the given format, if it is not already in it. The header is kept uncompressed,
+    # as libvirt expects.
+    ################################################################################################################
+    def convertFormat(self, newFormat):
+        if newFormat not in VMSavedState.FORMATS:
+            raise VMSavedStateException('Unknown saved state format {}'.format(newFormat))
+        currentFormat = self.getFormat()
+        if currentFormat == newFormat:
+            return
+
+        print 'Converting saved state {} from {} to {}'.format(self.savedStateFilename, currentFormat, newFormat)
+        decompressProgram = VMSavedState.FORMATS[currentFormat][1]
+        compressProgram = VMSavedState.FORMATS[newFormat][1]
+        tempFilename = self.savedStateFilename + '.tmp'
+        try:
+            with open(self.savedStateFilename, 'rb') as sourceStream, open(tempFilename, 'wb') as destinationStream:
+                hdr = vmnetx.LibvirtQemuMemoryHeader(sourceStream)
+                hdr.compressed = VMSavedState.FORMATS[newFormat][0]
+                hdr.write(destinationStream)
+                destinationStream.flush()
+                hdr.seek_body(sourceStream)
+
+                if not decompressProgram and not compressProgram:
+                    shutil.copyfileobj(sourceStream, destinationStream)
+                else:
+                    # Pipe the body through the programs. It is fed from here, since they would read the source file
+                    # from its start otherwise, and the last one writes directly to the destination file.
+                    processes = []
+                    if decompressProgram:
+                        processes.append(subprocess.Popen([decompressProgram, '-dc'], stdin=subprocess.PIPE,
+                                                          stdout=subprocess.PIPE if compressProgram else destinationStream))
+                    if compressProgram:
+                        processes.append(subprocess.Popen([compressProgram, '-c'],
+                                                          stdin=processes[0].stdout if processes else subprocess.PIPE,
+                                                          stdout=destinationStream))
+                        if len(processes) > 1:
+                            processes[0].stdout.close()
+
+                    try:
+                        shutil.copyfileobj(sourceStream, processes[0].stdin)
+                    finally:
+                        processes[0].stdin.close()
+                    for process in processes:
+                        if process.wait() != 0:
+                            raise VMSavedStateException('Error converting saved state to {}.'.format(newFormat))
+
+            shutil.copymode(self.savedStateFilename, tempFilename)
+            os.rename(tempFilename, self.savedStateFilename)
+        finally:
+            if os.path.exists(tempFilename):
+                os.remove(tempFilename)
+
+################################################################################################################
+# Functions to test the class.
+################################################################################################################
+
+################################################################################################################
+# Get the command line arguments.
+################################################################################################################
+import argparse
+def get_args():
+    parser = argparse.ArgumentParser(description='Benchmark saved state formats.')
+    parser.add_argument('-stateImage', required=True, action='store', help='A saved state file.')
+    parser.add_argument('-diskImage', required=True, action='store', help='The disk image of the saved VM.')
+    parser.add_argument('-formats', default=','.join(sorted(VMSavedState.FORMATS)), action='store',
+                        help='Comma separated formats to test.')
+    parser.add_argument('-repetitions', type=int, default=3, action='store', help='Restores per format.')
+    parser.add_argument('-uri', default='qemu:///system', action='store', help='libvirt URI.')
+    parsedArguments = parser.parse_args()
+    return parsedArguments
+
+################################################################################################################
+# Command line benchmark: converts a copy of the saved state to each format, and measures its size, the conversion
+# time, and how long libvirt takes to restore a VM from it with a cold page cache. The VM is restored on a
+# temporary overlay of the disk image, so the original image is not modified.
+################################################################################################################
+def benchmarkFormats():
+    import tempfile
+    import time
+    import uuid
+    import libvirt
+    from qcowdiskimage import Qcow2DiskImage
+    from virtualmachinedescriptor import VirtualMachineDescriptor
+    from pycloud.pycloud.utils import fileutils
+
+    parsedArguments = get_args()
+    hypervisor = libvirt.open(parsedArguments.uri)
+    workFolder = tempfile.mkdtemp()
+    try:
+        overlayImage = Qcow2DiskImage(os.path.join(workFolder, 'disk'))
+        overlayImage.linkToBackingFile(parsedArguments.diskImage)
+
+        print '{:>8} {:>14} {:>12} {:>12}'.format('format', 'size (bytes)', 'convert (s)', 'restore (s)')
+        for formatName in parsedArguments.formats.split(','):
+            stateCopy = os.path.join(workFolder, 'state-' + formatName + VMSavedState.SAVED_VM_FILE_EXTENSION)
+            shutil.copyfile(VMSavedState.getCorrectFilepath(parsedArguments.stateImage), stateCopy)
+            savedState = VMSavedState(stateCopy)
+
+            startTime = time.time()
+            savedState.convertFormat(formatName)
+            convertTime = time.time() - startTime
+
+            # Give the VM its own identity and disk, so that it does not clash with running ones.
+            vmId = str(uuid.uuid4())
+            descriptor = VirtualMachineDescriptor(savedState.getRawStoredVmDescription())
+            descriptor.setUuid(vmId)
+            descriptor.setName('benchmark-' + formatName)
+            descriptor.setDiskImage(overlayImage.filepath, 'qcow2')
+            descriptor.removeSecLabel()
+            xmlString = descriptor.getAsString()
+            savedState.updateStoredVmDescription(xmlString)
+
+            restoreTimes = []
+            for repetition in range(parsedArguments.repetitions):
+                fileutils.fadvise(stateCopy, fileutils.POSIX_FADV_DONTNEED)
+                startTime = time.time()
+                hypervisor.restoreFlags(stateCopy, xmlString, libvirt.VIR_DOMAIN_SAVE_PAUSED)
+                restoreTimes.append(time.time() - startTime)
+                hypervisor.lookupByUUIDString(vmId).destroy()
+
+            print '{:>8} {:>14} {:>12.2f} {:>12.2f}'.format(formatName, os.path.getsize(stateCopy), convertTime,
+                                                           sum(restoreTimes) / len(restoreTimes))
+    finally:
+        shutil.rmtree(workFolder)
+
+if __name__ == '__main__':
+    benchmarkFormats()
@@ -30,13 +30,15 @@ __author__ = 'jdroot'
 
 import libvirt
 
+from pycloud.pycloud.vm.hypervisorpool import get_hypervisor_pool, HypervisorPoolException
+
 QEMU_URI_PREFIX = "qemu://"
 QEMU_URI_TCP_PREFIX = "tcp://"
 SYSTEM_LIBVIRT_DAEMON_SUFFIX = "/system"
 SESSION_LIBVIRT_DAEMON_SUFFIX = "/session"
 
-# Global connection object, only open connection to local hypervisor used by app.
-_hypervisor = None
+# Max speed given to libvirt for migrations and saves without a bandwidth cap, in MiB/s.
+UNLIMITED_BANDWIDTH = 1000000
 
 
 ################################################################################################################
@@ -49,7 +51,10 @@ class VirtualMachineException(Exception):
 
 
 ################################################################################################################
-#
+# A domain in the local hypervisor, identified by its UUID. Each operation borrows a connection from the pool and
+# looks the domain up through it, so that it is limited, timed and reconnected like any other call to the hypervisor.
+# Long operations (saves, restores and migrations) use the pool's shared connection instead, so they don't hold a
+# pooled connection for minutes.
 ################################################################################################################
 class VirtualMachine(object):
 
@@ -57,17 +62,28 @@ class VirtualMachine(object):
     #
     ################################################################################################################
     def __init__(self):
-        self.vm = None
+        self.uuid = None
 
     ################################################################################################################
-    # Returns the hypervisor connection and will auto connect if the connection is null.
+    # Lends a connection to the local hypervisor from the pool, to be used in a with block. Long calls get the shared
+    # connection.
     ################################################################################################################
     @staticmethod
-    def _get_hypervisor(is_system_level=True):
-        global _hypervisor
-        if _hypervisor is None:
-            _hypervisor = VirtualMachine.connect_to_hypervisor(is_system_level)
-        return _hypervisor
+    def _borrow_hypervisor(long_call=False):
+        if long_call:
+            return get_hypervisor_pool().borrow_shared()
+        return get_hypervisor_pool().borrow()
+
+    ################################################################################################################
+    # Calls a method of the domain through a connection borrowed from the pool, or through the shared one if given
+    # long_call=True.
+    ################################################################################################################
+    def _call_domain(self, name, *args, **kwargs):
+        try:
+            with VirtualMachine._borrow_hypervisor(kwargs.get('long_call', False)) as hypervisor:
+                return hypervisor.call_domain(self.uuid, name, *args)
+        except (libvirt.libvirtError, HypervisorPoolException), e:
+            raise VirtualMachineException(str(e))
 
     ################################################################################################################
     # Returns the hypervisor connection.
@@ -106,27 +122,59 @@ class VirtualMachine(object):
     ################################################################################################################
     def connect_to_virtual_machine(self, uuid):
         try:
-            self.vm = VirtualMachine._get_hypervisor().lookupByUUIDString(uuid)
-        except libvirt.libvirtError, e:
+            with VirtualMachine._borrow_hypervisor() as hypervisor:
+                hypervisor.lookupByUUIDString(uuid)
+            self.uuid = uuid
+        except (libvirt.libvirtError, HypervisorPoolException), e:
             raise VirtualMachineException(str(e))
 
     ################################################################################################################
-    # Get the XML description of a running VM.
+    # Returns the UUIDs of all domains currently defined or running in the hypervisor, with a single call.
     ################################################################################################################
-    def get_running_vm_xml_string(self):
+    @staticmethod
+    def get_all_domain_uuids():
+        return VirtualMachine.get_all_virtual_machines().keys()
+
+    ################################################################################################################
+    # Returns a dict of UUID to VirtualMachine for all domains in the hypervisor, with a single call.
+    ################################################################################################################
+    @staticmethod
+    def get_all_virtual_machines():
         try:
-            return self.vm.XMLDesc(libvirt.VIR_DOMAIN_XML_SECURE)
-        except libvirt.libvirtError, e:
+            with VirtualMachine._borrow_hypervisor() as hypervisor:
+                domains = hypervisor.listAllDomains(0)
+
+            virtual_machines = {}
+            for domain in domains:
+                virtual_machine = VirtualMachine()
+                virtual_machine.uuid = domain.UUIDString()
+                virtual_machines[virtual_machine.uuid] = virtual_machine
+            return virtual_machines
+        except (libvirt.libvirtError, HypervisorPoolException), e:
             raise VirtualMachineException(str(e))
 
+    ################################################################################################################
+    # Returns the total CPU time used by the VM so far, in nanoseconds, and its amount of virtual CPUs.
+    ################################################################################################################
+    def get_cpu_time(self):
+        info = self._call_domain('info')
+        return info[4], info[3]
+
+    ################################################################################################################
+    # Get the XML description of a running VM.
+    ################################################################################################################
+    def get_running_vm_xml_string(self):
+        return self._call_domain('XMLDesc', libvirt.VIR_DOMAIN_XML_SECURE)
+
     ################################################################################################################
     # Get the XML description of a stored VM.
     ################################################################################################################
     @staticmethod
     def get_stored_vm_xml_string(saved_state_filename):
         try:
-            return VirtualMachine._get_hypervisor().saveImageGetXMLDesc(saved_state_filename, 0)
-        except libvirt.libvirtError, e:
+            with VirtualMachine._borrow_hypervisor() as hypervisor:
+                return hypervisor.saveImageGetXMLDesc(saved_state_filename, 0)
+        except (libvirt.libvirtError, HypervisorPoolException), e:
             raise VirtualMachineException(str(e))
 
     ################################################################################################################
@@ -134,24 +182,22 @@ class VirtualMachine(object):
     ################################################################################################################
     def create_and_start_vm(self, xml_descriptor):
         try:
-            self.vm = VirtualMachine._get_hypervisor().createXML(xml_descriptor, 0)
-        except libvirt.libvirtError, e:
+            with VirtualMachine._borrow_hypervisor() as hypervisor:
+                self.uuid = hypervisor.createXML(xml_descriptor, 0).UUIDString()
+        except (libvirt.libvirtError, HypervisorPoolException), e:
             raise VirtualMachineException(str(e))
 
     ################################################################################################################
     # Save the state of the give VM to the indicated file.
     ################################################################################################################
     def save_state(self, vm_state_image_file):
-        try:
-            # We indicate that we want want to use as much bandwidth as possible to store the VM's memory when suspending.
-            unlimited_bandwidth = 1000000
-            self.vm.migrateSetMaxSpeed(unlimited_bandwidth, 0)
+        # Saves go to a local file, so we use as much bandwidth as possible to store the VM's memory. Migrations
+        # set their own max speed when they start, so this does not affect them.
+        self.set_migration_max_speed(None)
 
-            result = self.vm.save(vm_state_image_file)
-            if result != 0:
-                raise VirtualMachineException("Cannot save memory state to file {}".format(vm_state_image_file))
-        except libvirt.libvirtError, e:
-            raise VirtualMachineException(str(e))
+        result = self._call_domain('save', vm_state_image_file, long_call=True)
+        if result != 0:
+            raise VirtualMachineException("Cannot save memory state to file {}".format(vm_state_image_file))
 
     ################################################################################################################
     #
@@ -159,64 +205,95 @@ class VirtualMachine(object):
     @staticmethod
     def restore_saved_vm(saved_state_filename, updated_xml_descriptor):
         try:
-            VirtualMachine._get_hypervisor().restoreFlags(saved_state_filename, updated_xml_descriptor,
-                                                          libvirt.VIR_DOMAIN_SAVE_RUNNING)
-        except libvirt.libvirtError as e:
+            with VirtualMachine._borrow_hypervisor(long_call=True) as hypervisor:
+                hypervisor.restoreFlags(saved_state_filename, updated_xml_descriptor, libvirt.VIR_DOMAIN_SAVE_RUNNING)
+        except (libvirt.libvirtError, HypervisorPoolException) as e:
             raise VirtualMachineException(str(e))
 
     ################################################################################################################
     #
     ################################################################################################################
     def pause(self):
-        try:
-            result = self.vm.suspend()
-            was_suspend_successful = result == 0
-            return was_suspend_successful
-        except libvirt.libvirtError, e:
-            raise VirtualMachineException(str(e))
+        result = self._call_domain('suspend')
+        was_suspend_successful = result == 0
+        return was_suspend_successful
 
     ################################################################################################################
     #
     ################################################################################################################
     def unpause(self):
-        try:
-            result = self.vm.resume()
-            was_resume_successful = result == 0
-            return was_resume_successful
-        except libvirt.libvirtError, e:
-            raise VirtualMachineException(str(e))
+        result = self._call_domain('resume')
+        was_resume_successful = result == 0
+        return was_resume_successful
 
     ################################################################################################################
     #
     ################################################################################################################
     def destroy(self):
-        try:
-            self.vm.destroy()
-        except libvirt.libvirtError, e:
-            raise VirtualMachineException(str(e))
+        self._call_domain('destroy')
 
     ################################################################################################################
-    #
+    # Sets the max speed at which the memory of the VM is sent by migrations and saves, in bytes per second; None
+    # removes the limit. Can be called while a migration is running.
     ################################################################################################################
-    def perform_memory_migration(self, remote_host, p2p=False):
+    def set_migration_max_speed(self, max_rate):
+        if max_rate:
+            bandwidth = max(1, int(round(float(max_rate) / (1024 * 1024))))
+        else:
+            bandwidth = UNLIMITED_BANDWIDTH
+
+        self._call_domain('migrateSetMaxSpeed', bandwidth, 0)
+
+    ################################################################################################################
+    # Returns the progress of the job running on the VM, such as a migration, as the bytes processed, remaining and in
+    # total. All are 0 if no job is running.
+    ################################################################################################################
+    def get_job_progress(self):
+        info = self._call_domain('jobInfo')
+        return info[4], info[5], info[3]
+
+    ################################################################################################################
+    # Migrates the memory and state of the VM to a remote host, sending it at most at max_rate bytes per second if
+    # given.
+    ################################################################################################################
+    def perform_memory_migration(self, remote_host, p2p=False, streams=1, max_rate=None):
         # Prepare basic flags. Bandwidth 0 lets libvirt choose the best value
         # (and some hypervisors do not support it anyway).
         flags = 0
         new_id = None
         bandwidth = 0
 
+        # Memory can be sent over several connections where libvirt supports it, but not through a tunnel.
+        parallel = streams > 1 and not p2p and hasattr(libvirt, 'VIR_MIGRATE_PARALLEL')
+
         if p2p:
             flags = flags | libvirt.VIR_MIGRATE_PEER2PEER | libvirt.VIR_MIGRATE_TUNNELLED
             uri = None
         else:
             uri = VirtualMachine._get_qemu_libvirt_tcp_connection_uri(host_name=remote_host)
 
+        self.set_migration_max_speed(max_rate)
+
+        # Migrate the state and memory (note that have to connect to the system-level libvirtd on the remote host).
+        remote_hypervisor = VirtualMachine.connect_to_hypervisor(is_system_level=True, host_name=remote_host)
         try:
-            # Migrate the state and memory (note that have to connect to the system-level libvirtd on the remote host).
-            remote_hypervisor = VirtualMachine.connect_to_hypervisor(is_system_level=True, host_name=remote_host)
-            self.vm.migrate(remote_hypervisor, flags, new_id, uri, bandwidth)
-        except libvirt.libvirtError, e:
-            raise VirtualMachineException(str(e))
+            if parallel:
+                params = {libvirt.VIR_MIGRATE_PARAM_URI: uri,
+                          libvirt.VIR_MIGRATE_PARAM_PARALLEL_CONNECTIONS: streams}
+                try:
+                    self._call_domain('migrate3', remote_hypervisor, params, flags | libvirt.VIR_MIGRATE_PARALLEL,
+                                      long_call=True)
+                    return
+                except VirtualMachineException:
+                    # One of the hypervisors does not support it; the VM is still here, so use a single connection.
+                    pass
+
+            self._call_domain('migrate', remote_hypervisor, flags, new_id, uri, bandwidth, long_call=True)
+        finally:
+            try:
+                remote_hypervisor.close()
+            except libvirt.libvirtError:
+                pass
 
 
 ################################################################################################################